@@ -1,12 +1,35 @@
 import os
 import requests
 import base64
-import boto3
-from flask import Flask, render_template, request, jsonify
+import copy
+import hmac
+import json
+from flask import Flask, Response, g, render_template, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import logging
 from botocore.exceptions import BotoCoreError, ClientError
 import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import dialogue
+from asis_index import index_version, open_index, parse_timestamp
+from audio_cache import AudioCache, cache_key
+from audio_formats import DEFAULT_FORMAT, format_for_extension, negotiate_request
+from batch_synth import ITEM_OPTIONS, BatchJob, create_job, job_status
+from engine_health import CLOSED, HALF_OPEN, EngineHealth
+from intake_log import IntakeLog
+from metrics import metrics
+from polly_client import PollyClientFactory
+from prefetch import Prefetcher
+from scheduler import PreviewScheduler, SchedulePolicy, create_scheduler, load_lawyers
+from session_store import SESSION_FIELDS, create_session_store
+from speech_pipeline import pipelined, split_sentences
+from ssml import add_natural_pauses, create_generative_ssml, create_ssml_text, improve_pronunciation
+from template_splice import SPLICEABLE_FORMATS, TemplateSplicer, clean_segment, splice, spliced_cache_key
+from warmup import start_background_warmup, warm_up
 
 app = Flask(__name__)
 CORS(app)
@@ -19,99 +42,604 @@ AWS_ACCESS_KEY = os.environ.get("AWS_ACCESS_KEY")
 AWS_SECRET_KEY = os.environ.get("AWS_SECRET_KEY")
 AWS_REGION = os.environ.get("AWS_REGION", "us-east-1")
 
-# DEBUG: Verificar configuración AWS
+# Cliente Polly compartido por el proceso (pool de conexiones reutilizable)
+polly_clients = PollyClientFactory.from_env(AWS_REGION, AWS_ACCESS_KEY, AWS_SECRET_KEY)
+
+# Voz y cadena de motores de Polly (de mejor a más compatible)
+POLLY_VOICE = 'Lupe'
+ENGINE_CHAIN = ('generative', 'neural', 'standard')
+
+# Salud de cada motor: tras varios errores seguidos se salta (circuit breaker)
+engine_health = EngineHealth(
+    ENGINE_CHAIN,
+    failure_threshold=int(os.environ.get("ENGINE_FAILURE_THRESHOLD", 3)),
+    cooldown=float(os.environ.get("ENGINE_COOLDOWN_SECONDS", 60))
+)
+
+# Tamaño de los trozos de audio en las respuestas en streaming
+STREAM_CHUNK_SIZE = 8192
+
+# Pool de hilos para sintetizar frases en paralelo (modo pipeline)
+synthesis_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("SYNTHESIS_WORKERS", 8)),
+                                    thread_name_prefix='polly')
+PIPELINE_WINDOW = int(os.environ.get("PIPELINE_WINDOW", 4))
+
+# Caché de audio sintetizado (memoria + disco compartido entre workers)
+audio_cache = AudioCache(
+    max_memory_bytes=int(os.environ.get("AUDIO_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    disk_dir=os.environ.get("AUDIO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sofia-audio-cache")),
+    max_disk_bytes=int(os.environ.get("AUDIO_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024)),
+    disk_ttl=int(os.environ.get("AUDIO_CACHE_DISK_TTL_SECONDS", 24 * 3600))
+)
+
+# Registro de intakes: instantánea de los datos recogidos en cada turno que los cambia
+intake_log = IntakeLog(
+    os.environ.get("INTAKE_LOG_DIR", os.path.join(tempfile.gettempdir(), "sofia-intakes")),
+    fsync=os.environ.get("INTAKE_LOG_FSYNC", "true").lower() in ('1', 'true', 'yes'),
+    retention_days=float(os.environ.get("INTAKE_LOG_RETENTION_DAYS", 30))
+)
+
+# Síntesis por lotes: solo con BATCH_API_TOKEN (cada lote consume cuota de Polly)
+BATCH_DIR = os.environ.get("BATCH_DIR", os.path.join(tempfile.gettempdir(), "sofia-batch"))
+BATCH_API_TOKEN = os.environ.get("BATCH_API_TOKEN")
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 4))
+BATCH_RATE = float(os.environ.get("BATCH_RATE", 8))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 10000))
+BATCH_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+batch_jobs = {}
+batch_jobs_lock = threading.Lock()
+
+# Historial de llamantes: hojas tipo ASIS.txt indexadas con asis_index.py (solo con CALLER_API_TOKEN)
+ASIS_INDEX_DIR = os.environ.get("ASIS_INDEX_DIR")
+CALLER_API_TOKEN = os.environ.get("CALLER_API_TOKEN")
+CALLER_MAX_RESULTS = int(os.environ.get("CALLER_MAX_RESULTS", 1000))
+asis_index = None
+asis_index_lock = threading.Lock()
+# Índices reemplazados por una reconstrucción: (índice, retirado en); se cierran
+# pasado ASIS_RETIRE_SECONDS para no cortar las peticiones que aún los usan
+asis_retired = []
+ASIS_RETIRE_SECONDS = 30
+
+# Audio servido por id en /api/audio/<id> (el id es la clave de la caché)
+AUDIO_ID_PATTERN = re.compile(r'[0-9a-f]{64}')
+AUDIO_MAX_AGE = int(os.environ.get("AUDIO_MAX_AGE_SECONDS", 24 * 60 * 60))
+
+# Estado de conversación por sesión (SESSION_BACKEND=sqlite para varios workers)
+SESSION_COOKIE = 'sofia_session'
+SESSION_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{8,64}')
+sessions = create_session_store(
+    backend=os.environ.get("SESSION_BACKEND", "memory"),
+    ttl=int(os.environ.get("SESSION_TTL_SECONDS", 30 * 60)),
+    path=os.environ.get("SESSION_DB_PATH", os.path.join(tempfile.gettempdir(), "sofia-sessions.db"))
+)
+
+# Agenda de citas: horarios por abogado y categoría (sqlite para varios workers)
+scheduler = create_scheduler(
+    backend=os.environ.get("SCHEDULER_BACKEND", os.environ.get("SESSION_BACKEND", "memory")),
+    path=os.environ.get("SCHEDULER_DB_PATH", os.path.join(tempfile.gettempdir(), "sofia-schedule.db")),
+    lawyers=load_lawyers(os.environ.get("SCHEDULER_LAWYERS")),
+    policy=SchedulePolicy(timezone=os.environ.get("SCHEDULER_TIMEZONE", "America/Bogota")),
+    hold_ttl=int(os.environ.get("SCHEDULER_HOLD_SECONDS", 5 * 60))
+)
+
+# Síntesis especulativa de la siguiente respuesta mientras el usuario habla.
+# Desactivada por defecto: gasta llamadas a Polly que pueden no usarse y el
+# audio adelantado es por proceso, así que solo acierta si el /api/speak llega
+# al mismo worker (un worker o sesiones fijas por worker)
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "false").lower() in ('1', 'true', 'yes')
+
+# Respuestas personalizadas montadas con las partes fijas de su plantilla (template_splice.py)
+TEMPLATE_SPLICING = os.environ.get("TEMPLATE_SPLICING", "true").lower() in ('1', 'true', 'yes')
+splicer = TemplateSplicer(dialogue.reply_templates())
+
+GENERATIVE_TEST_TEXT = "Hola, esta es una prueba del motor generativo."
+
+# Textos que el warm-up sintetiza al arrancar (con las partes fijas de las plantillas)
+STATIC_PROMPTS = dialogue.static_prompts() + splicer.static_segments() + (GENERATIVE_TEST_TEXT,)
+
+# Configuración AWS: se registra una vez al arrancar, no en cada petición
+app.logger.info(f"AWS_ACCESS_KEY configured: {bool(AWS_ACCESS_KEY)}")
+app.logger.info(f"AWS_SECRET_KEY configured: {bool(AWS_SECRET_KEY)}")
+app.logger.info(f"AWS_REGION: {AWS_REGION}")
+
+# Métricas de latencia por endpoint y por etapa (expuestas en /api/metrics)
+metrics.describe('http_requests_total', 'Peticiones HTTP atendidas')
+metrics.describe('http_request_duration_seconds', 'Duración de las peticiones HTTP')
+metrics.describe('stage_duration_seconds', 'Duración de cada etapa de la síntesis')
+metrics.describe('synthesis_total', 'Síntesis servidas por motor')
+metrics.describe('engine_fallbacks_total', 'Fallos de un motor que pasaron al siguiente de la cadena')
+metrics.describe('audio_cache_hits_total', 'Aciertos de la caché de audio por nivel')
+metrics.describe('audio_cache_misses_total', 'Fallos de la caché de audio')
+metrics.describe('audio_cache_memory_bytes', 'Bytes de audio en la caché en memoria')
+metrics.describe('engine_circuit_state', 'Circuito de cada motor (0 cerrado, 1 semiabierto, 2 abierto)')
+metrics.describe('active_sessions', 'Sesiones de conversación activas')
+metrics.describe('intake_records_total', 'Instantáneas de intakes escritas o descartadas')
+metrics.describe('intake_log_queued', 'Instantáneas de intakes pendientes de escribir')
+metrics.describe('prefetch_total', 'Respuestas sintetizadas por adelantado según su resultado')
+
+CIRCUIT_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1}
+
+def collect_runtime_metrics():
+    """Métricas leídas al exportar: caché de audio, motores y sesiones"""
+    cache_stats = audio_cache.stats()
+    yield 'audio_cache_hits_total', 'counter', {'tier': 'memory'}, cache_stats['memory_hits']
+    yield 'audio_cache_hits_total', 'counter', {'tier': 'disk'}, cache_stats['disk_hits']
+    yield 'audio_cache_misses_total', 'counter', {}, cache_stats['misses']
+    yield 'audio_cache_memory_bytes', 'gauge', {}, cache_stats['memory_bytes']
+    for engine, snapshot in engine_health.snapshot().items():
+        yield 'engine_circuit_state', 'gauge', {'engine': engine}, CIRCUIT_STATE_VALUES.get(snapshot['state'], 2)
+    yield 'active_sessions', 'gauge', {}, sessions.stats()['active_sessions']
+    intake_stats = intake_log.stats()
+    yield 'intake_records_total', 'counter', {'result': 'written'}, intake_stats['written']
+    yield 'intake_records_total', 'counter', {'result': 'dropped'}, intake_stats['dropped']
+    yield 'intake_log_queued', 'gauge', {}, intake_stats['queued']
+    prefetch_stats = prefetcher.stats()
+    for result in ('hits', 'misses', 'wasted', 'dropped'):
+        yield 'prefetch_total', 'counter', {'result': result}, prefetch_stats[result]
+
+metrics.register_collector(collect_runtime_metrics)
+
 @app.before_request
-def log_aws_config():
-    app.logger.info(f"AWS_ACCESS_KEY configured: {bool(AWS_ACCESS_KEY)}")
-    app.logger.info(f"AWS_SECRET_KEY configured: {bool(AWS_SECRET_KEY)}")
-    app.logger.info(f"AWS_REGION: {AWS_REGION}")
-
-def improve_pronunciation(text):
-    """Mejora la pronunciación de texto legal con énfasis en palabras clave"""
-    # Palabras legales que necesitan mejor pronunciación
-    improvements = {
-        'abogada': 'abogáda',
-        'legal': 'legál',
-        'cliente': 'clienté',
-        'proceso': 'procéso',
-        'judicial': 'judiciál',
-        'documento': 'documentó',
-        'contrato': 'contráto',
-        'custodia': 'custódia',
-        'pensión': 'pensión',
-        'alimentaria': 'alimentária',
-        'herencia': 'heréncia',
-        'testamento': 'testaménto',
-        'demanda': 'demánda',
-        'juzgado': 'juzgádo',
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Regla de la ruta (no la URL) para no crear una serie por texto o id
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = {'endpoint': endpoint, 'method': request.method, 'status': response.status_code}
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started, **labels)
+        metrics.inc('http_requests_total', **labels)
+    return response
+
+def build_synthesis_request(text, engine, audio_format=None):
+    """Parámetros de synthesize_speech para cada motor de la cadena de fallback"""
+    with metrics.timer('stage_duration_seconds', stage='ssml_build', engine=engine):
+        params = _synthesis_params(text, engine)
+    if audio_format is not None:
+        audio_format.apply(params)
+    return params
+
+def _synthesis_params(text, engine):
+    if engine == 'generative':
+        # SSML optimizado para generativo, máxima calidad
+        return {
+            'Text': create_generative_ssml(text),
+            'TextType': 'ssml',
+            'OutputFormat': 'mp3',
+            'VoiceId': POLLY_VOICE,
+            'Engine': 'generative',
+            'LanguageCode': 'es-US',
+            'SampleRate': '24000'
+        }
+    if engine == 'neural':
+        # Motor neuronal para voz más natural
+        return {
+            'Text': create_ssml_text(text),
+            'TextType': 'ssml',
+            'OutputFormat': 'mp3',
+            'VoiceId': POLLY_VOICE,
+            'Engine': 'neural',
+            'LanguageCode': 'es-US'
+        }
+    # Motor estándar: texto plano
+    return {
+        'Text': text,
+        'OutputFormat': 'mp3',
+        'VoiceId': POLLY_VOICE
     }
+
+def synthesis_cache_key(params):
+    """Clave de caché para unos parámetros de synthesize_speech"""
+    return cache_key(params['Text'],
+                     params.get('Engine', 'standard'),
+                     params['VoiceId'],
+                     params.get('SampleRate'),
+                     params['OutputFormat'])
+
+def polly_synthesize(params, polly=None):
+    """Llamada a Polly sin pasar por la caché"""
+    polly = polly or polly_clients.get()
+    with metrics.timer('stage_duration_seconds', stage='polly_call', engine=params.get('Engine', 'standard')):
+        response = polly.synthesize_speech(**params)
+        return response['AudioStream'].read()
+
+def synthesize_cached(params, polly=None):
+    """Sintetiza con Polly pasando primero por la caché de audio"""
+    key = synthesis_cache_key(params)
+    audio_data = audio_cache.get(key)
+    if audio_data is not None:
+        return audio_data
     
-    for word, replacement in improvements.items():
-        text = text.replace(word, f"<emphasis level=\"moderate\">{word}</emphasis>")
+    audio_data = polly_synthesize(params, polly)
+    audio_cache.put(key, audio_data)
+    return audio_data
+
+def synthesize_to_cache(params, polly=None):
+    """Sintetiza (si hace falta) dejando el audio en la caché; devuelve su clave"""
+    key = synthesis_cache_key(params)
+    synthesize_cached(params, polly)
+    return key
+
+def iter_audio_chunks(audio_data):
+    """Trocea audio ya disponible (p. ej. de la caché) para enviarlo en streaming"""
+    for start in range(0, len(audio_data), STREAM_CHUNK_SIZE):
+        yield audio_data[start:start + STREAM_CHUNK_SIZE]
+
+def _stream_and_cache(key, audio_stream):
+    chunks = []
+    try:
+        for chunk in audio_stream.iter_chunks(STREAM_CHUNK_SIZE):
+            chunks.append(chunk)
+            yield chunk
+    finally:
+        audio_stream.close()
+    # Solo se llega aquí si el cliente recibió el audio completo
+    audio_cache.put(key, b''.join(chunks))
+
+def open_synthesis_stream(params, polly=None):
+    """Como synthesize_cached pero devuelve un iterador de trozos de audio.
+
+    Los errores de Polly se lanzan aquí (antes del primer trozo) para que la
+    cadena de fallback pueda probar el siguiente motor."""
+    key = synthesis_cache_key(params)
+    audio_data = audio_cache.get(key)
+    if audio_data is not None:
+        return iter_audio_chunks(audio_data)
     
-    return text
+    polly = polly or polly_clients.get()
+    # En streaming se mide hasta que Polly empieza a responder (primer byte)
+    with metrics.timer('stage_duration_seconds', stage='polly_call', engine=params.get('Engine', 'standard')):
+        response = polly.synthesize_speech(**params)
+    return _stream_and_cache(key, response['AudioStream'])
+
+def synthesize_with_fallback(text, synthesize=synthesize_cached, audio_format=None, build=build_synthesis_request,
+                             chain=ENGINE_CHAIN):
+    """Sintetiza recorriendo la cadena generativo -> neural -> estándar.
+
+    Los motores con el circuito abierto se saltan directamente. Devuelve
+    (resultado de synthesize, motor). Si todos los motores fallan relanza el
+    último error. audio_format (audio_formats.py) fija formato y frecuencia;
+    build(text, motor, audio_format) prepara lo que recibe synthesize. chain
+    limita los motores que se pueden usar."""
+    engines = engine_health.candidates(chain)
+    for engine in engines:
+        is_last = engine == engines[-1]
+        # La prueba de un circuito semiabierto se toma solo al intentar el motor;
+        # el último se intenta siempre para no dejar la petición sin audio
+        if not engine_health.acquire(engine) and not is_last:
+            continue
+        try:
+            app.logger.info(f"Sintetizando con motor {engine}...")
+            audio_data = synthesize(build(text, engine, audio_format))
+            app.logger.info(f"Audio sintetizado correctamente con motor {engine}")
+            engine_health.record_success(engine)
+            metrics.inc('synthesis_total', engine=engine)
+            return audio_data, engine
+        except (BotoCoreError, ClientError) as engine_error:
+            engine_health.record_failure(engine, engine_error)
+            if not is_last:
+                metrics.inc('engine_fallbacks_total', engine=engine)
+            if is_last:
+                raise
+            app.logger.warning(f"Motor {engine} falló: {engine_error}")
 
-def add_natural_pauses(text):
-    """Añade pausas naturales en el texto para mejor fluidez"""
-    # Pausas después de signos de puntuación
-    text = re.sub(r'([.!?])', r'\1<break time="500ms"/>', text)
+def spliced_audio(text, audio_format):
+    """Audio de una respuesta personalizada montado segmento a segmento.
+
+    Las partes fijas de la plantilla salen de la caché y solo los segmentos
+    con datos del usuario van a Polly. Devuelve (clave, audio, motor), con
+    el audio ya en la caché, o None si el texto no sale de una plantilla."""
+    if not TEMPLATE_SPLICING or audio_format.output_format not in SPLICEABLE_FORMATS:
+        return None
+    segments = splicer.segments(text)
+    if segments is None:
+        return None
     
-    # Pausas menores después de comas
-    text = re.sub(r'(,)', r'\1<break time="200ms"/>', text)
+    def build(text, engine, audio_format):
+        return [build_synthesis_request(segment, engine, audio_format) for segment in segments]
     
-    # Pausas en enumeraciones
-    text = re.sub(r'(:)', r'\1<break time="300ms"/>', text)
+    def synthesize(prepared):
+        # Clave propia del montaje: no coincide con la de una síntesis de la respuesta completa
+        key = spliced_cache_key(synthesis_cache_key(params) for params in prepared)
+        audio_data = audio_cache.get(key)
+        if audio_data is None:
+            with metrics.timer('stage_duration_seconds', stage='splice', engine=prepared[0].get('Engine', 'standard')):
+                audio_data = splice(prepared[0]['OutputFormat'], synthesis_pool.map(synthesize_cached, prepared))
+            audio_cache.put(key, audio_data)
+        return key, audio_data
     
-    return text
+    (key, audio_data), engine = synthesize_with_fallback(text, synthesize, audio_format, build)
+    return key, audio_data, engine
 
-def create_ssml_text(text):
-    """Crea texto SSML optimizado para voz natural"""
-    # Mejorar pronunciación
-    improved_text = improve_pronunciation(text)
+def batch_synthesis_request(item, options):
+    """Parámetros de synthesize_speech para una línea de un lote"""
+    settings = dict(options)
+    settings.update({name: item[name] for name in ITEM_OPTIONS if item.get(name)})
+    engine = settings.get('engine', ENGINE_CHAIN[0])
+    if engine not in ENGINE_CHAIN:
+        raise ValueError(f"Motor desconocido: {engine}")
     
-    # Añadir pausas naturales
-    text_with_pauses = add_natural_pauses(improved_text)
+    if settings.get('text_type') == 'ssml':
+        # SSML ya preparado (p. ej. una variante de /api/ssml-test): se envía tal cual
+        params = {'Text': item['text'], 'TextType': 'ssml', 'OutputFormat': 'mp3', 'VoiceId': POLLY_VOICE}
+        if engine != 'standard':
+            params['Engine'] = engine
+    else:
+        params = build_synthesis_request(item['text'], engine)
     
-    # Crear SSML con configuración optimizada
-    ssml = f"""
-    <speak>
-        <prosody rate="105%" pitch="+2%" volume="loud">
-            <amazon:effect name="drc">
-                <amazon:effect vocal-tract-length="+3%">
-                    {text_with_pauses}
-                </amazon:effect>
-            </amazon:effect>
-        </prosody>
-    </speak>
-    """
+    if settings.get('voice'):
+        params['VoiceId'] = settings['voice']
+    if settings.get('output_format'):
+        params['OutputFormat'] = settings['output_format']
+    if settings.get('sample_rate'):
+        params['SampleRate'] = str(settings['sample_rate'])
+    return params
+
+def create_batch_job(output_dir, options, polly=None, input_path=None, workers=None, rate=None):
+    """Lote de síntesis con las opciones por defecto dadas (ver batch_synth.py)"""
+    return BatchJob(output_dir,
+                    prepare=lambda item: batch_synthesis_request(item, options),
+                    key=synthesis_cache_key,
+                    synthesize=lambda params: synthesize_cached(params, polly),
+                    input_path=input_path,
+                    workers=workers or BATCH_WORKERS,
+                    rate=BATCH_RATE if rate is None else rate)
+
+def warm_up_audio(polly=None, max_workers=None):
+    """Sintetiza los mensajes fijos con cada motor de la cadena de fallback"""
+    def synthesize(text, engine):
+        return synthesize_cached(build_synthesis_request(text, engine), polly)
     
-    return ssml.strip()
+    return warm_up(STATIC_PROMPTS, synthesize, ENGINE_CHAIN,
+                   max_workers=max_workers or int(os.environ.get("AUDIO_WARMUP_WORKERS", 4)))
 
-def create_generative_ssml(text):
-    """Crea SSML optimizado específicamente para motor generativo"""
-    # Mejorar pronunciación
-    improved_text = improve_pronunciation(text)
+def pipelined_audio(text, audio_format=DEFAULT_FORMAT, session_id=None):
+    """Sintetiza frase a frase en paralelo; devuelve (trozos de audio, motor, frases).
+
+    Cada frase pasa por la caché por separado, así las frases compartidas
+    entre respuestas solo se sintetizan una vez. El motor lo decide la
+    primera frase y las demás lo mantienen: cambiar de motor a mitad cambiaría
+    la voz y la frecuencia de muestreo del stream (estándar va a 22050 Hz).
+    Los errores de la primera frase se propagan para que el llamador use su
+    fallback. Los trozos ya van codificados en audio_format."""
+    prefetched = prefetched_audio(session_id, text, audio_format)
+    if prefetched is not None:
+        _, audio_data, engine = prefetched
+        return audio_format.encode_stream(iter_audio_chunks(audio_data)), engine, 1
+    
+    # Las respuestas de plantilla se parten por sus segmentos: las partes fijas ya están en la caché
+    segments = (TEMPLATE_SPLICING and splicer.segments(text)) or split_sentences(text)
+    # Ogg Vorbis no se puede encadenar por frases: una sola síntesis del texto completo
+    if len(segments) <= 1 or audio_format.output_format not in SPLICEABLE_FORMATS:
+        chunks, engine = synthesize_with_fallback(text, open_synthesis_stream, audio_format)
+        return audio_format.encode_stream(chunks), engine, 1
+    
+    first_audio, engine = synthesize_with_fallback(segments[0], audio_format=audio_format)
     
-    # Añadir pausas naturales
-    text_with_pauses = add_natural_pauses(improved_text)
+    def synthesize(segment):
+        # Sin fallback a otro motor: si falla, el stream termina en la frase anterior
+        audio_data, _ = synthesize_with_fallback(segment, audio_format=audio_format, chain=(engine,))
+        return audio_data
     
-    # SSML simplificado para generativo (es más inteligente)
-    ssml = f"""
-    <speak>
-        <prosody rate="100%" pitch="+2%" volume="medium">
-            <amazon:auto-breaths volume="x-soft" frequency="medium">
-                {text_with_pauses}
-            </amazon:auto-breaths>
-        </prosody>
-    </speak>
-    """
+    results = pipelined(segments[1:], synthesize, synthesis_pool, window=PIPELINE_WINDOW)
     
-    return ssml.strip()
+    def chunks():
+        # Cada frase es un MP3 independiente: se encadenan solo sus tramas de audio
+        try:
+            yield from iter_audio_chunks(clean_segment(audio_format.output_format, first_audio))
+            for audio_data in results:
+                yield from iter_audio_chunks(clean_segment(audio_format.output_format, audio_data))
+        except Exception as e:
+            app.logger.error(f"Error sintetizando frase en pipeline: {e}")
+        finally:
+            results.close()
+    
+    return audio_format.encode_stream(chunks()), engine, len(segments)
+
+def pipelined_stream_response(text, audio_format=DEFAULT_FORMAT, session_id=None):
+    """Respuesta de audio sintetizando frase a frase en paralelo"""
+    chunks, engine, segments = pipelined_audio(text, audio_format, session_id)
+    headers = {'X-TTS-Engine': engine, 'Cache-Control': 'no-store'}
+    if segments > 1:
+        headers['X-TTS-Segments'] = str(segments)
+    return Response(stream_with_context(chunks), mimetype=audio_format.mimetype, headers=headers)
+
+def audio_stream_response(text, audio_format=DEFAULT_FORMAT, session_id=None):
+    """Respuesta de audio con transferencia chunked"""
+    ready = prefetched_audio(session_id, text, audio_format) or spliced_audio(text, audio_format)
+    if ready is not None:
+        _, audio_data, engine = ready
+        chunks = iter_audio_chunks(audio_data)
+    else:
+        chunks, engine = synthesize_with_fallback(text, open_synthesis_stream, audio_format)
+    return Response(stream_with_context(audio_format.encode_stream(chunks)),
+                    mimetype=audio_format.mimetype,
+                    headers={'X-TTS-Engine': engine, 'Cache-Control': 'no-store'})
+
+def get_session_id(data, cookies):
+    """Id de sesión de la petición: campo session_id, cookie o uno nuevo"""
+    session_id = data.get('session_id') or cookies.get(SESSION_COOKIE)
+    if session_id and SESSION_ID_PATTERN.fullmatch(session_id):
+        return session_id
+    return uuid.uuid4().hex
+
+def intake_record(state):
+    """Instantánea de un intake para el registro"""
+    return {
+        'intake_id': state.intake_id,
+        'session_id': state.session_id,
+        'ts': state.updated_at,
+        # Sin horarios libres la cita queda pendiente de una llamada: no está completo
+        'complete': state.appointment_time not in (None, dialogue.NO_SLOT_VALUE),
+        'needs_callback': state.appointment_time == dialogue.NO_SLOT_VALUE,
+        'stage': dialogue.current_state(state).name,
+        **{field: getattr(state, field) for field in SESSION_FIELDS}
+    }
+
+def speculative_synthesis(text, audio_format):
+    """Síntesis para el prefetch, fuera de la caché: (clave, audio, motor).
+
+    Devuelve None si el audio ya está en la caché: no hace falta adelantarlo."""
+    engine = engine_health.preferred(ENGINE_CHAIN)
+    if audio_cache.contains(synthesis_cache_key(build_synthesis_request(text, engine, audio_format))):
+        return None
+    
+    def synthesize(params):
+        return synthesis_cache_key(params), polly_synthesize(params)
+    
+    (key, audio_data), engine = synthesize_with_fallback(text, synthesize, audio_format)
+    return key, audio_data, engine
+
+def predict_replies(state):
+    """Respuestas probables del próximo turno, simuladas sin tocar la agenda"""
+    return dialogue.likely_replies(state, PreviewScheduler(scheduler))
+
+prefetcher = Prefetcher(
+    predict_replies,
+    speculative_synthesis,
+    max_workers=int(os.environ.get("PREFETCH_WORKERS", 2)),
+    ttl=int(os.environ.get("PREFETCH_TTL_SECONDS", 60)),
+    max_predictions=int(os.environ.get("PREFETCH_MAX_PREDICTIONS", 2)),
+    max_bytes=int(os.environ.get("PREFETCH_MAX_BYTES", 32 * 1024 * 1024))
+)
+
+def prefetched_audio(session_id, text, audio_format):
+    """Audio que el prefetch adelantó para este texto (y lo pasa a la caché), o None"""
+    if not session_id or not PREFETCH_ENABLED:
+        return None
+    prefetched = prefetcher.take(session_id, text, audio_format)
+    if prefetched is not None:
+        audio_cache.put(prefetched[0], prefetched[1])
+    return prefetched
+
+def request_audio_format(data, headers):
+    """Formato de audio de la petición; el por defecto si no es válido"""
+    try:
+        return negotiate_request(data, headers)
+    except ValueError:
+        return DEFAULT_FORMAT
+
+def chat_turn(session_id, message, audio_format=DEFAULT_FORMAT):
+    """Procesa un turno de conversación y devuelve el cuerpo de la respuesta.
+
+    audio_format es el formato en que se adelanta el audio del turno siguiente."""
+    state = sessions.load(session_id)
+    captured = state.to_dict()
+    
+    # El flujo de conversación vive en dialogue.py (máquina de estados)
+    response = dialogue.next_response(state, message, scheduler)
+    
+    changed = state.to_dict() != captured and any(getattr(state, field) for field in SESSION_FIELDS)
+    if changed and state.intake_id is None:
+        state.intake_id = uuid.uuid4().hex
+    sessions.save(state)
+    if changed:
+        intake_log.append(intake_record(state))
+    end_call = dialogue.END_CALL_MARKER in response
+    if PREFETCH_ENABLED and AWS_ACCESS_KEY and AWS_SECRET_KEY and not end_call:
+        prefetcher.schedule(session_id, copy.copy(state), audio_format, keep=response)
+    return {
+        'response': response,
+        'end_call': end_call,
+        'session_id': session_id
+    }
+
+def sse_event(event, data):
+    """Evento de Server-Sent Events; data es texto de una línea o un objeto JSON"""
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {data}\n\n"
+
+def turn_events(turn, audio_format=DEFAULT_FORMAT):
+    """Eventos de /api/turn: el texto al momento y después el audio en trozos base64"""
+    yield sse_event('text', turn)
+    
+    text = turn['response']
+    if not AWS_ACCESS_KEY or not AWS_SECRET_KEY:
+        yield sse_event('end', {'useBrowserTTS': True})
+        return
+    
+    try:
+        chunks, engine, segments = pipelined_audio(text, audio_format, turn['session_id'])
+    except Exception as synthesis_error:
+        app.logger.error(f"Fallback también falló: {synthesis_error}")
+        yield sse_event('end', {'useBrowserTTS': True, 'error': str(synthesis_error)})
+        return
+    
+    audio_bytes = 0
+    try:
+        for chunk in chunks:
+            audio_bytes += len(chunk)
+            yield sse_event('audio', base64.b64encode(chunk).decode('ascii'))
+    finally:
+        chunks.close()
+    yield sse_event('end', {'useBrowserTTS': False, 'engine': engine, 'segments': segments, 'bytes': audio_bytes,
+                            'mimeType': audio_format.mimetype})
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def speak_payload(text, transport=None, audio_format=DEFAULT_FORMAT, session_id=None):
+    """Cuerpo JSON de /api/speak (compartido con asgi.py).
+
+    Con transport='url' el audio no viaja en el JSON: se devuelve su id y la
+    URL de /api/audio/<id> desde donde se sirve en audio_format. Con
+    session_id se usa el audio que el prefetch haya adelantado; si no, las
+    respuestas de plantilla se montan con sus partes fijas cacheadas."""
+    # Verificación DIRECTA de credenciales
+    if not AWS_ACCESS_KEY or not AWS_SECRET_KEY:
+        app.logger.error("AWS credentials not configured - usando modo navegador")
+        return {
+            'audioContent': None,
+            'audioUrl': None,
+            'useBrowserTTS': True,
+            'text': text
+        }
+    
+    try:
+        ready = prefetched_audio(session_id, text, audio_format) or spliced_audio(text, audio_format)
+        if transport == 'url':
+            if ready is not None:
+                audio_id, _, engine = ready
+            else:
+                audio_id, engine = synthesize_with_fallback(text, synthesize_to_cache, audio_format)
+            return {
+                'audioId': audio_id,
+                'audioUrl': f"/api/audio/{audio_id}{audio_format.url_suffix()}",
+                'mimeType': audio_format.mimetype,
+                'useBrowserTTS': False,
+                'engine': engine
+            }
+        if ready is not None:
+            _, audio_data, engine = ready
+        else:
+            audio_data, engine = synthesize_with_fallback(text, audio_format=audio_format)
+    except Exception as synthesis_error:
+        app.logger.error(f"Fallback también falló: {synthesis_error}")
+        return {
+            'audioContent': None,
+            'audioUrl': None,
+            'useBrowserTTS': True,
+            'text': text,
+            'error': str(synthesis_error)
+        }
+    
+    # Convertir audio a base64
+    with metrics.timer('stage_duration_seconds', stage='base64_encode'):
+        audio_content = base64.b64encode(audio_format.encode(audio_data)).decode('utf-8')
+    
+    return {
+        'audioContent': audio_content,
+        'audioUrl': f"data:{audio_format.mimetype};base64,{audio_content}",
+        'mimeType': audio_format.mimetype,
+        'useBrowserTTS': False,
+        'engine': engine
+    }
+
 @app.route('/api/speak', methods=['POST'])
 def speak_text():
     try:
@@ -120,119 +648,33 @@ def speak_text():
         
         if not text:
             return jsonify({'error': 'No text provided'}), 400
-        
-        # Verificación DIRECTA de credenciales
-        if not AWS_ACCESS_KEY or not AWS_SECRET_KEY:
-            app.logger.error("AWS credentials not configured - usando modo navegador")
-            return jsonify({
-                'audioContent': None,
-                'audioUrl': None,
-                'useBrowserTTS': True,
-                'text': text
-            })
-        
-        # Configurar cliente de Polly
-        app.logger.info("Configurando cliente Polly...")
-        polly = boto3.client('polly',
-                            aws_access_key_id=AWS_ACCESS_KEY,
-                            aws_secret_access_key=AWS_SECRET_KEY,
-                            region_name=AWS_REGION)
-        
-        # INTENTAR PRIMERO CON MOTOR GENERATIVO (LA MEJOR OPCIÓN)
         try:
-            # Crear SSML optimizado para generativo
-            ssml_text = create_generative_ssml(text)
-            app.logger.info("Sintetizando con motor GENERATIVO...")
-            
-            response = polly.synthesize_speech(
-                Text=ssml_text,
-                TextType='ssml',
-                OutputFormat='mp3',
-                VoiceId='Lupe',
-                Engine='generative',  # CAMBIO PRINCIPAL: usar generativo
-                LanguageCode='es-US',
-                SampleRate='24000'   # Máxima calidad para generativo
-            )
-            
-            app.logger.info("Audio sintetizado correctamente con motor GENERATIVO")
-            
-            # Convertir audio a base64
-            audio_data = response['AudioStream'].read()
-            audio_content = base64.b64encode(audio_data).decode('utf-8')
-            
-            return jsonify({
-                'audioContent': audio_content,
-                'audioUrl': f"data:audio/mp3;base64,{audio_content}",
-                'useBrowserTTS': False,
-                'engine': 'generative'
-            })
-            
-        except (BotoCoreError, ClientError) as generative_error:
-            app.logger.warning(f"Motor generativo falló: {generative_error}")
-            app.logger.info("Intentando fallback a motor neural...")
-            
-            # FALLBACK 1: Sintetizar voz con Polly - motor neuronal para voz más natural
+            audio_format = negotiate_request(data, request.headers)
+        except ValueError as format_error:
+            return jsonify({'error': str(format_error)}), 400
+        
+        session_id = data.get('session_id') or request.cookies.get(SESSION_COOKIE)
+        if AWS_ACCESS_KEY and AWS_SECRET_KEY and (data.get('pipeline') or data.get('stream')):
             try:
-                ssml_text = create_ssml_text(text)
-                response = polly.synthesize_speech(
-                    Text=ssml_text,
-                    TextType='ssml',  # Usar SSML
-                    OutputFormat='mp3',
-                    VoiceId='Lupe',
-                    Engine='neural',  # Motor neuronal para voz más natural
-                    LanguageCode='es-US'
-                )
-                
-                app.logger.info("Audio sintetizado correctamente con motor neuronal")
-                
-                # Convertir audio a base64
-                audio_data = response['AudioStream'].read()
-                audio_content = base64.b64encode(audio_data).decode('utf-8')
+                if data.get('pipeline'):
+                    # Modo pipeline: frases sintetizadas en paralelo y emitidas en orden
+                    return pipelined_stream_response(text, audio_format, session_id)
                 
+                # Modo streaming: el audio se reenvía según llega de Polly
+                return audio_stream_response(text, audio_format, session_id)
+            except Exception as synthesis_error:
+                app.logger.error(f"Fallback también falló: {synthesis_error}")
                 return jsonify({
-                    'audioContent': audio_content,
-                    'audioUrl': f"data:audio/mp3;base64,{audio_content}",
-                    'useBrowserTTS': False,
-                    'engine': 'neural'
+                    'audioContent': None,
+                    'audioUrl': None,
+                    'useBrowserTTS': True,
+                    'text': text,
+                    'error': str(synthesis_error)
                 })
-                
-            except (BotoCoreError, ClientError) as neural_error:
-                app.logger.error(f"AWS Polly neural error: {neural_error}")
-                
-                # Fallback a voz estándar si falla neural
-                try:
-                    if 'polly' not in locals():
-                        polly = boto3.client('polly',
-                                            aws_access_key_id=AWS_ACCESS_KEY,
-                                            aws_secret_access_key=AWS_SECRET_KEY,
-                                            region_name=AWS_REGION)
-                    
-                    app.logger.info("Intentando con motor estándar como fallback...")
-                    response = polly.synthesize_speech(
-                        Text=text,
-                        OutputFormat='mp3',
-                        VoiceId='Lupe'
-                    )
-                    
-                    audio_data = response['AudioStream'].read()
-                    audio_content = base64.b64encode(audio_data).decode('utf-8')
-                    
-                    return jsonify({
-                        'audioContent': audio_content,
-                        'audioUrl': f"data:audio/mp3;base64,{audio_content}",
-                        'useBrowserTTS': False,
-                        'engine': 'standard'
-                    })
-                    
-                except Exception as fallback_error:
-                    app.logger.error(f"Fallback también falló: {fallback_error}")
-                    return jsonify({
-                        'audioContent': None,
-                        'audioUrl': None,
-                        'useBrowserTTS': True,
-                        'text': text,
-                        'error': str(neural_error)
-                    })
+        
+        payload = speak_payload(text, data.get('transport'), audio_format, session_id)
+        with metrics.timer('stage_duration_seconds', stage='json_serialize'):
+            return jsonify(payload)
             
     except Exception as e:
         app.logger.error(f"Exception in speak_text: {str(e)}")
@@ -244,6 +686,64 @@ def speak_text():
             'error': str(e)
         })
 
+@app.route('/api/speak/stream', methods=['GET'])
+def speak_stream():
+    """Audio en streaming para usarlo directamente como src de un <audio>"""
+    text = request.args.get('text', '')
+    
+    if not text:
+        return jsonify({'error': 'No text provided'}), 400
+    try:
+        # Esta URL la pide un <audio>: solo cuentan format/sample_rate y las client hints
+        audio_format = negotiate_request(request.args, request.headers, use_accept=False)
+    except ValueError as format_error:
+        return jsonify({'error': str(format_error)}), 400
+    
+    if not AWS_ACCESS_KEY or not AWS_SECRET_KEY:
+        return jsonify({'useBrowserTTS': True, 'text': text}), 503
+    
+    session_id = request.args.get('session_id') or request.cookies.get(SESSION_COOKIE)
+    try:
+        if request.args.get('pipeline'):
+            return pipelined_stream_response(text, audio_format, session_id)
+        return audio_stream_response(text, audio_format, session_id)
+    except Exception as e:
+        app.logger.error(f"Exception in speak_stream: {str(e)}")
+        return jsonify({'useBrowserTTS': True, 'text': text, 'error': str(e)}), 502
+
+@app.route('/api/audio/<audio_id>', methods=['GET'])
+def get_audio(audio_id):
+    """Audio sintetizado por su id de caché (<id>[.ogg|.wav|.pcm]), con ETag y peticiones Range"""
+    key, _, extension = audio_id.partition('.')
+    try:
+        if not AUDIO_ID_PATTERN.fullmatch(key):
+            raise ValueError(audio_id)
+        audio_format = format_for_extension(extension, request.args.get('rate'))
+    except ValueError:
+        return jsonify({'error': 'Invalid audio id'}), 404
+    
+    # El id es un hash del contenido: la respuesta no cambia nunca
+    etag = key if audio_format.passthrough else f"{key}-{audio_format.name}-{audio_format.sample_rate}"
+    path = audio_cache.disk_path(key)
+    if audio_format.passthrough and path and os.path.exists(path):
+        response = send_file(path, mimetype=audio_format.mimetype, etag=etag, conditional=True,
+                             max_age=AUDIO_MAX_AGE)
+    else:
+        audio_data = audio_cache.get(key)
+        if audio_data is None:
+            return jsonify({'error': 'Audio not found'}), 404
+        audio_data = audio_format.encode(audio_data)
+        response = Response(audio_data, mimetype=audio_format.mimetype)
+        response.set_etag(etag)
+        response.cache_control.max_age = AUDIO_MAX_AGE
+        response.make_conditional(request, accept_ranges=True, complete_length=len(audio_data))
+    # private: el audio puede leer el nombre, el correo o el teléfono del usuario,
+    # así que solo lo guarda el navegador, nunca un proxy o CDN compartido
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     try:
@@ -253,191 +753,206 @@ def chat():
         if not message:
             return jsonify({'error': 'No message provided'}), 400
         
-        message_lower = message.lower()
-        
-        # Saludo inicial - Pide el nombre
-        if any(word in message_lower for word in ['hola', 'buenos días', 'buenas tardes', 'saludos', 'buenos', 'buenas', 'iniciar', 'empezar']):
-            # Reiniciar variables de sesión
-            for attr in ['user_name', 'user_email', 'user_phone', 'case_description', 'appointment_time', 'user_role', 'case_category']:
-                if hasattr(chat, attr):
-                    delattr(chat, attr)
+        session_id = get_session_id(data, request.cookies)
+        result = jsonify(chat_turn(session_id, message, request_audio_format(data, request.headers)))
+        result.set_cookie(SESSION_COOKIE, session_id, max_age=sessions.ttl, httponly=True, samesite='Lax')
+        return result
             
-            response = """¡Bienvenido a TusAbogados.com! Para personalizar su atención, ¿con quién tengo el gusto de hablar?
-
-Por favor, dígame su nombre."""
-       
-        # Captura del nombre - Pregunta por el rol
-        elif not hasattr(chat, 'user_name'):
-            chat.user_name = message.strip()
-            response = f"""Mucho gusto {chat.user_name}. Para orientarle mejor, necesito saber su rol en el caso.
-
-¿Es usted:
-- "Víctima": por ejemplo, si sufrió un accidente de tránsito, le deben dinero, fue estafado, o sufrió algún daño o perjuicio.
-- "Demandante": por ejemplo, si quiere iniciar una demanda por divorcio, reclamar una herencia, demandar por incumplimiento de contrato, o exigir sus derechos laborales.
-
-¿Se considera víctima o demandante en esta situación?"""
-        
-        # Captura del rol - Pregunta por categoría
-        elif not hasattr(chat, 'user_role'):
-            if 'víctima' in message_lower or 'victima' in message_lower:
-                chat.user_role = 'víctima'
-            else:
-                chat.user_role = 'demandante'
-                
-            response = f"""Entendido {getattr(chat, 'user_name', '')}, como {chat.user_role}. Ahora necesito saber el tipo de caso.
-
-Por ejemplo:
-- "Categoría Civil": si quiere demandar por divorcio, reclamar una herencia, exigir cumplimiento de contrato, o resolver problemas de propiedad.
-- "Categoría Laboral": por ejemplo si va a demandar por despido injustificado, acoso laboral, o para reclamar prestaciones laborales.  
-- "Categoría Penal": si va a denunciar por robos, agresiones, amenazas, o estafas.
-
-Si no está seguro a qué categoría pertenece su caso, puede decir: "No sé cuál es mi categoría" o "La desconozco".
-
-¿En qué categoría cree que está su caso?"""
-        
-        # Captura de categoría - Pide descripción breve
-        elif not hasattr(chat, 'case_category'):
-            if 'civil' in message_lower:
-                chat.case_category = 'civil'
-            elif 'laboral' in message_lower:
-                chat.case_category = 'laboral'
-            elif 'penal' in message_lower:
-                chat.case_category = 'penal'
-            else:
-                chat.case_category = 'no definida'
-            
-            response = f"""Categoría {chat.case_category} registrada. 
-
-Por favor, descríbame brevemente su caso para entender mejor su situación."""
-        
-        # Captura descripción - Pide correo electrónico
-        elif not hasattr(chat, 'user_email') and not hasattr(chat, 'case_description'):
-            chat.case_description = message.strip()
-            response = f"""Gracias {getattr(chat, 'user_name', '')} por la información. 
-
-Para agendar su cita y enviarle la confirmación, necesito su correo electrónico.
+    except Exception as e:
+        app.logger.error(f"Exception in chat: {str(e)}")
+        return jsonify({'error': str(e)}), 500        
 
-¿Cuál es su correo electrónico?"""
+@app.route('/api/turn', methods=['POST'])
+def turn():
+    """Turno completo (chat + voz) en una sola petición, como text/event-stream"""
+    try:
+        data = request.json
+        message = data.get('message', '')
         
-        # Captura del email - CUALQUIER respuesta después de pedir correo
-        elif not hasattr(chat, 'user_email'):
-            # Cualquier respuesta se toma como email
-            chat.user_email = message.strip()
-            response = f"""Correo registrado correctamente.
-
-Ahora necesito un número de teléfono para contactarle.
-
-¿Cuál es su número de contacto?"""
+        if not message:
+            return jsonify({'error': 'No message provided'}), 400
         
-        # Captura del teléfono - CUALQUIER respuesta después de pedir teléfono
-        elif not hasattr(chat, 'user_phone'):
-            chat.user_phone = message.strip()
-            response = f"""¡Perfecto {getattr(chat, 'user_name', '')}! Tenemos toda la información necesaria.
-
-Le propongo el primer horario disponible:
-¿Le viene bien el Lunes 29 de Septiembre a las 10:30 de la mañana?
-
-Responda "sí" para confirmar o "no" para otro horario."""
+        try:
+            audio_format = negotiate_request(data, request.headers)
+        except ValueError as format_error:
+            return jsonify({'error': str(format_error)}), 400
         
-        # Confirmación de primer horario
-        elif not hasattr(chat, 'appointment_time') and any(word in message_lower for word in ['sí', 'si', 'ok', 'de acuerdo', 'confirmo', 'sí acepto', 'si acepto']):
-            chat.appointment_time = "Lunes 29 de Septiembre - 10:30 am"
-            response = f"""¡Cita confirmada {getattr(chat, 'user_name', '')}!
+        session_id = get_session_id(data, request.cookies)
+        result = chat_turn(session_id, message, audio_format)
+    except Exception as e:
+        app.logger.error(f"Exception in turn: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    
+    response = Response(stream_with_context(turn_events(result, audio_format)),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+    response.set_cookie(SESSION_COOKIE, session_id, max_age=sessions.ttl, httponly=True, samesite='Lax')
+    return response
 
-Fecha: Lunes 29 de Septiembre - 10:30 am
-Confirmación enviada a: {getattr(chat, 'user_email', '')}
-Teléfono de contacto: {getattr(chat, 'user_phone', '')}
+def bearer_authorized(token):
+    if not token:
+        return False
+    return hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
 
-Recuerde: si su caso supera los 10 millones, no hay costo inicial. Solo paga el 10% si recuperamos su dinero.
+def batch_limits(workers=None, rate=None):
+    """Hilos y peticiones/s pedidos para un lote, acotados a BATCH_WORKERS y BATCH_RATE.
 
-¿Hay algo más en lo que pueda ayudarle?"""
-        
-        # Rechazo del primer horario - Ofrece segundo
-        elif not hasattr(chat, 'appointment_time') and any(word in message_lower for word in ['no', 'no me viene', 'otro horario', 'otra hora']):
-            response = """Entiendo. Le propongo:
-Miércoles 1 de Octubre a las 3:30 de la tarde.
-
-¿Le funciona este horario?"""
-        
-        # Confirmación de segundo horario
-        elif not hasattr(chat, 'appointment_time') and any(word in message_lower for word in ['miércoles', 'miercoles', 'sí miércoles', 'si miercoles', '3:30']):
-            chat.appointment_time = "Miércoles 1 de Octubre - 3:30 pm"
-            response = f"""¡Cita confirmada {getattr(chat, 'user_name', '')}!
+    Lanza ValueError si no son números. Un rate de 0 o negativo no quita el
+    límite: se usa BATCH_RATE."""
+    try:
+        workers = BATCH_WORKERS if workers is None else max(1, min(int(workers), BATCH_WORKERS))
+        rate = BATCH_RATE if rate is None else float(rate)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("'workers' y 'rate' deben ser números")
+    if not rate > 0 or (BATCH_RATE > 0 and rate > BATCH_RATE):
+        rate = BATCH_RATE
+    return workers, rate
 
-Fecha: Miércoles 1 de Octubre - 3:30 pm
-Confirmación enviada a: {getattr(chat, 'user_email', '')}
-Teléfono de contacto: {getattr(chat, 'user_phone', '')}
+def start_batch_job(job_id):
+    """Lanza (o reanuda) un lote en un hilo de fondo de este worker"""
+    output_dir = os.path.join(BATCH_DIR, job_id)
+    with open(os.path.join(output_dir, 'job.json'), encoding='utf-8') as f:
+        settings = json.load(f)
+    try:
+        workers, rate = batch_limits(settings.get('workers'), settings.get('rate'))
+    except ValueError:
+        workers, rate = batch_limits()
+    job = create_batch_job(output_dir, settings.get('options', {}), workers=workers, rate=rate)
+    
+    def run():
+        try:
+            job.run()
+        except Exception as e:
+            app.logger.error(f"Error en el lote de síntesis {job_id}: {e}")
+            # El estado vuelve a leerse del disco (p. ej. si otro worker ya lo ejecuta)
+            with batch_jobs_lock:
+                if batch_jobs.get(job_id) is job:
+                    del batch_jobs[job_id]
+    
+    with batch_jobs_lock:
+        batch_jobs[job_id] = job
+    threading.Thread(target=run, name=f'batch-{job_id[:8]}', daemon=True).start()
+    return job
 
-¿Hay algo más en lo que pueda ayudarle?"""
-        
-        # Respuesta NEGATIVA a "¿algo más?" - CIERRE AUTOMÁTICO
-        elif hasattr(chat, 'appointment_time') and any(word in message_lower for word in ['no', 'nada más', 'eso es todo', 'no gracias', 'listo', 'ya está', 'ya esta']):
-            response = f"""¡Perfecto {getattr(chat, 'user_name', '')}! 
+@app.route('/api/batch', methods=['POST'])
+def create_batch():
+    """Crea un lote de síntesis a partir de una lista de textos"""
+    if not bearer_authorized(BATCH_API_TOKEN):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.json or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'No items provided'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Too many items (max {BATCH_MAX_ITEMS})'}), 400
+    if not all(isinstance(item, dict) and item.get('text') for item in items):
+        return jsonify({'error': "Every item needs a 'text'"}), 400
+    
+    try:
+        workers, rate = batch_limits(data.get('workers'), data.get('rate'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    job_id = uuid.uuid4().hex
+    options = {name: data[name] for name in ITEM_OPTIONS if data.get(name)}
+    create_job(os.path.join(BATCH_DIR, job_id), items, {'options': options, 'workers': workers, 'rate': rate})
+    start_batch_job(job_id)
+    return jsonify({'job_id': job_id, 'status_url': f"/api/batch/{job_id}"}), 202
 
-Ha sido un placer ayudarle. Un abogado se contactará con usted en la fecha acordada.
+@app.route('/api/batch/<job_id>', methods=['GET'])
+def batch_status(job_id):
+    """Progreso de un lote (del worker que lo ejecuta o del disco)"""
+    if not bearer_authorized(BATCH_API_TOKEN):
+        return jsonify({'error': 'Unauthorized'}), 401
+    if not BATCH_ID_PATTERN.fullmatch(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+    
+    job = batch_jobs.get(job_id)
+    status = job.status() if job else job_status(os.path.join(BATCH_DIR, job_id))
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job_id': job_id, **status})
 
-Esta llamada se finalizará automáticamente. ¡Que tenga un excelente día!
+@app.route('/api/batch/<job_id>/resume', methods=['POST'])
+def resume_batch(job_id):
+    """Reanuda un lote interrumpido sin repetir lo ya sintetizado"""
+    if not bearer_authorized(BATCH_API_TOKEN):
+        return jsonify({'error': 'Unauthorized'}), 401
+    if not BATCH_ID_PATTERN.fullmatch(job_id) or not os.path.isdir(os.path.join(BATCH_DIR, job_id)):
+        return jsonify({'error': 'Job not found'}), 404
+    
+    job = batch_jobs.get(job_id)
+    if job and job.status()['status'] in ('pending', 'running'):
+        return jsonify({'error': 'Job already running'}), 409
+    start_batch_job(job_id)
+    return jsonify({'job_id': job_id, 'status_url': f"/api/batch/{job_id}"}), 202
 
-[LLAMADA FINALIZADA]"""
-        
-        # Consulta adicional después de cita confirmada
-        elif hasattr(chat, 'appointment_time') and len(message.strip()) > 5:
-            response = f"""Entendido {getattr(chat, 'user_name', '')}. 
+def caller_index():
+    """Índice de llamantes abierto (mmap) en este worker; se reabre si se reconstruye"""
+    global asis_index
+    if not ASIS_INDEX_DIR:
+        return None
+    try:
+        version = index_version(ASIS_INDEX_DIR)
+    except OSError:
+        return None
+    if asis_index is None or asis_index.version != version or asis_retired:
+        with asis_index_lock:
+            if asis_index is None or asis_index.version != version:
+                previous = asis_index
+                asis_index = open_index(ASIS_INDEX_DIR)
+                app.logger.info(f"Índice de llamantes abierto: {asis_index.stats()}")
+                if previous is not None:
+                    asis_retired.append((previous, time.monotonic()))
+            close_retired_indexes()
+    return asis_index
 
-He registrado su consulta adicional. Uno de nuestros abogados especializados se contactará con usted según los datos agendados y le ampliará toda la información al respecto.
+def close_retired_indexes():
+    """Cierra (fd y mmap) los índices retirados hace más de ASIS_RETIRE_SECONDS; con el lock tomado"""
+    now = time.monotonic()
+    while asis_retired and now - asis_retired[0][1] >= ASIS_RETIRE_SECONDS:
+        index, _ = asis_retired.pop(0)
+        try:
+            index.close()
+        except Exception as e:
+            app.logger.warning(f"No se pudo cerrar el índice de llamantes anterior: {e}")
 
-¿Hay alguna otra cosa en la que pueda asistirle?"""
-        
-        # Solicitud de repetición
-        elif any(word in message_lower for word in ['repetir', 'repita', 'no entendí']):
-            if not hasattr(chat, 'user_name'):
-                response = "Por favor, dígame su nombre para continuar."
-            elif not hasattr(chat, 'user_role'):
-                response = "¿Se considera víctima o demandante en este caso?"
-            elif not hasattr(chat, 'case_category'):
-                response = "¿En qué categoría está su caso: civil, laboral o penal?"
-            elif not hasattr(chat, 'user_email'):
-                response = "Necesito su correo electrónico para enviarle la confirmación."
-            elif not hasattr(chat, 'user_phone'):
-                response = "Necesito su número de teléfono para contactarle."
-            elif not hasattr(chat, 'appointment_time'):
-                response = "¿Le viene bien el Lunes 29 de Septiembre a las 10:30 de la mañana?"
-            else:
-                response = "¿Hay algo más en lo que pueda ayudarle?"
-        
-        # Agradecimientos y cierre automático
-        elif any(word in message_lower for word in ['gracias', 'adiós', 'chao', 'hasta luego']):
-            response = f"""Gracias a usted {getattr(chat, 'user_name', '')}. 
+def result_limit():
+    try:
+        return max(1, min(int(request.args.get('limit', 100)), CALLER_MAX_RESULTS))
+    except ValueError:
+        return 100
 
-Esta llamada se finalizará automáticamente. ¡Que tenga un excelente día!
+@app.route('/api/caller/<int:caller_id>', methods=['GET'])
+def caller_history(caller_id):
+    """Nombre e historial de llamadas de un llamante"""
+    if not bearer_authorized(CALLER_API_TOKEN):
+        return jsonify({'error': 'Unauthorized'}), 401
+    index = caller_index()
+    if index is None:
+        return jsonify({'error': 'Caller index not available'}), 503
+    
+    caller = index.caller(caller_id, limit=result_limit())
+    if caller is None:
+        return jsonify({'error': 'Caller not found'}), 404
+    return jsonify(caller)
 
-[LLAMADA FINALIZADA]"""
-        
-        # Respuesta por defecto - Guía al siguiente paso
-        else:
-            if not hasattr(chat, 'user_name'):
-                response = "Por favor, dígame su nombre para continuar."
-            elif not hasattr(chat, 'user_role'):
-                response = "¿Se considera víctima o demandante en este caso?"
-            elif not hasattr(chat, 'case_category'):
-                response = "¿En qué categoría está su caso: civil, laboral o penal?"
-            elif not hasattr(chat, 'user_email'):
-                response = "Necesito su correo electrónico para enviarle la confirmación."
-            elif not hasattr(chat, 'user_phone'):
-                response = "Necesito su número de teléfono para contactarle."
-            elif not hasattr(chat, 'appointment_time'):
-                response = "¿Le viene bien el Lunes 29 de Septiembre a las 10:30 de la mañana?"
-            else:
-                response = "¿Hay algo más en lo que pueda ayudarle?"
-        
-        return jsonify({
-            'response': response,
-            'end_call': '[LLAMADA FINALIZADA]' in response
-        })
-            
-    except Exception as e:
-        app.logger.error(f"Exception in chat: {str(e)}")
-        return jsonify({'error': str(e)}), 500        
+@app.route('/api/calls', methods=['GET'])
+def calls_between():
+    """Llamadas entre dos fechas (?from=...&to=...) con el nombre del llamante"""
+    if not bearer_authorized(CALLER_API_TOKEN):
+        return jsonify({'error': 'Unauthorized'}), 401
+    index = caller_index()
+    if index is None:
+        return jsonify({'error': 'Caller index not available'}), 503
+    
+    try:
+        start = parse_timestamp(request.args['from'])
+        end = parse_timestamp(request.args['to'])
+    except (KeyError, ValueError):
+        return jsonify({'error': "'from' and 'to' must be dates like 01/09/2025 8:00"}), 400
+    return jsonify(index.calls_between(start, end, limit=result_limit()))
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -448,9 +963,24 @@ def health_check():
         'aws_configured': aws_configured,
         'aws_access_key_set': bool(AWS_ACCESS_KEY),
         'aws_secret_key_set': bool(AWS_SECRET_KEY),
-        'service': 'Amazon Polly - Lupe Generativa' if aws_configured else 'Modo emergencia - Navegador TTS'
+        'service': 'Amazon Polly - Lupe Generativa' if aws_configured else 'Modo emergencia - Navegador TTS',
+        'audio_cache': audio_cache.stats(),
+        'polly_pool': polly_clients.stats(),
+        'sessions': sessions.stats(),
+        'intake_log': intake_log.stats(),
+        'scheduler': scheduler.stats(),
+        'prefetch': prefetcher.stats(),
+        'caller_index': asis_index.stats() if asis_index else None,
+        'engines': engine_health.snapshot()
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Métricas del worker en formato Prometheus (o JSON con ?format=json)"""
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.snapshot())
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/debug', methods=['GET'])
 def debug_info():
     """Endpoint para debugging"""
@@ -506,21 +1036,24 @@ def test_generative():
         if not AWS_ACCESS_KEY or not AWS_SECRET_KEY:
             return jsonify({'error': 'AWS credentials not configured'}), 400
             
-        polly = boto3.client('polly',
-                            aws_access_key_id=AWS_ACCESS_KEY,
-                            aws_secret_access_key=AWS_SECRET_KEY,
-                            region_name=AWS_REGION)
+        polly = polly_clients.get()
         
-        test_text = "Hola, esta es una prueba del motor generativo."
+        test_text = GENERATIVE_TEST_TEXT
         
         # Intentar síntesis con motor generativo
-        response = polly.synthesize_speech(
-            Text=test_text,
-            OutputFormat='mp3',
-            VoiceId='Lupe',
-            Engine='generative',
-            LanguageCode='es-US'
-        )
+        try:
+            response = polly.synthesize_speech(
+                Text=test_text,
+                OutputFormat='mp3',
+                VoiceId='Lupe',
+                Engine='generative',
+                LanguageCode='es-US'
+            )
+        except (BotoCoreError, ClientError) as probe_error:
+            engine_health.record_failure('generative', probe_error)
+            raise
+        
+        engine_health.record_success('generative')
         
         return jsonify({
             'generative_available': True,
@@ -538,6 +1071,13 @@ def test_generative():
             'fallback': 'Usará motor neural como alternativa'
         })
 
+# Pre-sintetizar los mensajes fijos sin bloquear el arranque del worker
+if os.environ.get("AUDIO_WARMUP", "").lower() in ('1', 'true', 'yes') and AWS_ACCESS_KEY and AWS_SECRET_KEY:
+    start_background_warmup(
+        warm_up_audio,
+        lock_path=os.path.join(audio_cache.disk_dir, '.warmup.lock') if audio_cache.disk_dir else None
+    )
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
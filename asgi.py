@@ -0,0 +1,260 @@
+"""Modo de servicio ASGI (asyncio) para /api/speak y /api/chat.
+
+Con workers síncronos cada /api/speak ocupa un worker durante toda la llamada
+a Polly. Aquí esas dos rutas se atienden en el bucle de asyncio y la síntesis
+se ejecuta en un pool de hilos, así un solo proceso puede tener cientos de
+síntesis en vuelo:
+
+- POLLY_MAX_CONCURRENCY limita las llamadas simultáneas a Polly (ajústelo a
+  la cuota de la cuenta; POLLY_RETRY_MODE=adaptive añade limitación del lado
+  del cliente cuando Polly responde con throttling).
+- ASGI_MAX_PENDING es la contrapresión: si hay más síntesis esperando turno,
+  se responde 503 con Retry-After y el navegador usa su TTS.
+
+Las demás rutas (y los modos stream/pipeline de /api/speak) las sirve la app
+Flask a través de WsgiToAsgi.
+
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import CookieError, SimpleCookie
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.http import dump_cookie
+
+import app as sofia
+from audio_formats import negotiate_request
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+POLLY_MAX_CONCURRENCY = int(os.environ.get("POLLY_MAX_CONCURRENCY", 64))
+ASGI_MAX_PENDING = int(os.environ.get("ASGI_MAX_PENDING", 512))
+MAX_BODY_BYTES = 1024 * 1024
+
+flask_asgi = WsgiToAsgi(sofia.app)
+
+
+class SynthesisLimiter:
+    """Semáforo de llamadas a Polly con límite de peticiones en espera"""
+
+    def __init__(self, max_concurrency, max_pending):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._semaphore = None
+        self._executor = None
+
+    def start(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='polly-async')
+
+    def stop(self):
+        if self._executor:
+            self._executor.shutdown(wait=False)
+
+    def overloaded(self):
+        return self.pending >= self.max_pending
+
+    async def run(self, func, *args):
+        """Ejecuta func(*args) en el pool respetando el límite de concurrencia"""
+        if self._semaphore is None:
+            self.start()
+        self.pending += 1
+        try:
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {
+            'max_concurrency': self.max_concurrency,
+            'max_pending': self.max_pending,
+            'pending': self.pending,
+            'rejected': self.rejected
+        }
+
+
+limiter = SynthesisLimiter(POLLY_MAX_CONCURRENCY, ASGI_MAX_PENDING)
+
+
+def collect_limiter_metrics():
+    yield 'asgi_pending_syntheses', 'gauge', {}, limiter.pending
+    yield 'asgi_rejected_total', 'counter', {}, limiter.rejected
+
+
+metrics.describe('asgi_pending_syntheses', 'Síntesis en vuelo o esperando turno en el bucle ASGI')
+metrics.describe('asgi_rejected_total', 'Peticiones rechazadas con 503 por contrapresión')
+metrics.register_collector(collect_limiter_metrics)
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            raise ValueError('Request body too large')
+        if not message.get('more_body'):
+            return body
+
+
+def replay_receive(body, receive):
+    """receive() que entrega de nuevo un cuerpo ya leído (para delegar en Flask)"""
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        return await receive()
+
+    return replay
+
+
+def timed_send(send, path, method):
+    """send() que registra la duración de la petición al enviar la cabecera"""
+    started = time.perf_counter()
+
+    async def send_and_record(message):
+        if message['type'] == 'http.response.start':
+            labels = {'endpoint': path, 'method': method, 'status': message['status']}
+            metrics.observe('http_request_duration_seconds', time.perf_counter() - started, **labels)
+            metrics.inc('http_requests_total', **labels)
+        await send(message)
+
+    return send_and_record
+
+
+async def send_json(send, payload, status=200, headers=()):
+    with metrics.timer('stage_duration_seconds', stage='json_serialize'):
+        body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            (b'access-control-allow-origin', b'*'),
+            *headers
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def request_headers(scope):
+    """Cabeceras de la petición con el nombre en minúsculas"""
+    return {name.decode('latin-1'): value.decode('latin-1') for name, value in scope.get('headers', [])}
+
+
+def request_cookies(scope):
+    cookies = SimpleCookie()
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            try:
+                cookies.load(value.decode('latin-1'))
+            except CookieError:
+                # Cabecera mal formada: como si no hubiera cookie
+                return {}
+    return {key: morsel.value for key, morsel in cookies.items()}
+
+
+async def speak(scope, receive, send, data):
+    text = data.get('text', '')
+    if not text:
+        await send_json(send, {'error': 'No text provided'}, status=400)
+        return
+    try:
+        audio_format = negotiate_request(data, request_headers(scope))
+    except ValueError as format_error:
+        await send_json(send, {'error': str(format_error)}, status=400)
+        return
+
+    if limiter.overloaded():
+        limiter.rejected += 1
+        await send_json(send, {'audioContent': None, 'audioUrl': None, 'useBrowserTTS': True,
+                               'text': text, 'error': 'Servidor ocupado'},
+                        status=503, headers=[(b'retry-after', b'1')])
+        return
+
+    session_id = data.get('session_id') or request_cookies(scope).get(sofia.SESSION_COOKIE)
+    payload = await limiter.run(sofia.speak_payload, text, data.get('transport'), audio_format, session_id)
+    await send_json(send, payload)
+
+
+async def chat(scope, receive, send, data):
+    message = data.get('message', '')
+    if not message:
+        await send_json(send, {'error': 'No message provided'}, status=400)
+        return
+
+    session_id = sofia.get_session_id(data, request_cookies(scope))
+    try:
+        # El backend de sesiones puede hacer E/S (SQLite): fuera del bucle
+        loop = asyncio.get_running_loop()
+        audio_format = sofia.request_audio_format(data, request_headers(scope))
+        payload = await loop.run_in_executor(None, sofia.chat_turn, session_id, message, audio_format)
+    except Exception as e:
+        logger.error(f"Exception in chat: {str(e)}")
+        await send_json(send, {'error': str(e)}, status=500)
+        return
+
+    cookie = dump_cookie(sofia.SESSION_COOKIE, session_id, max_age=sofia.sessions.ttl,
+                         httponly=True, samesite='Lax')
+    await send_json(send, payload, headers=[(b'set-cookie', cookie.encode('latin-1'))])
+
+
+ASYNC_ROUTES = {
+    '/api/speak': speak,
+    '/api/chat': chat,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            limiter.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            limiter.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    handler = ASYNC_ROUTES.get(scope.get('path')) if scope['type'] == 'http' else None
+    if handler is None or scope['method'] != 'POST':
+        await flask_asgi(scope, receive, send)
+        return
+
+    # Las peticiones delegadas en Flask ya se miden en app.py
+    recorded_send = timed_send(send, scope['path'], scope['method'])
+    try:
+        body = await read_body(receive)
+        data = json.loads(body or b'{}')
+    except ValueError:
+        body, data = b'', None
+    if not isinstance(data, dict):
+        await send_json(recorded_send, {'error': 'Invalid JSON body'}, status=400)
+        return
+
+    # Los modos en streaming de /api/speak siguen en Flask
+    if handler is speak and (data.get('stream') or data.get('pipeline')):
+        await flask_asgi(scope, replay_receive(body, receive), send)
+        return
+
+    await handler(scope, receive, recorded_send, data)
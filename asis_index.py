@@ -0,0 +1,472 @@
+"""Índice de consulta rápida para las hojas tipo ASIS.txt.
+
+ASIS.txt describe dos hojas que se cruzan por id:
+
+- Hoja 1 (llamadas): id -> fecha y hora ("01/09/2025 8:12"); un id puede
+  aparecer muchas veces (su historial).
+- Hoja 2 (nombres): id -> nombre.
+
+build() lee las hojas en streaming (TSV, CSV o el propio formato de ASIS.txt
+con sus secciones "HOJA n:") a columnas compactas (array) y escribe un archivo
+por hoja con las columnas y sus índices ya construidos:
+
+- Índice hash de direccionamiento abierto sobre el id (sondeo lineal, carga
+  <= 0.5, dimensionado por ids distintos). En la hoja de llamadas apunta a la primera fila del id y el arreglo
+  `next` encadena las demás, así el historial sale sin ordenar nada.
+- En la hoja de llamadas, las filas ordenadas por fecha para las consultas
+  por rango (búsqueda binaria). Si el archivo ya viene en orden de fecha,
+  como un registro de llamadas, no se guarda nada extra.
+
+open_index() abre los archivos con mmap: arrancar un worker no vuelve a
+parsear nada y el sistema comparte las páginas entre todos los workers.
+
+    python asis_index.py build --asis ASIS.txt --output /tmp/sofia-asis
+    python asis_index.py build --calls hoja1.tsv --names hoja2.csv --output /tmp/sofia-asis
+    python asis_index.py caller --dir /tmp/sofia-asis 10
+    python asis_index.py range --dir /tmp/sofia-asis "01/09/2025 8:00" "01/09/2025 8:20"
+"""
+import argparse
+import csv
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+from array import array
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+CALLS_FILE = 'calls.idx'
+NAMES_FILE = 'names.idx'
+
+TABLE_MAGIC = b'SOFIAIDX'
+TABLE_VERSION = 1
+KIND_CALLS = 1
+KIND_NAMES = 2
+
+# Cabecera: magic, versión, tipo, nº de secciones, filas, bits del hash
+HEADER = struct.Struct('<8sHHIQQ')
+# Sección: nombre, typecode de array, offset y longitud en bytes
+SECTION = struct.Struct('<7scQQ')
+
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+EMPTY = -1
+
+SHEET_HEADER = re.compile(r'\s*HOJA\s+(\d+)\s*:', re.IGNORECASE)
+EPOCH = datetime(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+_DAYS = {}
+
+
+def parse_timestamp(value):
+    """'01/09/2025 8:12' (día/mes/año) o '2025-09-01 08:12[:SS]' a segundos desde 1970.
+
+    Es la hora local tal cual aparece en la hoja, sin zona horaria."""
+    day, _, clock = value.strip().partition(' ')
+    days = _DAYS.get(day)
+    if days is None:
+        if '/' in day:
+            d, m, y = day.split('/')
+        else:
+            y, m, d = day.split('-')
+        days = date(int(y), int(m), int(d)).toordinal() - EPOCH_ORDINAL
+        # Un archivo tiene pocas fechas distintas; se cachean para no reparsearlas
+        if len(_DAYS) > 100000:
+            _DAYS.clear()
+        _DAYS[day] = days
+    seconds = 0
+    if clock:
+        parts = clock.strip().split(':')
+        seconds = int(parts[0]) * 3600 + int(parts[1]) * 60 + (int(parts[2]) if len(parts) > 2 else 0)
+    return days * 86400 + seconds
+
+
+def format_timestamp(seconds):
+    return (EPOCH + timedelta(seconds=seconds)).isoformat()
+
+
+def _row(fields):
+    # Las cabeceras ("A    B") y las líneas vacías no tienen un id numérico
+    if len(fields) < 2:
+        return None
+    try:
+        return int(fields[0].strip()), fields[1].strip()
+    except ValueError:
+        return None
+
+
+def read_sheet(path):
+    """(id, valor) de una hoja TSV o CSV (.csv), en streaming"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith('.csv'):
+            lines = csv.reader(f)
+        else:
+            lines = (line.rstrip('\r\n').split('\t', 1) for line in f)
+        for fields in lines:
+            row = _row(fields)
+            if row is not None:
+                yield row
+
+
+def read_asis(path, sheet):
+    """(id, valor) de la hoja `sheet` de un archivo con secciones 'HOJA n:' como ASIS.txt"""
+    current = None
+    with open(path, encoding='utf-8-sig') as f:
+        for line in f:
+            match = SHEET_HEADER.match(line)
+            if match:
+                current = int(match.group(1))
+                continue
+            if current == sheet:
+                row = _row(line.rstrip('\r\n').split('\t', 1))
+                if row is not None:
+                    yield row
+
+
+def _empty_table(bits):
+    capacity = 1 << bits
+    return array('q', bytes(8 * capacity)), array('q', [EMPTY]) * capacity
+
+
+def _grow(keys, heads, bits):
+    """Duplica la tabla reinsertando lo que ya tenía"""
+    new_keys, new_heads = _empty_table(bits)
+    mask = (1 << bits) - 1
+    shift = 64 - bits
+    for key, head in zip(keys, heads):
+        if head == EMPTY:
+            continue
+        slot = ((key * HASH_MULTIPLIER) & MASK64) >> shift
+        while new_heads[slot] != EMPTY:
+            slot = (slot + 1) & mask
+        new_keys[slot] = key
+        new_heads[slot] = head
+    return new_keys, new_heads
+
+
+def build_hash(ids, chained=False):
+    """Tabla hash (keys, heads) de id -> primera fila del id.
+
+    La tabla crece al doble cuando pasa de la mitad de ocupación, así su
+    tamaño depende de los ids distintos y no de las filas. Con chained=True
+    devuelve también next: la siguiente fila del mismo id (-1 al final). Se
+    recorre al revés para que cada cadena quede en el orden del archivo."""
+    bits = 3
+    keys, heads = _empty_table(bits)
+    mask = (1 << bits) - 1
+    shift = 64 - bits
+    used = 0
+    next_rows = array('q', [EMPTY]) * len(ids) if chained else None
+
+    for row in range(len(ids) - 1, -1, -1):
+        key = ids[row]
+        slot = ((key * HASH_MULTIPLIER) & MASK64) >> shift
+        while True:
+            head = heads[slot]
+            if head == EMPTY:
+                keys[slot] = key
+                heads[slot] = row
+                used += 1
+                if 2 * used > mask + 1:
+                    bits += 1
+                    keys, heads = _grow(keys, heads, bits)
+                    mask = (1 << bits) - 1
+                    shift = 64 - bits
+                break
+            if keys[slot] == key:
+                if chained:
+                    next_rows[row] = head
+                heads[slot] = row
+                break
+            slot = (slot + 1) & mask
+    return keys, heads, next_rows, bits
+
+
+def time_order(timestamps):
+    """Filas ordenadas por fecha, o None si ya están en orden"""
+    if all(a <= b for a, b in zip(timestamps, islice(timestamps, 1, None))):
+        return None
+    return array('q', sorted(range(len(timestamps)), key=timestamps.__getitem__))
+
+
+def write_table(path, kind, count, bits, sections):
+    """Escribe las secciones (nombre, array) alineadas a 8 bytes, de forma atómica"""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.idx-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            offset = HEADER.size + SECTION.size * len(sections)
+            entries = []
+            for name, values in sections:
+                offset += -offset % 8
+                size = len(values) * values.itemsize
+                entries.append(SECTION.pack(name.encode('ascii'), values.typecode.encode('ascii'), offset, size))
+                offset += size
+            f.write(HEADER.pack(TABLE_MAGIC, TABLE_VERSION, kind, len(sections), count, bits))
+            f.write(b''.join(entries))
+            for _, values in sections:
+                f.write(bytes(-f.tell() % 8))
+                values.tofile(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def build_calls(rows, path):
+    """Indexa la hoja de llamadas (id, fecha) y devuelve el número de filas"""
+    ids = array('q')
+    timestamps = array('q')
+    for caller_id, value in rows:
+        try:
+            timestamps.append(parse_timestamp(value))
+        except ValueError:
+            raise ValueError(f"Fecha no válida para el id {caller_id}: {value!r}")
+        ids.append(caller_id)
+
+    keys, heads, next_rows, bits = build_hash(ids, chained=True)
+    sections = [('ids', ids), ('ts', timestamps), ('keys', keys), ('heads', heads), ('next', next_rows)]
+    order = time_order(timestamps)
+    if order is not None:
+        sections.append(('order', order))
+    write_table(path, KIND_CALLS, len(ids), bits, sections)
+    return len(ids)
+
+
+def build_names(rows, path):
+    """Indexa la hoja de nombres (id, nombre) y devuelve el número de filas"""
+    ids = array('q')
+    offsets = array('Q', [0])
+    text = bytearray()
+    for caller_id, name in rows:
+        ids.append(caller_id)
+        text += name.encode('utf-8')
+        offsets.append(len(text))
+
+    keys, heads, _, bits = build_hash(ids)
+    sections = [('ids', ids), ('offsets', offsets), ('text', array('B', text)), ('keys', keys), ('heads', heads)]
+    write_table(path, KIND_NAMES, len(ids), bits, sections)
+    return len(ids)
+
+
+def build(output_dir, calls, names):
+    """Construye el índice de las dos hojas en output_dir"""
+    os.makedirs(output_dir, exist_ok=True)
+    return {
+        'calls': build_calls(calls, os.path.join(output_dir, CALLS_FILE)),
+        'names': build_names(names, os.path.join(output_dir, NAMES_FILE)),
+    }
+
+
+class _Table:
+    """Archivo de write_table() abierto con mmap; las secciones son memoryviews"""
+
+    KIND = None
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, kind, section_count, self.count, bits = HEADER.unpack_from(self._mmap, 0)
+        if magic != TABLE_MAGIC or version != TABLE_VERSION or kind != self.KIND:
+            self._mmap.close()
+            raise ValueError(f"{path} no es un índice válido")
+
+        self._view = memoryview(self._mmap)
+        self._sections = {}
+        for index in range(section_count):
+            name, typecode, offset, size = SECTION.unpack_from(self._mmap, HEADER.size + SECTION.size * index)
+            section = self._view[offset:offset + size].cast(typecode.decode('ascii'))
+            self._sections[name.rstrip(b'\0').decode('ascii')] = section
+        self._mask = (1 << bits) - 1
+        self._shift = 64 - bits
+        self._keys = self._sections['keys']
+        self._heads = self._sections['heads']
+        self.ids = self._sections['ids']
+
+    def __len__(self):
+        return self.count
+
+    def find(self, key):
+        """Primera fila del id, o -1"""
+        keys = self._keys
+        heads = self._heads
+        slot = ((key * HASH_MULTIPLIER) & MASK64) >> self._shift
+        while True:
+            row = heads[slot]
+            if row == EMPTY or keys[slot] == key:
+                return row
+            slot = (slot + 1) & self._mask
+
+    def close(self):
+        for section in self._sections.values():
+            section.release()
+        self._sections.clear()
+        self._view.release()
+        self._mmap.close()
+
+
+class CallTable(_Table):
+    KIND = KIND_CALLS
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.timestamps = self._sections['ts']
+        self._next = self._sections['next']
+        self._order = self._sections.get('order')
+
+    def history(self, caller_id):
+        """Filas del id en orden del archivo"""
+        rows = []
+        row = self.find(caller_id)
+        while row != EMPTY:
+            rows.append(row)
+            row = self._next[row]
+        return rows
+
+    def between(self, start, end):
+        """Filas con start <= fecha < end, en orden de fecha"""
+        low = self._lower_bound(start)
+        high = self._lower_bound(end)
+        if self._order is None:
+            return range(low, high)
+        return self._order[low:high].tolist()
+
+    def _lower_bound(self, value):
+        timestamps = self.timestamps
+        order = self._order
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            row = middle if order is None else order[middle]
+            if timestamps[row] < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+class NameTable(_Table):
+    KIND = KIND_NAMES
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._offsets = self._sections['offsets']
+        self._text = self._sections['text']
+
+    def name(self, caller_id):
+        row = self.find(caller_id)
+        if row == EMPTY:
+            return None
+        return self._text[self._offsets[row]:self._offsets[row + 1]].tobytes().decode('utf-8')
+
+    def names(self, caller_ids):
+        """{id: nombre} con un sondeo del hash por id distinto"""
+        return {caller_id: self.name(caller_id) for caller_id in set(caller_ids)}
+
+
+def join_names(calls, names, rows):
+    """Cruce de filas de llamadas con la hoja de nombres: [(id, fecha, nombre)]
+
+    Hash join: cada id distinto se resuelve una sola vez en el hash de la
+    hoja de nombres y después se arma la columna de nombres de una pasada.
+    Es un bucle de Python por fila, no un cruce vectorizado (no hay numpy);
+    un merge join con bisect sobre los ids ordenados resultó más lento."""
+    ids = calls.ids
+    timestamps = calls.timestamps
+    row_ids = [ids[row] for row in rows]
+    lookup = names.names(row_ids)
+    return [(caller_id, timestamps[row], lookup[caller_id]) for caller_id, row in zip(row_ids, rows)]
+
+
+def index_version(directory):
+    """Identifica la versión de los archivos del índice (cambia al reconstruirlo)"""
+    return tuple((stat.st_ino, stat.st_mtime_ns) for stat in
+                 (os.stat(os.path.join(directory, name)) for name in (CALLS_FILE, NAMES_FILE)))
+
+
+class AsisIndex:
+    """Las dos hojas indexadas de un directorio de build()"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.version = index_version(directory)
+        self.calls = CallTable(os.path.join(directory, CALLS_FILE))
+        self.names = NameTable(os.path.join(directory, NAMES_FILE))
+
+    def caller(self, caller_id, limit=100):
+        """Nombre e historial (las `limit` llamadas más recientes) de un id, o None"""
+        rows = self.calls.history(caller_id)
+        name = self.names.name(caller_id)
+        if not rows and name is None:
+            return None
+        timestamps = self.calls.timestamps
+        calls = sorted((timestamps[row] for row in rows), reverse=True)[:limit]
+        return {
+            'id': caller_id,
+            'name': name,
+            'total_calls': len(rows),
+            'calls': [format_timestamp(seconds) for seconds in calls],
+        }
+
+    def calls_between(self, start, end, limit=1000):
+        """Llamadas con start <= fecha < end (segundos) cruzadas con su nombre"""
+        rows = self.calls.between(start, end)
+        joined = join_names(self.calls, self.names, rows[:limit])
+        return {
+            'total_calls': len(rows),
+            'calls': [{'id': caller_id, 'name': name, 'time': format_timestamp(seconds)}
+                      for caller_id, seconds, name in joined],
+        }
+
+    def stats(self):
+        return {'directory': self.directory, 'calls': len(self.calls), 'names': len(self.names)}
+
+    def close(self):
+        self.calls.close()
+        self.names.close()
+
+
+def open_index(directory):
+    return AsisIndex(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Índice de las hojas de llamadas y nombres')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='Construye el índice')
+    build_parser.add_argument('--output', required=True, help='Directorio del índice')
+    build_parser.add_argument('--asis', help='Archivo con secciones HOJA 1 (llamadas) y HOJA 2 (nombres)')
+    build_parser.add_argument('--calls', help='Hoja de llamadas (TSV o CSV): id, fecha')
+    build_parser.add_argument('--names', help='Hoja de nombres (TSV o CSV): id, nombre')
+    caller_parser = commands.add_parser('caller', help='Nombre e historial de un id')
+    caller_parser.add_argument('--dir', required=True)
+    caller_parser.add_argument('id', type=int)
+    range_parser = commands.add_parser('range', help='Llamadas entre dos fechas')
+    range_parser.add_argument('--dir', required=True)
+    range_parser.add_argument('--limit', type=int, default=1000)
+    range_parser.add_argument('start')
+    range_parser.add_argument('end')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if args.asis:
+            calls, names = read_asis(args.asis, 1), read_asis(args.asis, 2)
+        elif args.calls and args.names:
+            calls, names = read_sheet(args.calls), read_sheet(args.names)
+        else:
+            parser.error('Indique --asis o --calls y --names')
+        counts = build(args.output, calls, names)
+        print(f"{counts['calls']} llamadas y {counts['names']} nombres indexados en {args.output}")
+    elif args.command == 'caller':
+        print(json.dumps(open_index(args.dir).caller(args.id), ensure_ascii=False, indent=2))
+    else:
+        result = open_index(args.dir).calls_between(parse_timestamp(args.start), parse_timestamp(args.end),
+                                                   limit=args.limit)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
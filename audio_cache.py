@@ -0,0 +1,241 @@
+"""Caché de audio sintetizado direccionada por contenido.
+
+La clave es un hash de (SSML final, motor, voz, sample rate, formato), así que
+el mismo texto con la misma configuración siempre produce la misma entrada.
+Tiene dos niveles:
+
+- Memoria: LRU por proceso con presupuesto máximo en bytes.
+- Disco: un archivo por clave, compartido por todos los workers de gunicorn y
+  persistente entre reinicios. Las escrituras son atómicas (archivo temporal +
+  os.replace), por lo que varios workers pueden escribir la misma clave sin
+  corromperla.
+
+El disco también tiene límites: cada lectura actualiza la fecha de
+modificación del archivo, y un barrido periódico (en segundo plano, como
+mucho uno cada `sweep_interval` por proceso) borra lo que lleva más de
+`disk_ttl` sin usarse. Si el total aún supera `max_disk_bytes`, borra los
+menos usados. Así el audio con datos personales (nombres, correos,
+teléfonos) no se queda en disco para siempre.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_DISK_BYTES = 1024 * 1024 * 1024
+DEFAULT_DISK_TTL = 24 * 3600
+DEFAULT_SWEEP_INTERVAL = 300
+
+
+def cache_key(ssml, engine, voice, sample_rate, output_format):
+    """Calcula la clave de contenido de una síntesis"""
+    digest = hashlib.sha256()
+    for part in (ssml, engine, voice, sample_rate, output_format):
+        digest.update(str(part if part is not None else '').encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class AudioCache:
+    """Caché de dos niveles (memoria LRU + disco) para audio de Polly"""
+
+    def __init__(self, max_memory_bytes=DEFAULT_MAX_MEMORY_BYTES, disk_dir=None,
+                 max_disk_bytes=DEFAULT_MAX_DISK_BYTES, disk_ttl=DEFAULT_DISK_TTL,
+                 sweep_interval=DEFAULT_SWEEP_INTERVAL):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir or None
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_ttl = disk_ttl
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+        self._sweeping = False
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'disk_errors': 0,
+            'disk_evictions': 0,
+        }
+
+        if self.disk_dir:
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"No se pudo crear el directorio de caché {self.disk_dir}: {e}")
+                self.disk_dir = None
+
+    def disk_path(self, key):
+        """Ruta del archivo en disco para una clave (None si no hay nivel de disco)"""
+        if not self.disk_dir:
+            return None
+        return os.path.join(self.disk_dir, key[:2], f"{key}.audio")
+
+    def get(self, key):
+        """Devuelve el audio cacheado o None"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return data
+
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['disk_hits'] += 1
+            self._remember(key, data)
+        return data
+
+    def contains(self, key):
+        """True si la clave está en algún nivel (sin contar acierto ni fallo)"""
+        with self._lock:
+            if key in self._entries:
+                return True
+        path = self.disk_path(key)
+        return bool(path) and os.path.exists(path)
+
+    def put(self, key, data):
+        """Guarda el audio en ambos niveles"""
+        with self._lock:
+            self._counters['stores'] += 1
+            self._remember(key, data)
+        self._write_disk(key, data)
+        self._maybe_sweep()
+
+    def stats(self):
+        """Contadores de aciertos/fallos y ocupación de memoria"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._entries)
+            stats['memory_bytes'] = self._memory_bytes
+        stats['max_memory_bytes'] = self.max_memory_bytes
+        stats['disk_enabled'] = bool(self.disk_dir)
+        stats['max_disk_bytes'] = self.max_disk_bytes
+        stats['disk_ttl'] = self.disk_ttl
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_ratio'] = round((lookups - stats['misses']) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _remember(self, key, data):
+        # Debe llamarse con el lock tomado
+        size = len(data)
+        if size > self.max_memory_bytes:
+            return
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+
+        self._entries[key] = data
+        self._memory_bytes += size
+
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self._counters['evictions'] += 1
+
+    def _read_disk(self, key):
+        path = self.disk_path(key)
+        if not path:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # La fecha de modificación hace de "último uso" para el barrido
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Error leyendo caché de audio {path}: {e}")
+            with self._lock:
+                self._counters['disk_errors'] += 1
+            return None
+
+    def _write_disk(self, key, data):
+        path = self.disk_path(key)
+        if not path or os.path.exists(path):
+            return
+        try:
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning(f"Error escribiendo caché de audio {path}: {e}")
+            with self._lock:
+                self._counters['disk_errors'] += 1
+
+    def sweep(self):
+        """Borra del disco lo caducado y, si hace falta, lo menos usado; devuelve los archivos borrados"""
+        if not self.disk_dir:
+            return 0
+        now = time.time()
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((info.st_mtime, info.st_size, path))
+
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, path in files:
+            # Los más antiguos primero: caducados o, mientras sobre espacio, los menos usados
+            if now - mtime < self.disk_ttl and total <= self.max_disk_bytes:
+                break
+            try:
+                os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Error borrando caché de audio {path}: {e}")
+                continue
+            total -= size
+        with self._lock:
+            self._counters['disk_evictions'] += removed
+        return removed
+
+    def _maybe_sweep(self):
+        if not self.disk_dir:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self._sweeping or now - self._last_sweep < self.sweep_interval:
+                return
+            self._sweeping = True
+            self._last_sweep = now
+        threading.Thread(target=self._run_sweep, name='audio-cache-sweep', daemon=True).start()
+
+    def _run_sweep(self):
+        try:
+            self.sweep()
+        except Exception as e:
+            logger.warning(f"Error en el barrido de la caché de audio: {e}")
+        finally:
+            with self._lock:
+                self._sweeping = False
@@ -0,0 +1,232 @@
+"""Negociación del formato del audio sintetizado.
+
+Polly puede devolver mp3, ogg_vorbis o pcm (16 bits con signo, mono,
+little-endian) a varias frecuencias de muestreo. El formato de cada respuesta
+se elige, por orden, a partir de:
+
+1. Los campos `format` y `sample_rate` de la petición.
+2. La cabecera Accept (audio/mpeg, audio/ogg, audio/wav, audio/L16;rate=8000)
+   con sus pesos q.
+3. Las client hints de red: con Save-Data: on o ECT: 3g se pide audio a
+   16 kHz, y con ECT: 2g / slow-2g a 8 kHz (menos bytes por turno).
+
+Sin ninguna pista todo sigue como antes: MP3 a la frecuencia por defecto de
+cada motor, así que las entradas ya cacheadas siguen valiendo. Formato y
+frecuencia forman parte de la clave de la caché, por lo que cada variante se
+cachea por separado.
+
+Formatos que se entregan al cliente:
+
+- mp3: audio/mpeg.
+- ogg: Ogg Vorbis (audio/ogg), más compacto que MP3 a igual calidad.
+- wav: el PCM de Polly con cabecera RIFF (audio/wav).
+- pcm: PCM lineal de 16 bits big-endian (audio/L16, RFC 2586), el que
+  esperan las pasarelas de telefonía a 8 kHz.
+"""
+import struct
+from array import array
+
+OUTPUT_FORMATS = {'mp3': 'mp3', 'ogg': 'ogg_vorbis', 'wav': 'pcm', 'pcm': 'pcm'}
+
+MIMETYPES = {'mp3': 'audio/mpeg', 'ogg': 'audio/ogg', 'wav': 'audio/wav'}
+
+# Frecuencias que acepta Polly para cada OutputFormat
+POLLY_SAMPLE_RATES = {
+    'mp3': ('8000', '16000', '22050', '24000'),
+    'ogg_vorbis': ('8000', '16000', '22050', '24000'),
+    'pcm': ('8000', '16000'),
+}
+DEFAULT_PCM_RATE = '16000'
+
+FORMAT_ALIASES = {
+    'mp3': 'mp3', 'mpeg': 'mp3',
+    'ogg': 'ogg', 'ogg_vorbis': 'ogg', 'vorbis': 'ogg',
+    'wav': 'wav', 'wave': 'wav',
+    'pcm': 'pcm', 'l16': 'pcm',
+}
+
+ACCEPT_TYPES = {
+    'audio/mpeg': 'mp3', 'audio/mp3': 'mp3',
+    'audio/ogg': 'ogg', 'audio/vorbis': 'ogg',
+    'audio/wav': 'wav', 'audio/wave': 'wav', 'audio/x-wav': 'wav',
+    'audio/l16': 'pcm',
+}
+
+# Tamaño que se declara en la cabecera WAV cuando aún no se conoce (streaming)
+UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+class AudioFormat:
+    """Formato de salida: cómo se pide a Polly y cómo se entrega al cliente"""
+
+    __slots__ = ('name', 'output_format', 'sample_rate')
+
+    def __init__(self, name, sample_rate=None):
+        if name not in OUTPUT_FORMATS:
+            raise ValueError(f"Formato de audio no soportado: {name}")
+        self.name = name
+        self.output_format = OUTPUT_FORMATS[name]
+        if sample_rate is None and self.output_format == 'pcm':
+            sample_rate = DEFAULT_PCM_RATE
+        if sample_rate is not None and sample_rate not in POLLY_SAMPLE_RATES[self.output_format]:
+            raise ValueError(f"Frecuencia no soportada para {name}: {sample_rate} "
+                             f"(válidas: {', '.join(POLLY_SAMPLE_RATES[self.output_format])})")
+        # None: la frecuencia por defecto de Polly para el motor
+        self.sample_rate = sample_rate
+
+    def __eq__(self, other):
+        return isinstance(other, AudioFormat) and (self.name, self.sample_rate) == (other.name, other.sample_rate)
+
+    def __hash__(self):
+        return hash((self.name, self.sample_rate))
+
+    def __repr__(self):
+        return f"AudioFormat({self.name!r}, {self.sample_rate!r})"
+
+    @property
+    def mimetype(self):
+        if self.name == 'pcm':
+            return f'audio/L16;rate={self.sample_rate};channels=1'
+        return MIMETYPES[self.name]
+
+    @property
+    def passthrough(self):
+        """True si el audio de Polly se entrega tal cual (sin cabecera ni conversión)"""
+        return self.name in ('mp3', 'ogg')
+
+    def apply(self, params):
+        """Ajusta unos parámetros de synthesize_speech a este formato"""
+        params['OutputFormat'] = self.output_format
+        if self.sample_rate is not None:
+            params['SampleRate'] = self.sample_rate
+        return params
+
+    def url_suffix(self):
+        """Sufijo de /api/audio/<id> para servir el audio en este formato"""
+        if self.name == 'mp3':
+            return ''
+        if self.passthrough:
+            return f'.{self.name}'
+        return f'.{self.name}?rate={self.sample_rate}'
+
+    def encode(self, audio_data):
+        """Audio completo de Polly -> cuerpo de la respuesta"""
+        if self.name == 'wav':
+            return wav_header(int(self.sample_rate), len(audio_data)) + audio_data
+        if self.name == 'pcm':
+            return swap_bytes(audio_data)
+        return audio_data
+
+    def encode_stream(self, chunks):
+        """Como encode() para un iterador de trozos"""
+        try:
+            if self.name == 'wav':
+                yield wav_header(int(self.sample_rate))
+                yield from chunks
+            elif self.name == 'pcm':
+                # Una muestra puede quedar partida entre dos trozos
+                pending = b''
+                for chunk in chunks:
+                    chunk = pending + chunk
+                    even = len(chunk) - len(chunk) % 2
+                    pending = chunk[even:]
+                    if even:
+                        yield swap_bytes(chunk[:even])
+            else:
+                yield from chunks
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+
+DEFAULT_FORMAT = AudioFormat('mp3')
+
+
+def wav_header(sample_rate, data_bytes=None):
+    """Cabecera RIFF de PCM mono de 16 bits (tamaño desconocido si data_bytes es None)"""
+    data_size = UNKNOWN_SIZE if data_bytes is None else data_bytes
+    riff_size = UNKNOWN_SIZE if data_bytes is None else 36 + data_bytes
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', riff_size, b'WAVE', b'fmt ', 16, 1, 1,
+                       sample_rate, sample_rate * 2, 2, 16, b'data', data_size)
+
+
+def swap_bytes(audio_data):
+    """PCM de 16 bits little-endian (Polly) a big-endian (audio/L16)"""
+    samples = array('h')
+    samples.frombytes(audio_data[:len(audio_data) - len(audio_data) % 2])
+    samples.byteswap()
+    return samples.tobytes()
+
+
+def _sample_rate(value):
+    if value is None or value == '':
+        return None
+    try:
+        return str(int(value))
+    except (TypeError, ValueError):
+        raise ValueError(f"Frecuencia no válida: {value}")
+
+
+def parse_accept(header):
+    """Formatos de audio de una cabecera Accept: [(formato, frecuencia)] por preferencia"""
+    ranges = []
+    for position, item in enumerate((header or '').split(',')):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        name = ACCEPT_TYPES.get(media_type.lower())
+        if name is None:
+            continue
+        options = dict(param.split('=', 1) for param in params if '=' in param)
+        try:
+            quality = float(options.get('q', 1))
+        except ValueError:
+            continue
+        if quality > 0:
+            ranges.append((-quality, position, name, options.get('rate')))
+    return [(name, rate) for _, _, name, rate in sorted(ranges)]
+
+
+def hinted_sample_rate(save_data=None, ect=None):
+    """Frecuencia sugerida por las client hints de red (None si la conexión es buena)"""
+    ect = (ect or '').strip().lower()
+    if ect in ('slow-2g', '2g'):
+        return '8000'
+    if ect == '3g' or (save_data or '').strip().lower() == 'on':
+        return '16000'
+    return None
+
+
+def negotiate(format_name=None, sample_rate=None, accept=None, save_data=None, ect=None):
+    """AudioFormat para una petición. Lanza ValueError si lo pedido en los campos
+    explícitos no existe; lo que no encaja de la cabecera Accept se ignora."""
+    sample_rate = _sample_rate(sample_rate)
+    if format_name:
+        name = FORMAT_ALIASES.get(str(format_name).lower())
+        if name is None:
+            raise ValueError(f"Formato de audio no soportado: {format_name}")
+        return AudioFormat(name, sample_rate or hinted_sample_rate(save_data, ect))
+
+    hinted = hinted_sample_rate(save_data, ect)
+    for name, accept_rate in parse_accept(accept):
+        try:
+            return AudioFormat(name, sample_rate or _sample_rate(accept_rate) or hinted)
+        except ValueError:
+            continue
+    if sample_rate is None and hinted is None:
+        return DEFAULT_FORMAT
+    return AudioFormat('mp3', sample_rate or hinted)
+
+
+def negotiate_request(fields, headers, use_accept=True):
+    """negotiate() con los campos de la petición (dict) y sus cabeceras.
+
+    Con use_accept=False se ignora la cabecera Accept: la que envía un <audio>
+    del navegador lista lo que sabe reproducir, no una preferencia."""
+    return negotiate(fields.get('format'), fields.get('sample_rate'),
+                     accept=headers.get('accept') if use_accept else None,
+                     save_data=headers.get('save-data'),
+                     ect=headers.get('ect'))
+
+
+def format_for_extension(extension, sample_rate=None):
+    """AudioFormat de una URL /api/audio/<id>.<extensión>; ValueError si no existe"""
+    return AudioFormat(extension or 'mp3', _sample_rate(sample_rate))
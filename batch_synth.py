@@ -0,0 +1,333 @@
+"""Síntesis por lotes (prompts, variantes de SSML, campañas de recordatorios).
+
+La entrada es un JSONL con un texto por línea:
+
+    {"id": "recordatorio-001", "text": "Le recordamos su cita del lunes.", "engine": "neural"}
+
+Campos opcionales por línea: id, engine, voice, text_type ("text" o "ssml"),
+output_format y sample_rate; los que falten se toman de las opciones del lote.
+
+Cada audio se guarda en el directorio de salida con su clave de contenido
+(audio/<ab>/<clave>.<ext>), así dos líneas iguales se sintetizan una sola vez.
+Cada resultado se añade a manifest.jsonl en cuanto termina, de modo que un lote
+interrumpido se reanuda sin repetir lo ya hecho. Las llamadas a Polly se
+reparten en un pool acotado de hilos con un límite de peticiones por segundo.
+
+    python batch_synth.py textos.jsonl --output lote/ --engine neural --rate 8
+    python batch_synth.py textos.jsonl --output lote/ --stub      # Polly local de pruebas
+"""
+import argparse
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_RATE = 8.0  # Peticiones/s, la cuota por defecto de Polly para neural
+
+JOB_FILE = 'job.json'
+INPUT_FILE = 'input.jsonl'
+MANIFEST_FILE = 'manifest.jsonl'
+SUMMARY_FILE = 'summary.json'
+LOCK_FILE = '.lock'
+
+# Campos de una línea de entrada que se pueden fijar para todo el lote
+ITEM_OPTIONS = ('engine', 'voice', 'text_type', 'output_format', 'sample_rate')
+
+EXTENSIONS = {'mp3': 'mp3', 'ogg_vorbis': 'ogg', 'pcm': 'pcm'}
+
+
+class RateLimiter:
+    """Token bucket compartido por los hilos: acquire() espera su turno"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+def read_items(path):
+    """Lee el JSONL de entrada; cada línea necesita al menos 'text'"""
+    items = []
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{number}: JSON inválido ({e})")
+            if not isinstance(item, dict) or not item.get('text'):
+                raise ValueError(f"{path}:{number}: falta el campo 'text'")
+            item.setdefault('id', f'line-{number}')
+            items.append(item)
+    return items
+
+
+def read_manifest(path):
+    """Último resultado de cada id en el manifest (ignora una línea final a medias)"""
+    results = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                results[record['id']] = record
+    except FileNotFoundError:
+        pass
+    return results
+
+
+def write_atomic(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def create_job(output_dir, items, options=None):
+    """Prepara el directorio de un lote con su entrada y sus opciones"""
+    os.makedirs(output_dir, exist_ok=True)
+    lines = ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in items)
+    write_atomic(os.path.join(output_dir, INPUT_FILE), lines.encode('utf-8'))
+    write_atomic(os.path.join(output_dir, JOB_FILE),
+                 json.dumps(options or {}, ensure_ascii=False).encode('utf-8'))
+
+
+class BatchJob:
+    """Un lote de síntesis sobre un directorio de salida.
+
+    prepare(item) devuelve los parámetros de synthesize_speech de una línea,
+    key(params) su clave de contenido y synthesize(params) el audio."""
+
+    def __init__(self, output_dir, prepare, key, synthesize, input_path=None,
+                 workers=DEFAULT_WORKERS, rate=DEFAULT_RATE):
+        self.output_dir = output_dir
+        self.input_path = input_path or os.path.join(output_dir, INPUT_FILE)
+        self.prepare = prepare
+        self.key = key
+        self.synthesize = synthesize
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.counters = {'items': 0, 'skipped': 0, 'ok': 0, 'failed': 0, 'deduplicated': 0, 'bytes': 0}
+        self.started_at = None
+        self.finished_at = None
+        self._cancelled = threading.Event()
+        # Clave en síntesis -> Event que se activa al terminar (bien o mal)
+        self._in_flight = {}
+        self._keys_lock = threading.Lock()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.output_dir, MANIFEST_FILE)
+
+    def audio_path(self, key, output_format):
+        extension = EXTENSIONS.get(output_format, output_format)
+        return os.path.join(self.output_dir, 'audio', key[:2], f'{key}.{extension}')
+
+    def cancel(self):
+        """Deja de lanzar síntesis nuevas; las que están en vuelo terminan"""
+        self._cancelled.set()
+
+    def run(self):
+        """Sintetiza las líneas pendientes y devuelve el resumen.
+
+        Un lock sobre el directorio impide que dos procesos lo ejecuten a la vez."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, LOCK_FILE), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise RuntimeError(f"El lote {self.output_dir} ya se está ejecutando")
+            return self._run()
+
+    def _run(self):
+        self.started_at = time.time()
+        # Un resumen de una ejecución anterior ya no vale mientras se reanuda
+        try:
+            os.remove(os.path.join(self.output_dir, SUMMARY_FILE))
+        except FileNotFoundError:
+            pass
+        items = read_items(self.input_path)
+        done = read_manifest(self.manifest_path)
+        self.counters['items'] = len(items)
+
+        pending = []
+        for item in items:
+            record = done.get(item['id'])
+            if record and record['status'] == 'ok' and os.path.exists(os.path.join(self.output_dir, record['file'])):
+                self.counters['skipped'] += 1
+            else:
+                pending.append(item)
+
+        with open(self.manifest_path, 'a', encoding='utf-8') as manifest, \
+                ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='batch-synth') as pool:
+            in_flight = set()
+            for item in pending:
+                if self._cancelled.is_set():
+                    break
+                # Como mucho dos tareas por hilo en cola: no se crean millones de futures
+                if len(in_flight) >= self.workers * 2:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    self._record(manifest, finished)
+                in_flight.add(pool.submit(self._process, item))
+            self._record(manifest, wait(in_flight).done)
+
+        self.finished_at = time.time()
+        summary = self.status()
+        if not self._cancelled.is_set():
+            write_atomic(os.path.join(self.output_dir, SUMMARY_FILE),
+                         json.dumps(summary, ensure_ascii=False, indent=2).encode('utf-8'))
+        logger.info(f"Lote de síntesis terminado: {summary}")
+        return summary
+
+    def status(self):
+        if self.finished_at:
+            state = 'cancelled' if self._cancelled.is_set() else 'finished'
+        else:
+            state = 'running' if self.started_at else 'pending'
+        elapsed = (self.finished_at or time.time()) - self.started_at if self.started_at else 0.0
+        return {'status': state, **self.counters, 'seconds': round(elapsed, 3)}
+
+    def _process(self, item):
+        started = time.monotonic()
+        record = {'id': item['id']}
+        try:
+            params = self.prepare(item)
+            key = self.key(params)
+            path = self.audio_path(key, params['OutputFormat'])
+            record.update(key=key, file=os.path.relpath(path, self.output_dir),
+                          engine=params.get('Engine', 'standard'), voice=params['VoiceId'],
+                          characters=len(params['Text']))
+
+            if self._claim(key, path):
+                try:
+                    self.limiter.acquire()
+                    audio_data = self.synthesize(params)
+                    write_atomic(path, audio_data)
+                    record['bytes'] = len(audio_data)
+                finally:
+                    with self._keys_lock:
+                        self._in_flight.pop(key).set()
+            else:
+                record['deduplicated'] = True
+            record['status'] = 'ok'
+        except Exception as e:
+            logger.warning(f"Síntesis por lotes falló para {item['id']}: {e}")
+            record.update(status='failed', error=str(e))
+        record['seconds'] = round(time.monotonic() - started, 3)
+        return record
+
+    def _claim(self, key, path):
+        """True si esta línea debe sintetizar la clave; False si el archivo ya existe.
+
+        Si otra línea con el mismo contenido lo está sintetizando se espera a
+        su resultado: si falló, esta línea lo vuelve a intentar."""
+        while True:
+            with self._keys_lock:
+                original = self._in_flight.get(key)
+                if original is None:
+                    if os.path.exists(path):
+                        return False
+                    self._in_flight[key] = threading.Event()
+                    return True
+            original.wait()
+
+    def _record(self, manifest, futures):
+        # Solo el hilo que lanza el lote escribe en el manifest
+        for future in futures:
+            record = future.result()
+            manifest.write(json.dumps(record, ensure_ascii=False) + '\n')
+            if record['status'] == 'ok':
+                self.counters['ok'] += 1
+                self.counters['bytes'] += record.get('bytes', 0)
+                if record.get('deduplicated'):
+                    self.counters['deduplicated'] += 1
+            else:
+                self.counters['failed'] += 1
+        manifest.flush()
+
+
+def job_status(output_dir):
+    """Estado de un lote leído del disco (sirve desde cualquier worker)"""
+    summary_path = os.path.join(output_dir, SUMMARY_FILE)
+    if os.path.exists(summary_path):
+        with open(summary_path, encoding='utf-8') as f:
+            return json.load(f)
+    if not os.path.exists(os.path.join(output_dir, INPUT_FILE)):
+        return None
+
+    with open(os.path.join(output_dir, INPUT_FILE), encoding='utf-8') as f:
+        items = sum(1 for line in f if line.strip())
+    records = read_manifest(os.path.join(output_dir, MANIFEST_FILE)).values()
+    ok = sum(1 for record in records if record['status'] == 'ok')
+    failed = sum(1 for record in records if record['status'] != 'ok')
+    return {'status': 'incomplete', 'items': items, 'ok': ok, 'failed': failed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Síntesis por lotes a partir de un JSONL de textos')
+    parser.add_argument('input', help='JSONL con un {"text": ...} por línea')
+    parser.add_argument('--output', required=True, help='Directorio de salida (se reanuda si ya existe)')
+    parser.add_argument('--engine', help='Motor por defecto (generative, neural o standard)')
+    parser.add_argument('--voice', help='Voz por defecto')
+    parser.add_argument('--output-format', help='mp3, ogg_vorbis o pcm')
+    parser.add_argument('--sample-rate', help='Sample rate en Hz')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Síntesis simultáneas')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help='Máximo de peticiones por segundo')
+    parser.add_argument('--stub', action='store_true', help='Usar un Polly local de pruebas')
+    parser.add_argument('--stub-latency', type=float, default=0.05, help='Latencia simulada del stub (s)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.stub and 'AUDIO_CACHE_DIR' not in os.environ:
+        # No mezclar audio falso con la caché real
+        os.environ['AUDIO_CACHE_DIR'] = os.path.join(tempfile.gettempdir(), 'sofia-audio-cache-stub')
+
+    import app as sofia
+    from warmup import StubPolly
+
+    options = {name: getattr(args, name) for name in ITEM_OPTIONS if getattr(args, name, None)}
+    polly = StubPolly(latency=args.stub_latency) if args.stub else None
+    job = sofia.create_batch_job(args.output, options, polly=polly, input_path=args.input,
+                                 workers=args.workers, rate=args.rate)
+    try:
+        print(json.dumps(job.run(), ensure_ascii=False))
+    except KeyboardInterrupt:
+        job.cancel()
+        print("Interrumpido: vuelva a lanzar el mismo comando para reanudar")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Benchmark del índice de llamantes (asis_index.py).
+
+Genera una hoja de llamadas (id, fecha) y una de nombres en TSV con el
+formato de ASIS.txt y mide: construcción del índice, apertura con mmap (lo
+que paga cada worker al arrancar), búsquedas por id, historial, consultas
+por rango de fechas y el cruce con los nombres.
+
+    python benchmarks/bench_asis.py [--rows 10000000] [--callers 1000000] [--shuffle]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asis_index  # noqa: E402
+
+START = asis_index.parse_timestamp('01/01/2025 0:00')
+
+
+def write_sheets(directory, rows, callers, shuffle, seed):
+    """Hojas TSV con cabecera como las de ASIS.txt; las llamadas en orden de fecha salvo --shuffle"""
+    rng = random.Random(seed)
+    calls_path = os.path.join(directory, 'hoja1.tsv')
+    names_path = os.path.join(directory, 'hoja2.tsv')
+    # Un registro de llamadas real llega en orden; con --shuffle se fuerza el índice por fecha
+    step = 86400 * 365 / rows
+    with open(calls_path, 'w', encoding='utf-8') as f:
+        f.write('A\tB\n')
+        batch = []
+        for row in range(rows):
+            offset = rng.randrange(rows) if shuffle else row
+            seconds = START + int(offset * step)
+            day = asis_index.format_timestamp(seconds)
+            batch.append(f"{rng.randint(1, callers)}\t{day[8:10]}/{day[5:7]}/{day[:4]} "
+                         f"{int(day[11:13])}:{day[14:16]}:{day[17:19]}\n")
+            if len(batch) == 100000:
+                f.writelines(batch)
+                batch.clear()
+        f.writelines(batch)
+    with open(names_path, 'w', encoding='utf-8') as f:
+        f.write('A\tB\n')
+        f.writelines(f"{caller_id}\tLLAMANTE {caller_id}\n" for caller_id in range(1, callers + 1))
+    return calls_path, names_path
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def run(args, directory):
+    print(f"Generando {args.rows} llamadas de {args.callers} llamantes...")
+    calls_path, names_path = write_sheets(directory, args.rows, args.callers, args.shuffle, args.seed)
+    sheet_mb = (os.path.getsize(calls_path) + os.path.getsize(names_path)) / 1e6
+
+    index_dir = os.path.join(directory, 'index')
+    counts, seconds = timed(asis_index.build, index_dir,
+                            asis_index.read_sheet(calls_path), asis_index.read_sheet(names_path))
+    index_mb = sum(os.path.getsize(os.path.join(index_dir, name)) for name in os.listdir(index_dir)) / 1e6
+    print(f"build        {seconds:8.2f} s  {counts['calls'] / seconds:>12,.0f} filas/s  "
+          f"hojas {sheet_mb:.0f} MB -> índice {index_mb:.0f} MB")
+
+    rss_before = rss_mb()
+    index, seconds = timed(asis_index.open_index, index_dir)
+    print(f"open (mmap)  {seconds * 1000:8.2f} ms  RSS +{rss_mb() - rss_before:.1f} MB")
+
+    rng = random.Random(args.seed)
+    ids = [rng.randint(1, args.callers) for _ in range(args.lookups)]
+    _, seconds = timed(lambda: [index.calls.find(caller_id) for caller_id in ids])
+    print(f"find         {args.lookups / seconds:>12,.0f} búsquedas/s  {seconds / args.lookups * 1e6:6.2f} us")
+
+    _, seconds = timed(lambda: [index.names.name(caller_id) for caller_id in ids])
+    print(f"name         {args.lookups / seconds:>12,.0f} búsquedas/s  {seconds / args.lookups * 1e6:6.2f} us")
+
+    sample = ids[:args.lookups // 10]
+    _, seconds = timed(lambda: [index.caller(caller_id) for caller_id in sample])
+    print(f"caller       {len(sample) / seconds:>12,.0f} historiales/s  "
+          f"(~{args.rows / args.callers:.0f} llamadas por llamante)")
+
+    windows = [START + rng.randrange(86400 * 360) for _ in range(1000)]
+    rows_found, seconds = timed(lambda: sum(len(index.calls.between(start, start + 3600)) for start in windows))
+    print(f"range 1h     {len(windows) / seconds:>12,.0f} consultas/s  ({rows_found / len(windows):.0f} filas por consulta)")
+
+    rows = list(index.calls.between(START, START + 86400 * 7))[:args.join_rows]
+    joined, seconds = timed(asis_index.join_names, index.calls, index.names, rows)
+    print(f"join         {len(joined) / seconds:>12,.0f} filas/s  ({len(joined)} filas de una semana)")
+    index.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--callers', type=int, default=1_000_000)
+    parser.add_argument('--lookups', type=int, default=200_000)
+    parser.add_argument('--join-rows', type=int, default=200_000)
+    parser.add_argument('--shuffle', action='store_true', help='Llamadas desordenadas por fecha')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dir', help='Directorio de trabajo (por defecto uno temporal que se borra)')
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix='bench-asis-')
+    try:
+        run(args, directory)
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Microbenchmark del compilador de SSML.
+
+Compara la construcción anterior (str.replace por palabra + tres re.sub) con
+la pasada única de ssml.py, con y sin memoización, sobre respuestas reales de
+la conversación.
+
+    python benchmarks/bench_ssml.py [--iterations N]
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ssml  # noqa: E402
+
+REPLY_TEXTS = (
+    """¡Bienvenido a TusAbogados.com! Para personalizar su atención, ¿con quién tengo el gusto de hablar?
+
+Por favor, dígame su nombre.""",
+    """Mucho gusto Juan Pérez. Para orientarle mejor, necesito saber su rol en el caso.
+
+¿Es usted:
+- "Víctima": por ejemplo, si sufrió un accidente de tránsito, le deben dinero, fue estafado, o sufrió algún daño o perjuicio.
+- "Demandante": por ejemplo, si quiere iniciar una demanda por divorcio, reclamar una herencia, demandar por incumplimiento de contrato, o exigir sus derechos laborales.
+
+¿Se considera víctima o demandante en esta situación?""",
+    """Entendido Juan Pérez, como víctima. Ahora necesito saber el tipo de caso.
+
+Por ejemplo:
+- "Categoría Civil": si quiere demandar por divorcio, reclamar una herencia, exigir cumplimiento de contrato, o resolver problemas de propiedad.
+- "Categoría Laboral": por ejemplo si va a demandar por despido injustificado, acoso laboral, o para reclamar prestaciones laborales.
+- "Categoría Penal": si va a denunciar por robos, agresiones, amenazas, o estafas.
+
+¿En qué categoría cree que está su caso?""",
+    "¿En qué categoría está su caso: civil, laboral o penal?",
+    "Hola, soy Claudia García, tu abogada virtual. Revisaré el contrato y el proceso judicial de custodia y pensión alimentaria.",
+)
+
+
+def legacy_body(text):
+    """Construcción anterior: 14 str.replace + 3 re.sub"""
+    for word in ssml.PRONUNCIATION_LEXICON:
+        text = text.replace(word, f"<emphasis level=\"moderate\">{word}</emphasis>")
+    text = re.sub(r'([.!?])', r'\1<break time="500ms"/>', text)
+    text = re.sub(r'(,)', r'\1<break time="200ms"/>', text)
+    text = re.sub(r'(:)', r'\1<break time="300ms"/>', text)
+    return text
+
+
+def legacy_both_engines(text):
+    # Antes cada motor repetía todo el trabajo
+    return legacy_body(text), legacy_body(text)
+
+
+def compiled_both_engines(text):
+    body = ssml.compile_ssml_body.__wrapped__
+    return body(text), body(text)
+
+
+def memoized_both_engines(text):
+    return ssml.create_generative_ssml(text), ssml.create_ssml_text(text)
+
+
+def run(iterations):
+    total_chars = sum(len(text) for text in REPLY_TEXTS)
+    results = {}
+    for name, func in (('legacy', legacy_both_engines),
+                       ('single_pass', compiled_both_engines),
+                       ('memoized', memoized_both_engines)):
+        seconds = timeit.timeit(lambda: [func(text) for text in REPLY_TEXTS], number=iterations)
+        results[name] = {
+            'replies_per_sec': round(iterations * len(REPLY_TEXTS) / seconds),
+            'mb_per_sec': round(iterations * total_chars / seconds / 1e6, 2),
+            'us_per_reply': round(seconds / (iterations * len(REPLY_TEXTS)) * 1e6, 2)
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    for name, stats in run(args.iterations).items():
+        print(f"{name:12s} {stats['replies_per_sec']:>10d} respuestas/s  "
+              f"{stats['mb_per_sec']:>7.2f} MB/s  {stats['us_per_reply']:>8.2f} us/respuesta")
+
+
+if __name__ == '__main__':
+    main()
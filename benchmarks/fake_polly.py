@@ -0,0 +1,196 @@
+"""Servidor HTTP local que imita la API de Amazon Polly (SynthesizeSpeech).
+
+Atiende POST /v1/speech con el mismo protocolo REST-JSON que usa botocore,
+así la app se prueba tal cual apuntando POLLY_ENDPOINT_URL a este servidor:
+
+    python benchmarks/fake_polly.py --port 9000 --latency 0.15 --error-rate 0.01
+    POLLY_ENDPOINT_URL=http://127.0.0.1:9000 AWS_ACCESS_KEY=x AWS_SECRET_KEY=y python app.py
+
+Simula la latencia (con variación), errores internos, throttling por encima de
+un número de peticiones por segundo y motores no disponibles. GET /stats
+devuelve los contadores.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from warmup import silent_mp3  # noqa: E402
+
+
+class TokenBucket:
+    """Limitador de peticiones por segundo con ráfaga de un segundo"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class FakePollyServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, latency=0.1, jitter=0.0, error_rate=0.0, throttle_rps=None,
+                 unsupported_engines=(), seed=None):
+        super().__init__(address, FakePollyHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle = TokenBucket(throttle_rps) if throttle_rps else None
+        self.unsupported_engines = frozenset(unsupported_engines)
+        self.random = random.Random(seed)
+        self.counters = {'requests': 0, 'ok': 0, 'errors': 0, 'throttled': 0, 'unsupported': 0, 'characters': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def delay(self):
+        with self._lock:
+            variation = self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+            fail = self.random.random() < self.error_rate
+        return max(0.0, self.latency + variation), fail
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+class FakePollyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.split('?')[0] != '/v1/speech':
+            self.send_error_json(404, 'UnknownOperationException', 'Unknown operation')
+            return
+
+        server = self.server
+        server.count('requests')
+        params = json.loads(body or b'{}')
+        text = params.get('Text', '')
+
+        if server.throttle and not server.throttle.take():
+            server.count('throttled')
+            self.send_error_json(400, 'ThrottlingException', 'Rate exceeded')
+            return
+        if params.get('Engine', 'standard') in server.unsupported_engines:
+            server.count('unsupported')
+            self.send_error_json(400, 'ValidationException',
+                                 'This voice does not support the selected engine')
+            return
+
+        latency, fail = server.delay()
+        time.sleep(latency)
+        if fail:
+            server.count('errors')
+            self.send_error_json(500, 'ServiceFailureException', 'Simulated service failure')
+            return
+
+        audio = silent_mp3(text)
+        server.count('ok')
+        server.count('characters', len(text))
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/mpeg')
+        self.send_header('Content-Length', str(len(audio)))
+        self.send_header('x-amzn-RequestCharacters', str(len(text)))
+        self.end_headers()
+        self.wfile.write(audio)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_error_json(404, 'NotFound', 'Not found')
+            return
+        self.send_json(200, self.server.stats())
+
+    def send_error_json(self, status, error_type, message):
+        self.send_json(status, {'message': message}, {'x-amzn-ErrorType': error_type})
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Una línea por petición falsearía la medida con carga alta
+        pass
+
+
+def start_fake_polly(host='127.0.0.1', port=0, **options):
+    """Arranca el servidor en un hilo y lo devuelve (server.url, server.shutdown())"""
+    server = FakePollyServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name='fake-polly', daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    """Opciones del servidor falso (compartidas con loadtest.py)"""
+    parser.add_argument('--latency', type=float, default=0.15, help='Latencia media de Polly (s)')
+    parser.add_argument('--jitter', type=float, default=0.05, help='Variación de la latencia (± s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fracción de respuestas 500')
+    parser.add_argument('--throttle-rps', type=float, default=None,
+                        help='Peticiones/s a partir de las que se responde ThrottlingException')
+    parser.add_argument('--unsupported-engines', default='',
+                        help='Motores rechazados, separados por comas (p. ej. generative)')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def options_from_args(args):
+    return {
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'error_rate': args.error_rate,
+        'throttle_rps': args.throttle_rps,
+        'unsupported_engines': tuple(filter(None, args.unsupported_engines.split(','))),
+        'seed': args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Polly local para pruebas de carga')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakePollyServer((args.host, args.port), **options_from_args(args))
+    print(f"Polly falso escuchando en {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
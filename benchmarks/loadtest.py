@@ -0,0 +1,466 @@
+"""Prueba de carga de la app contra un Polly falso local.
+
+Cada usuario virtual reproduce conversaciones completas (saludo → nombre →
+rol → categoría → descripción → correo → teléfono → cita → cierre) como lo
+hace el navegador: un POST /api/chat por turno y la síntesis de la respuesta.
+Para cada configuración de servidor se arranca gunicorn con la app apuntando
+a benchmarks/fake_polly.py y se mide peticiones/s, latencias p50/p95/p99 por
+endpoint y memoria (RSS) por worker.
+
+    python benchmarks/loadtest.py --users 32 --duration 30 \\
+        --config sync:workers=4,threads=8 --config asgi:workers=2 \\
+        --latency 0.2 --error-rate 0.01 --output results.json
+
+    # Falla (código 1) si empeora más de un 15 % respecto a una ejecución anterior
+    python benchmarks/loadtest.py --baseline results.json --tolerance 0.15
+
+Con --target se mide un servidor ya arrancado (sin Polly falso ni memoria).
+La memoria se lee de /proc, así que solo se informa en Linux.
+"""
+import argparse
+import datetime
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+import requests
+
+import fake_polly
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_CONFIGS = ('sync:workers=1,threads=1', 'sync:workers=4,threads=8', 'asgi:workers=2')
+
+# Conversaciones que recorren las ramas del flujo de dialogue.py
+SCENARIOS = (
+    ('hola', '{name}', 'soy víctima', 'civil',
+     'Me chocaron el carro y el conductor no quiere pagar los daños',
+     '{email}', '{phone}', 'sí', 'no gracias'),
+    ('buenas tardes', '{name}', 'demandante', 'laboral',
+     'Me despidieron sin justa causa después de cinco años en la empresa',
+     '{email}', '{phone}', 'no me viene', 'sí', 'nada más'),
+    ('buenos días', '{name}', 'víctima', 'no sé', 'penal',
+     'Me robaron el celular y tengo la denuncia', 'repita', '{email}', '{phone}',
+     'ok', 'tengo otra consulta sobre la herencia de mi padre', 'listo'),
+)
+
+NAMES = ('Juan Pérez', 'Ana Gómez', 'Luis Martínez', 'María Rodríguez', 'Pedro Sánchez', 'Lucía Torres')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} no respondió en {timeout}s")
+
+
+def parse_config(spec):
+    """'sync:workers=4,threads=8' -> {'name': spec, 'mode': 'sync', 'workers': 4, 'threads': 8}"""
+    mode, _, options = spec.partition(':')
+    if mode not in ('sync', 'asgi'):
+        raise ValueError(f"Modo de servidor desconocido: {mode}")
+    config = {'name': spec, 'mode': mode, 'workers': 1, 'threads': 1}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        config[key.strip()] = int(value)
+    return config
+
+
+def gunicorn_command(config, port):
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(config['workers']), '--log-level', 'warning']
+    if config['mode'] == 'asgi':
+        return command + ['-k', 'uvicorn.workers.UvicornWorker', 'asgi:app']
+    return command + ['--threads', str(config['threads']), 'app:app']
+
+
+class Percentiles:
+    """Muestras de latencia de un endpoint (percentiles exactos por rango)"""
+
+    def __init__(self):
+        self.samples = []
+        self.errors = 0
+
+    def summary(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {'count': 0, 'errors': self.errors}
+
+        def rank(q):
+            return samples[min(len(samples) - 1, max(0, int(q * len(samples) + 0.5) - 1))]
+
+        return {
+            'count': len(samples),
+            'errors': self.errors,
+            'mean_ms': round(sum(samples) / len(samples) * 1000, 2),
+            'p50_ms': round(rank(0.50) * 1000, 2),
+            'p95_ms': round(rank(0.95) * 1000, 2),
+            'p99_ms': round(rank(0.99) * 1000, 2),
+            'max_ms': round(samples[-1] * 1000, 2),
+        }
+
+
+class LoadRun:
+    """Usuarios virtuales que reproducen conversaciones durante un tiempo fijo"""
+
+    def __init__(self, base_url, users, duration, speak_mode):
+        self.base_url = base_url
+        self.users = users
+        self.duration = duration
+        self.speak_mode = speak_mode
+        self.endpoints = {}
+        self.conversations = 0
+        self.degraded = 0
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok):
+        with self._lock:
+            stats = self.endpoints.setdefault(endpoint, Percentiles())
+            if ok:
+                stats.samples.append(seconds)
+            else:
+                stats.errors += 1
+
+    def request(self, http, endpoint, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = http.request(method, self.base_url + url, timeout=60, **kwargs)
+            response.content  # noqa: B018 - medir hasta el último byte
+        except requests.RequestException:
+            self.record(endpoint, time.perf_counter() - started, False)
+            return None
+        self.record(endpoint, time.perf_counter() - started, response.status_code == 200)
+        return response if response.status_code == 200 else None
+
+    def speak(self, http, text):
+        if self.speak_mode == 'none':
+            return
+        if self.speak_mode in ('json', 'url'):
+            body = {'text': text, 'transport': 'url'} if self.speak_mode == 'url' else {'text': text}
+            response = self.request(http, '/api/speak', 'POST', '/api/speak', json=body)
+            if response is None:
+                return
+            data = response.json()
+            if data.get('useBrowserTTS'):
+                with self._lock:
+                    self.degraded += 1
+            elif self.speak_mode == 'url':
+                self.request(http, '/api/audio', 'GET', data['audioUrl'])
+            return
+        pipeline = '&pipeline=1' if self.speak_mode == 'pipeline' else ''
+        self.request(http, f'/api/speak/stream ({self.speak_mode})', 'GET',
+                     f'/api/speak/stream?text={quote(text)}{pipeline}')
+
+    def user(self, index, deadline):
+        http = requests.Session()
+        turn = 0
+        while time.monotonic() < deadline:
+            scenario = SCENARIOS[(index + turn) % len(SCENARIOS)]
+            name = NAMES[(index + turn) % len(NAMES)]
+            values = {'name': name, 'email': f'usuario{index}.{turn}@example.com', 'phone': f'300{index:03d}{turn:04d}'}
+            # Cada conversación es una llamada nueva: sin la cookie de sesión anterior
+            http.cookies.clear()
+            session_id = None
+            for message in scenario:
+                if time.monotonic() >= deadline:
+                    return
+                body = {'message': message.format(**values)}
+                if session_id:
+                    body['session_id'] = session_id
+                if self.speak_mode == 'turn':
+                    # Texto y audio en la misma respuesta SSE; el primer evento es el texto
+                    response = self.request(http, '/api/turn', 'POST', '/api/turn', json=body)
+                    if response is None:
+                        break
+                    first_event = response.text.split('\n\n', 1)[0]
+                    data = json.loads(first_event.split('data: ', 1)[1])
+                    session_id = data.get('session_id')
+                    continue
+                response = self.request(http, '/api/chat', 'POST', '/api/chat', json=body)
+                if response is None:
+                    break
+                data = response.json()
+                session_id = data.get('session_id')
+                self.speak(http, data['response'])
+            else:
+                with self._lock:
+                    self.conversations += 1
+            turn += 1
+
+    def run(self):
+        started = time.monotonic()
+        deadline = started + self.duration
+        threads = [threading.Thread(target=self.user, args=(index, deadline), daemon=True)
+                   for index in range(self.users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.monotonic() - started
+
+        endpoints = {name: stats.summary() for name, stats in sorted(self.endpoints.items())}
+        requests_ok = sum(summary['count'] for summary in endpoints.values())
+        errors = sum(summary['errors'] for summary in endpoints.values())
+        return {
+            'seconds': round(seconds, 2),
+            'requests': requests_ok + errors,
+            'errors': errors,
+            'degraded_speak': self.degraded,
+            'rps': round(requests_ok / seconds, 1),
+            'conversations': self.conversations,
+            'endpoints': endpoints,
+        }
+
+
+class MemorySampler:
+    """Muestrea el RSS de los workers de gunicorn (hijos del proceso maestro)"""
+
+    def __init__(self, master_pid, interval=0.5):
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peak = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        if not self.peak:
+            return None
+        rss = sorted(self.peak.values())
+        return {
+            'workers': len(rss),
+            'master_rss_mb': _mb(_rss_kb(self.master_pid)),
+            'worker_rss_mb_max': _mb(rss[-1]),
+            'worker_rss_mb_mean': _mb(sum(rss) / len(rss)),
+            'total_rss_mb': _mb(sum(rss) + (_rss_kb(self.master_pid) or 0)),
+        }
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        for pid in _children(self.master_pid):
+            rss = _rss_kb(pid)
+            if rss:
+                self.peak[pid] = max(rss, self.peak.get(pid, 0))
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir('/proc') if os.path.isdir('/proc') else ():
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat:
+                # El nombre del proceso va entre paréntesis y puede tener espacios
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def _rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def _mb(kilobytes):
+    return round(kilobytes / 1024, 1) if kilobytes is not None else None
+
+
+def fake_polly_stats(url):
+    try:
+        return requests.get(f'{url}/stats', timeout=2).json()
+    except requests.RequestException:
+        return None
+
+
+def run_config(config, args, polly_url):
+    """Arranca gunicorn con la configuración, lanza la carga y lo para"""
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix='sofia-loadtest-')
+    env = dict(os.environ,
+               AWS_ACCESS_KEY='loadtest', AWS_SECRET_KEY='loadtest',
+               POLLY_ENDPOINT_URL=polly_url,
+               SESSION_BACKEND='sqlite', SESSION_DB_PATH=os.path.join(workdir, 'sessions.db'),
+               SCHEDULER_DB_PATH=os.path.join(workdir, 'schedule.db'),
+               INTAKE_LOG_DIR=os.path.join(workdir, 'intakes'),
+               AUDIO_CACHE_DIR=os.path.join(workdir, 'audio-cache'),
+               AUDIO_WARMUP='0')
+    if config['mode'] == 'asgi':
+        env.setdefault('POLLY_MAX_POOL_CONNECTIONS', env.get('POLLY_MAX_CONCURRENCY', '64'))
+    if args.no_cache:
+        env.update(AUDIO_CACHE_DIR='', AUDIO_CACHE_MAX_BYTES='0')
+
+    # El log de la app (una línea por síntesis) va a fichero para no mezclarlo con el informe
+    log_path = os.path.join(workdir, 'server.log')
+    with open(log_path, 'wb') as log:
+        server = subprocess.Popen(gunicorn_command(config, port), cwd=ROOT, env=env,
+                                  stdout=log, stderr=subprocess.STDOUT)
+    sampler = None
+    try:
+        base_url = f'http://127.0.0.1:{port}'
+        try:
+            wait_until_up(f'{base_url}/api/health')
+        except RuntimeError:
+            raise RuntimeError(f"{config['name']} no arrancó; ver {log_path}")
+        sampler = MemorySampler(server.pid)
+        sampler.start()
+        polly_before = fake_polly_stats(polly_url)
+        result = LoadRun(base_url, args.users, args.duration, args.speak_mode).run()
+        polly_after = fake_polly_stats(polly_url)
+    finally:
+        memory = sampler.stop() if sampler else None
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    result = {'config': config['name'], **{key: config[key] for key in config if key != 'name'}, **result}
+    result['memory'] = memory
+    result['server_log'] = log_path
+    if polly_before and polly_after:
+        result['polly'] = {key: polly_after[key] - polly_before.get(key, 0) for key in polly_after}
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Regresiones frente a una ejecución anterior (mismo nombre de configuración)"""
+    previous = {run['config']: run for run in baseline.get('runs', [])}
+    regressions = []
+    for run in results['runs']:
+        old = previous.get(run['config'])
+        if old is None:
+            continue
+        if old['rps'] and run['rps'] < old['rps'] * (1 - tolerance):
+            regressions.append(f"{run['config']}: rps {old['rps']} -> {run['rps']}")
+        for endpoint, summary in run['endpoints'].items():
+            old_p95 = old['endpoints'].get(endpoint, {}).get('p95_ms')
+            if old_p95 and summary.get('p95_ms', 0) > old_p95 * (1 + tolerance):
+                regressions.append(f"{run['config']} {endpoint}: p95 {old_p95} ms -> {summary['p95_ms']} ms")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_run(run):
+    memory = run.get('memory') or {}
+    print(f"\n{run['config']}: {run['rps']} peticiones/s, {run['conversations']} conversaciones, "
+          f"{run['errors']} errores, {run['degraded_speak']} con TTS del navegador")
+    if memory:
+        print(f"  memoria: {memory['workers']} workers, máx {memory['worker_rss_mb_max']} MB/worker, "
+              f"total {memory['total_rss_mb']} MB")
+    for endpoint, summary in run['endpoints'].items():
+        if summary['count']:
+            print(f"  {endpoint:32s} n={summary['count']:<6d} p50={summary['p50_ms']:>8.1f} ms  "
+                  f"p95={summary['p95_ms']:>8.1f} ms  p99={summary['p99_ms']:>8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prueba de carga de /api/chat y /api/speak')
+    parser.add_argument('--config', action='append',
+                        help=f"Servidor a probar, p. ej. sync:workers=4,threads=8 o asgi:workers=2 "
+                             f"(por defecto: {' '.join(DEFAULT_CONFIGS)})")
+    parser.add_argument('--target', help='URL de un servidor ya arrancado (no se arranca gunicorn)')
+    parser.add_argument('--users', type=int, default=16, help='Usuarios virtuales concurrentes')
+    parser.add_argument('--duration', type=float, default=20, help='Segundos de carga por configuración')
+    parser.add_argument('--speak-mode', choices=('json', 'url', 'stream', 'pipeline', 'turn', 'none'), default='json',
+                        help='Cómo se sintetiza cada respuesta (turn: /api/turn en lugar de chat + speak)')
+    parser.add_argument('--no-cache', action='store_true', help='Desactivar la caché de audio de la app')
+    parser.add_argument('--output', help='Fichero JSON de resultados')
+    parser.add_argument('--baseline', help='Resultados anteriores con los que comparar')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Empeoramiento admitido (fracción)')
+    fake_polly.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = {
+        'generated_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'options': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'runs': [],
+    }
+
+    if args.target:
+        run = LoadRun(args.target.rstrip('/'), args.users, args.duration, args.speak_mode).run()
+        results['runs'].append({'config': args.target, **run})
+        print_run(results['runs'][-1])
+    else:
+        polly_port = free_port()
+        polly = subprocess.Popen([sys.executable, os.path.join(ROOT, 'benchmarks', 'fake_polly.py'),
+                                  '--port', str(polly_port), *polly_arguments(args)],
+                                 stdout=subprocess.DEVNULL)
+        polly_url = f'http://127.0.0.1:{polly_port}'
+        try:
+            wait_until_up(f'{polly_url}/stats')
+            for spec in args.config or DEFAULT_CONFIGS:
+                results['runs'].append(run_config(parse_config(spec), args, polly_url))
+                print_run(results['runs'][-1])
+        finally:
+            polly.terminate()
+            polly.wait()
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, ensure_ascii=False)
+        print(f"\nResultados en {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESIÓN {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+def polly_arguments(args):
+    options = ['--latency', str(args.latency), '--jitter', str(args.jitter), '--error-rate', str(args.error_rate)]
+    if args.throttle_rps:
+        options += ['--throttle-rps', str(args.throttle_rps)]
+    if args.unsupported_engines:
+        options += ['--unsupported-engines', args.unsupported_engines]
+    if args.seed is not None:
+        options += ['--seed', str(args.seed)]
+    return options
+
+
+if __name__ == '__main__':
+    main()
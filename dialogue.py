@@ -0,0 +1,405 @@
+"""Flujo de conversación de Sofía como máquina de estados declarativa.
+
+Cada estado indica el dato (slot) que espera, el mensaje con el que se pide,
+el mensaje para repetir la pregunta y sus transiciones. El estado actual no
+se guarda aparte: es el primero cuyo slot sigue vacío en la sesión.
+
+La intención del mensaje se clasifica con un único autómata Aho-Corasick
+construido con todas las palabras clave, así que cada turno cuesta
+O(longitud del mensaje) sin importar cuántos estados o palabras clave haya.
+"""
+import copy
+from collections import deque
+from string import Formatter
+
+from session_store import SESSION_FIELDS
+
+END_CALL_MARKER = '[LLAMADA FINALIZADA]'
+
+# Mensaje libre simulado en likely_replies(): si aparece en la respuesta, esta
+# depende de lo que diga el usuario y no se puede anticipar
+SPECULATIVE_TEXT = '\x00'
+
+# Palabras clave por intención (se buscan como subcadena del mensaje en minúsculas)
+INTENT_KEYWORDS = {
+    'greeting': ('hola', 'buenos días', 'buenas tardes', 'saludos', 'buenos', 'buenas', 'iniciar', 'empezar'),
+    'victim': ('víctima', 'victima'),
+    'civil': ('civil',),
+    'laboral': ('laboral',),
+    'penal': ('penal',),
+    'accept': ('sí', 'si', 'ok', 'de acuerdo', 'confirmo', 'sí acepto', 'si acepto'),
+    'reject': ('no', 'no me viene', 'otro horario', 'otra hora'),
+    'close': ('no', 'nada más', 'eso es todo', 'no gracias', 'listo', 'ya está', 'ya esta'),
+    'repeat': ('repetir', 'repita', 'no entendí'),
+    'farewell': ('gracias', 'adiós', 'chao', 'hasta luego'),
+}
+
+
+class KeywordMatcher:
+    """Autómata Aho-Corasick: todas las intenciones presentes en una pasada"""
+
+    def __init__(self, keywords_by_intent):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [frozenset()]
+
+        for intent, keywords in keywords_by_intent.items():
+            for keyword in keywords:
+                node = 0
+                for char in keyword:
+                    next_node = self._goto[node].get(char)
+                    if next_node is None:
+                        next_node = len(self._goto)
+                        self._goto[node][char] = next_node
+                        self._goto.append({})
+                        self._fail.append(0)
+                        self._output.append(frozenset())
+                    node = next_node
+                self._output[node] = self._output[node] | {intent}
+
+        # Enlaces de fallo en anchura; cada nodo hereda las salidas de su fallo
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] = self._output[child] | self._output[self._fail[child]]
+
+    def intents(self, text):
+        """Conjunto de intenciones cuyas palabras clave aparecen en el texto"""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found |= output[node]
+        return found
+
+
+class Transition:
+    """Regla de un estado: si se cumple, fija el slot (opcional) y responde.
+
+    `action(session, scheduler)` se ejecuta al aplicar la regla; si devuelve
+    una plantilla, esa sustituye a `reply`."""
+
+    __slots__ = ('intent', 'min_length', 'value', 'reply', 'action')
+
+    def __init__(self, reply, intent=None, min_length=None, value=None, action=None):
+        self.intent = intent
+        self.min_length = min_length
+        self.value = value
+        self.reply = reply
+        self.action = action
+
+    def matches(self, intents, message):
+        if self.intent is not None and self.intent not in intents:
+            return False
+        if self.min_length is not None and len(message.strip()) < self.min_length:
+            return False
+        return True
+
+
+class State:
+    """Paso del flujo: pide `slot` con `prompt` y lo rellena según sus reglas.
+
+    Si `captures` es True cualquier mensaje rellena el slot: con el valor de
+    la primera intención de `choices` presente, con `default`, o con el texto
+    del mensaje si no hay choices. Si no, solo lo rellenan las transiciones.
+    `on_enter(session, scheduler)` se ejecuta al llegar al estado y, como las
+    acciones de las transiciones, puede devolver otra plantilla."""
+
+    __slots__ = ('name', 'slot', 'prompt', 'reprompt', 'captures', 'choices', 'default', 'transitions', 'on_enter')
+
+    def __init__(self, name, slot, prompt, reprompt, captures=True, choices=(), default=None, transitions=(),
+                 on_enter=None):
+        self.name = name
+        self.slot = slot
+        self.prompt = prompt
+        self.reprompt = reprompt
+        self.captures = captures
+        self.choices = choices
+        self.default = default
+        self.transitions = transitions
+        self.on_enter = on_enter
+
+    def capture(self, message, intents):
+        if not self.choices:
+            return message.strip()
+        for intent, value in self.choices:
+            if intent in intents:
+                return value
+        return self.default
+
+
+# Mensajes del flujo; los campos entre llaves se rellenan con los datos de la sesión
+WELCOME_PROMPT = """¡Bienvenido a TusAbogados.com! Para personalizar su atención, ¿con quién tengo el gusto de hablar?
+
+Por favor, dígame su nombre."""
+
+ROLE_PROMPT = """Mucho gusto {user_name}. Para orientarle mejor, necesito saber su rol en el caso.
+
+¿Es usted:
+- "Víctima": por ejemplo, si sufrió un accidente de tránsito, le deben dinero, fue estafado, o sufrió algún daño o perjuicio.
+- "Demandante": por ejemplo, si quiere iniciar una demanda por divorcio, reclamar una herencia, demandar por incumplimiento de contrato, o exigir sus derechos laborales.
+
+¿Se considera víctima o demandante en esta situación?"""
+
+CATEGORY_PROMPT = """Entendido {user_name}, como {user_role}. Ahora necesito saber el tipo de caso.
+
+Por ejemplo:
+- "Categoría Civil": si quiere demandar por divorcio, reclamar una herencia, exigir cumplimiento de contrato, o resolver problemas de propiedad.
+- "Categoría Laboral": por ejemplo si va a demandar por despido injustificado, acoso laboral, o para reclamar prestaciones laborales.  
+- "Categoría Penal": si va a denunciar por robos, agresiones, amenazas, o estafas.
+
+Si no está seguro a qué categoría pertenece su caso, puede decir: "No sé cuál es mi categoría" o "La desconozco".
+
+¿En qué categoría cree que está su caso?"""
+
+DESCRIPTION_PROMPT = """Categoría {case_category} registrada. 
+
+Por favor, descríbame brevemente su caso para entender mejor su situación."""
+
+EMAIL_PROMPT = """Gracias {user_name} por la información. 
+
+Para agendar su cita y enviarle la confirmación, necesito su correo electrónico.
+
+¿Cuál es su correo electrónico?"""
+
+PHONE_PROMPT = """Correo registrado correctamente.
+
+Ahora necesito un número de teléfono para contactarle.
+
+¿Cuál es su número de contacto?"""
+
+FIRST_SLOT_PROMPT = """¡Perfecto {user_name}! Tenemos toda la información necesaria.
+
+Le propongo el primer horario disponible:
+¿Le viene bien el {offered_time}?
+
+Responda "sí" para confirmar o "no" para otro horario."""
+
+NEXT_SLOT_PROMPT = """Entiendo. Le propongo:
+{offered_time}.
+
+¿Le funciona este horario?"""
+
+SLOT_TAKEN_PROMPT = """Lo siento {user_name}, ese horario se acaba de ocupar. Le propongo:
+{offered_time}.
+
+¿Le funciona este horario?"""
+
+APPOINTMENT_CONFIRMED = """¡Cita confirmada {user_name}!
+
+Fecha: {appointment_time}
+Confirmación enviada a: {user_email}
+Teléfono de contacto: {user_phone}
+
+Recuerde: si su caso supera los 10 millones, no hay costo inicial. Solo paga el 10% si recuperamos su dinero.
+
+¿Hay algo más en lo que pueda ayudarle?"""
+
+NO_SLOTS_MESSAGE = """Lo siento {user_name}, en este momento no tenemos más horarios disponibles.
+
+Uno de nuestros abogados le llamará al {user_phone} para acordar la cita.
+
+¿Hay algo más en lo que pueda ayudarle?"""
+
+# Valor de appointment_time cuando no quedan horarios que ofrecer
+NO_SLOT_VALUE = 'pendiente de acordar por teléfono'
+
+GOODBYE_MESSAGE = """¡Perfecto {user_name}! 
+
+Ha sido un placer ayudarle. Un abogado se contactará con usted en la fecha acordada.
+
+Esta llamada se finalizará automáticamente. ¡Que tenga un excelente día!
+
+[LLAMADA FINALIZADA]"""
+
+ADDITIONAL_QUERY_MESSAGE = """Entendido {user_name}. 
+
+He registrado su consulta adicional. Uno de nuestros abogados especializados se contactará con usted según los datos agendados y le ampliará toda la información al respecto.
+
+¿Hay alguna otra cosa en la que pueda asistirle?"""
+
+FAREWELL_MESSAGE = """Gracias a usted {user_name}. 
+
+Esta llamada se finalizará automáticamente. ¡Que tenga un excelente día!
+
+[LLAMADA FINALIZADA]"""
+
+REPROMPT_NAME = "Por favor, dígame su nombre para continuar."
+REPROMPT_ROLE = "¿Se considera víctima o demandante en este caso?"
+REPROMPT_CATEGORY = "¿En qué categoría está su caso: civil, laboral o penal?"
+REPROMPT_EMAIL = "Necesito su correo electrónico para enviarle la confirmación."
+REPROMPT_PHONE = "Necesito su número de teléfono para contactarle."
+REPROMPT_APPOINTMENT = "¿Le viene bien el {offered_time}?"
+REPROMPT_ANYTHING_ELSE = "¿Hay algo más en lo que pueda ayudarle?"
+
+def offer_slot(session, scheduler, after=None):
+    """Retiene para la sesión el siguiente horario libre de su categoría"""
+    slot = scheduler.hold(session.case_category, session.session_id, after=after)
+    if slot is None:
+        session.offered_slot = None
+        session.offered_time = None
+        session.appointment_time = NO_SLOT_VALUE
+        return NO_SLOTS_MESSAGE
+    session.offered_slot = slot.slot_id
+    session.offered_time = scheduler.spoken(slot)
+    return None
+
+
+def offer_next_slot(session, scheduler):
+    """Libera el horario rechazado y ofrece el siguiente posterior"""
+    after = None
+    if session.offered_slot:
+        scheduler.release(session.offered_slot, session.session_id)
+        after = scheduler.slot_start(session.offered_slot)
+    return offer_slot(session, scheduler, after=after)
+
+
+def confirm_slot(session, scheduler):
+    """Reserva el horario ofrecido; si ya no está disponible ofrece otro"""
+    slot = scheduler.confirm(session.offered_slot, session.session_id) if session.offered_slot else None
+    if slot is None:
+        return offer_slot(session, scheduler) or SLOT_TAKEN_PROMPT
+    session.appointment_time = scheduler.label(slot)
+    return None
+
+
+# Estados en orden; el actual es el primero con el slot vacío
+STATES = (
+    State('name', 'user_name', WELCOME_PROMPT, REPROMPT_NAME),
+    State('role', 'user_role', ROLE_PROMPT, REPROMPT_ROLE,
+          choices=(('victim', 'víctima'),), default='demandante'),
+    State('category', 'case_category', CATEGORY_PROMPT, REPROMPT_CATEGORY,
+          choices=(('civil', 'civil'), ('laboral', 'laboral'), ('penal', 'penal')), default='no definida'),
+    State('description', 'case_description', DESCRIPTION_PROMPT, REPROMPT_EMAIL),
+    State('email', 'user_email', EMAIL_PROMPT, REPROMPT_EMAIL),
+    State('phone', 'user_phone', PHONE_PROMPT, REPROMPT_PHONE),
+    State('appointment', 'appointment_time', FIRST_SLOT_PROMPT, REPROMPT_APPOINTMENT, captures=False,
+          on_enter=offer_slot,
+          transitions=(
+              Transition(APPOINTMENT_CONFIRMED, intent='accept', action=confirm_slot),
+              Transition(NEXT_SLOT_PROMPT, intent='reject', action=offer_next_slot),
+          )),
+    State('followup', None, REPROMPT_ANYTHING_ELSE, REPROMPT_ANYTHING_ELSE, captures=False,
+          transitions=(
+              Transition(GOODBYE_MESSAGE, intent='close'),
+              Transition(ADDITIONAL_QUERY_MESSAGE, min_length=6),
+          )),
+)
+
+STATES_BY_NAME = {state.name: state for state in STATES}
+
+MATCHER = KeywordMatcher(INTENT_KEYWORDS)
+
+
+def current_state(session):
+    """Primer estado cuyo slot aún no tiene valor"""
+    for state in STATES:
+        if state.slot is None or getattr(session, state.slot) is None:
+            return state
+
+
+def render(template, session):
+    """Rellena una plantilla con los datos de la sesión ('' si faltan)"""
+    return template.format(**{field: getattr(session, field) or '' for field in SESSION_FIELDS})
+
+
+def template_fields(template):
+    """Campos de sesión que usa una plantilla"""
+    return {field for _, field, _, _ in Formatter().parse(template) if field}
+
+
+def reply_templates():
+    """Todas las plantillas con las que se puede responder, sin repetir"""
+    templates = [WELCOME_PROMPT, FAREWELL_MESSAGE, GOODBYE_MESSAGE, SLOT_TAKEN_PROMPT, NO_SLOTS_MESSAGE]
+    for state in STATES:
+        templates.extend((state.prompt, state.reprompt))
+        templates.extend(transition.reply for transition in state.transitions)
+    return tuple(dict.fromkeys(templates))
+
+
+def static_prompts():
+    """Mensajes del flujo que no dependen de datos del usuario"""
+    return tuple(template for template in reply_templates() if not template_fields(template))
+
+
+def enter(state, session, scheduler):
+    """Respuesta al llegar a un estado (ejecutando su on_enter)"""
+    template = state.on_enter(session, scheduler) if state.on_enter else None
+    return render(template or state.prompt, session)
+
+
+def next_response(session, message, scheduler):
+    """Avanza la conversación con el mensaje del usuario y devuelve la respuesta.
+
+    scheduler es la agenda (scheduler.py) de la que salen los horarios ofrecidos."""
+    intents = MATCHER.intents(message.lower())
+
+    # Un saludo siempre reinicia la conversación (y suelta el horario retenido)
+    if 'greeting' in intents:
+        if session.offered_slot and session.appointment_time is None:
+            scheduler.release(session.offered_slot, session.session_id)
+        session.reset()
+        return render(STATES_BY_NAME['name'].prompt, session)
+
+    state = current_state(session)
+
+    if state.captures:
+        setattr(session, state.slot, state.capture(message, intents))
+        return enter(current_state(session), session, scheduler)
+
+    for transition in state.transitions:
+        if transition.matches(intents, message):
+            if transition.value is not None:
+                setattr(session, state.slot, transition.value)
+            template = transition.action(session, scheduler) if transition.action else None
+            return render(template or transition.reply, session)
+
+    # Agradecimientos y cierre automático (la petición de repetir tiene prioridad)
+    if 'farewell' in intents and 'repeat' not in intents:
+        return render(FAREWELL_MESSAGE, session)
+
+    # Repetición o respuesta por defecto: volver a preguntar lo pendiente
+    return render(state.reprompt, session)
+
+
+def likely_messages(state):
+    """Mensajes representativos de lo que el usuario puede contestar en un estado"""
+    if state.captures:
+        # Una palabra clave por opción y un texto libre (valor por defecto o dato capturado)
+        return [INTENT_KEYWORDS[intent][0] for intent, _ in state.choices] + [SPECULATIVE_TEXT]
+    messages = []
+    for transition in state.transitions:
+        if transition.intent:
+            messages.append(INTENT_KEYWORDS[transition.intent][0])
+        elif transition.min_length:
+            messages.append(SPECULATIVE_TEXT * transition.min_length)
+    return messages
+
+
+def likely_replies(session, scheduler):
+    """Respuestas que puede dar el próximo turno: [(etiqueta, texto)].
+
+    Simula next_response() con cada mensaje de likely_messages() sobre una
+    copia de la sesión. scheduler debe ser de solo lectura
+    (scheduler.PreviewScheduler) para que la simulación no retenga horarios.
+    Las respuestas que dependen del texto libre del usuario se descartan. La
+    etiqueta ('estado:n') identifica la predicción para contar sus aciertos."""
+    state = current_state(session)
+    replies = []
+    for index, message in enumerate(likely_messages(state)):
+        reply = next_response(copy.copy(session), message, scheduler)
+        if SPECULATIVE_TEXT not in reply:
+            replies.append((f"{state.name}:{index}", reply))
+    return replies
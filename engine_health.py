@@ -0,0 +1,154 @@
+"""Estado de salud de los motores de Polly (circuit breaker por motor).
+
+Si el motor generativo no está disponible en la región, cada /api/speak
+perdía una llamada completa antes de pasar a neural. Aquí cada motor tiene un
+circuito:
+
+- closed: se usa normalmente.
+- open: tras `failure_threshold` errores seguidos se salta durante un tiempo
+  de espera que se duplica en cada apertura consecutiva (hasta `max_cooldown`).
+- half_open: pasado el tiempo de espera se deja pasar una sola petición de
+  prueba; si funciona el circuito se cierra y si falla vuelve a abrirse.
+
+candidates() solo consulta el estado; la prueba la toma acquire() justo antes
+de llamar al motor, así que un motor que no llega a intentarse no gasta la
+prueba de nadie. El throttling de Polly no es una caída del motor y no cuenta
+como fallo; si le toca a la petición de prueba, la prueba se libera.
+
+El estado es por proceso: cada worker aprende por su cuenta.
+"""
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Errores que dependen del texto y no de la salud del motor
+TEXT_ERROR_CODES = frozenset({
+    'InvalidSsmlException',
+    'TextLengthExceededException',
+})
+
+# Límites de uso de la cuenta: el motor funciona, solo hay que ir más despacio
+THROTTLING_CODES = frozenset({
+    'ThrottlingException',
+    'Throttling',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+})
+
+
+class _Circuit:
+    __slots__ = ('state', 'failures', 'trips', 'opened_at', 'trial_started_at', 'last_error', 'successes')
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self.trial_started_at = None
+        self.last_error = None
+        self.successes = 0
+
+
+class EngineHealth:
+    """Circuit breaker por motor con recuperación periódica (half-open)"""
+
+    def __init__(self, engines, failure_threshold=3, cooldown=60, max_cooldown=600, trial_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.trial_timeout = trial_timeout
+        self._circuits = {engine: _Circuit() for engine in engines}
+        self._lock = threading.Lock()
+
+    def candidates(self, chain):
+        """Motores de la cadena que se pueden intentar ahora, en orden (sin cambiar su estado).
+
+        Si todos tienen el circuito abierto se devuelve el último de la cadena
+        para no dejar la petición sin intentar nada."""
+        now = time.monotonic()
+        with self._lock:
+            available = [engine for engine in chain if self._available(self._circuits[engine], now)]
+        return available or [chain[-1]]
+
+    def preferred(self, chain):
+        """Motor con el que se intentaría sintetizar ahora (sin cambiar su estado)"""
+        return self.candidates(chain)[0]
+
+    def acquire(self, engine):
+        """Reserva el intento de un motor justo antes de llamarlo.
+
+        Con el circuito abierto y el tiempo de espera cumplido pasa a half_open
+        y esta petición es la de prueba. False si otra petición ya la tiene."""
+        now = time.monotonic()
+        with self._lock:
+            circuit = self._circuits[engine]
+            if not self._available(circuit, now):
+                return False
+            if circuit.state != CLOSED:
+                circuit.state = HALF_OPEN
+                circuit.trial_started_at = now
+            return True
+
+    def record_success(self, engine):
+        with self._lock:
+            circuit = self._circuits[engine]
+            circuit.state = CLOSED
+            circuit.failures = 0
+            circuit.trips = 0
+            circuit.opened_at = None
+            circuit.trial_started_at = None
+            circuit.successes += 1
+
+    def record_failure(self, engine, error):
+        """Registra un error del motor; los errores del propio texto y el throttling no cuentan"""
+        counted = not (isinstance(error, ClientError) and
+                       error.response.get('Error', {}).get('Code') in TEXT_ERROR_CODES | THROTTLING_CODES)
+        with self._lock:
+            circuit = self._circuits[engine]
+            if not counted:
+                # La prueba no dice nada del motor: se libera para la siguiente petición
+                # (sigue abierto con el mismo tiempo de espera, ya cumplido)
+                if circuit.state == HALF_OPEN:
+                    circuit.state = OPEN
+                    circuit.trial_started_at = None
+                return
+            circuit.failures += 1
+            circuit.last_error = str(error)
+            if circuit.state == HALF_OPEN or circuit.failures >= self.failure_threshold:
+                circuit.state = OPEN
+                circuit.trips += 1
+                circuit.opened_at = time.monotonic()
+                circuit.trial_started_at = None
+
+    def snapshot(self):
+        """Estado de cada motor para /api/health"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                engine: {
+                    'state': circuit.state,
+                    'consecutive_failures': circuit.failures,
+                    'successes': circuit.successes,
+                    'last_error': circuit.last_error,
+                    'retry_in_seconds': round(max(0.0, circuit.opened_at + self._cooldown(circuit) - now), 1)
+                    if circuit.state == OPEN else None
+                }
+                for engine, circuit in self._circuits.items()
+            }
+
+    def _cooldown(self, circuit):
+        return min(self.cooldown * 2 ** max(0, circuit.trips - 1), self.max_cooldown)
+
+    def _available(self, circuit, now):
+        # Debe llamarse con el lock tomado
+        if circuit.state == CLOSED:
+            return True
+        if circuit.state == OPEN:
+            return now - circuit.opened_at >= self._cooldown(circuit)
+        # half_open: una sola prueba en vuelo; si se quedó colgada se permite otra
+        return now - circuit.trial_started_at >= self.trial_timeout
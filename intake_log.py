@@ -0,0 +1,370 @@
+"""Registro de intakes (los datos que recoge la conversación).
+
+Cada vez que un turno cambia los datos de una conversación se añade una
+instantánea al registro, así quedan tanto los intakes completos como los que
+se abandonaron a medias. El registro es de solo añadir:
+
+- Cada proceso escribe su propio segmento JSONL (intakes-<host>-<pid>-...),
+  por lo que varios workers nunca compiten por el mismo archivo ni por un lock.
+- La petición solo encola el registro. Un hilo de fondo vacía la cola y
+  escribe todo lo acumulado con un único write + fsync (group commit): con
+  más carga los lotes son más grandes, no hay más fsync.
+- Si la cola se llena (disco colgado) los registros se descartan y se cuentan
+  en lugar de bloquear la petición.
+
+Los registros llevan datos personales (nombre, correo, teléfono): el
+directorio se crea con permisos 0700 y los segmentos con 0600. Cada segmento
+se cierra al llenarse o al cumplir `segment_seconds` (un día), y el hilo de
+escritura borra cada hora los segmentos con más de `retention_days` sin
+escribirse: ningún registro dura más de retention_days + segment_seconds.
+
+La última instantánea de cada intake_id es el estado final del intake.
+export_columnar() la vuelca en un formato binario por columnas para análisis:
+
+    python intake_log.py export --dir /tmp/sofia-intakes --output intakes.col
+    python intake_log.py show intakes.col
+    python intake_log.py prune --dir /tmp/sofia-intakes --days 30
+"""
+import argparse
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_QUEUE = 100000
+DEFAULT_MAX_BATCH = 5000
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+DEFAULT_SEGMENT_SECONDS = 86400
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_PRUNE_INTERVAL = 3600
+
+SEGMENT_PATTERN = 'intakes-*.jsonl'
+
+# Columnas de la exportación: (nombre, tipo) con 's' texto, 'd' float64, 'b' booleano
+COLUMNS = (
+    ('intake_id', 's'),
+    ('session_id', 's'),
+    ('ts', 'd'),
+    ('complete', 'b'),
+    ('needs_callback', 'b'),
+    ('stage', 's'),
+    ('user_name', 's'),
+    ('user_role', 's'),
+    ('case_category', 's'),
+    ('case_description', 's'),
+    ('user_email', 's'),
+    ('user_phone', 's'),
+    ('appointment_time', 's'),
+)
+
+COLUMNAR_MAGIC = b'SOFIACOL'
+COLUMNAR_VERSION = 1
+
+
+class IntakeLog:
+    """Registro de solo añadir con escritura en un hilo de fondo"""
+
+    def __init__(self, directory, fsync=True, max_queue=DEFAULT_MAX_QUEUE,
+                 max_batch=DEFAULT_MAX_BATCH, segment_bytes=DEFAULT_SEGMENT_BYTES,
+                 segment_seconds=DEFAULT_SEGMENT_SECONDS, retention_days=DEFAULT_RETENTION_DAYS,
+                 prune_interval=DEFAULT_PRUNE_INTERVAL):
+        self.directory = directory
+        self.fsync = fsync
+        self.max_batch = max_batch
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        # 0 o None: sin borrado automático
+        self.retention_days = retention_days
+        self.prune_interval = prune_interval
+        self._max_queue = max_queue
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._counters = {'appended': 0, 'written': 0, 'batches': 0, 'dropped': 0, 'write_errors': 0, 'pruned': 0}
+        self._file = None
+        self._file_path = None
+        self._opened = 0
+        self._segment = 0
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        try:
+            os.chmod(directory, 0o700)
+        except OSError as e:
+            logger.warning(f"No se pudieron restringir los permisos de {directory}: {e}")
+        atexit.register(self.close)
+
+    def append(self, record):
+        """Encola un registro; nunca espera al disco"""
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(record)
+            # Contadores sin lock: aproximados, pero sin contención en la petición
+            self._counters['appended'] += 1
+        except queue.Full:
+            self._counters['dropped'] += 1
+
+    def flush(self, timeout=5):
+        """Espera a que lo encolado hasta ahora esté escrito (y sincronizado)"""
+        if self._thread is None or self._pid != os.getpid():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=5):
+        """Escribe lo pendiente y para el hilo de escritura"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats['queued'] = self._queue.qsize() if self._queue is not None else 0
+        stats['directory'] = self.directory
+        stats['fsync'] = self.fsync
+        stats['retention_days'] = self.retention_days
+        stats['segment_seconds'] = self.segment_seconds
+        return stats
+
+    def segment_path(self):
+        started = time.strftime('%Y%m%dT%H%M%S')
+        return os.path.join(self.directory,
+                            f'intakes-{socket.gethostname()}-{os.getpid()}-{started}-{self._segment}.jsonl')
+
+    def _ensure_writer(self):
+        # Un hilo por proceso: tras un fork el hilo del padre no existe en el hijo
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue(maxsize=self._max_queue)
+            self._file = None
+            self._thread = threading.Thread(target=self._run, name='intake-log', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        stop = False
+        next_maintenance = 0
+        while not stop:
+            # Sin tráfico el hilo se despierta igualmente para rotar y borrar a tiempo
+            if time.monotonic() >= next_maintenance:
+                self._maintenance()
+                next_maintenance = time.monotonic() + self.prune_interval
+            try:
+                batch = [self._queue.get(timeout=max(next_maintenance - time.monotonic(), 0))]
+            except queue.Empty:
+                continue
+            # Todo lo que ya espera en la cola va en el mismo commit
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            records = [item for item in batch if isinstance(item, dict)]
+            if records:
+                self._write(records)
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+                elif item is None:
+                    stop = True
+
+        self._close_segment()
+
+    def _maintenance(self):
+        # El segmento abierto no se borra aunque lleve tiempo sin escribirse
+        if self._file is not None and self._segment_expired():
+            self._close_segment()
+        if self.retention_days:
+            self._counters['pruned'] += prune(self.directory, self.retention_days * 86400, keep=self._file_path)
+
+    def _segment_expired(self):
+        return (self._file.tell() >= self.segment_bytes
+                or (self.segment_seconds and time.time() - self._opened >= self.segment_seconds))
+
+    def _write(self, records):
+        data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8')
+        try:
+            if self._file is None or self._segment_expired():
+                self._open_segment()
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        except OSError as e:
+            logger.error(f"Error escribiendo el registro de intakes: {e}")
+            self._counters['write_errors'] += 1
+            return
+        self._counters['written'] += len(records)
+        self._counters['batches'] += 1
+
+    def _open_segment(self):
+        self._close_segment()
+        if self.retention_days:
+            self._counters['pruned'] += prune(self.directory, self.retention_days * 86400)
+        self._file_path = self.segment_path()
+        fd = os.open(self._file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self._file = os.fdopen(fd, 'ab')
+        self._opened = time.time()
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self._file_path = None
+        self._segment += 1
+
+
+def prune(directory, max_age, keep=None):
+    """Borra los segmentos sin escribir desde hace más de max_age segundos; devuelve cuántos"""
+    cutoff = time.time() - max_age
+    removed = 0
+    for path in glob.glob(os.path.join(directory, SEGMENT_PATTERN)):
+        if path == keep:
+            continue
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+                removed += 1
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            logger.warning(f"No se pudo borrar el segmento {path}: {e}")
+    return removed
+
+
+def read_records(directory):
+    """Todos los registros de todos los segmentos (ignora líneas a medias)"""
+    for path in sorted(glob.glob(os.path.join(directory, SEGMENT_PATTERN))):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def latest_intakes(records):
+    """Última instantánea de cada intake, en orden de llegada"""
+    latest = {}
+    for record in records:
+        intake_id = record.get('intake_id')
+        if intake_id and (intake_id not in latest or record.get('ts', 0) >= latest[intake_id].get('ts', 0)):
+            latest[intake_id] = record
+    return list(latest.values())
+
+
+def export_columnar(rows, path):
+    """Escribe las filas en formato por columnas.
+
+    Formato: cabecera (magic, versión, filas, columnas) y después, por cada
+    columna, su nombre, su tipo, una máscara de nulos (1 byte por fila) y los
+    valores: float64 o uint8 empaquetados, o para texto los offsets uint32
+    (filas + 1) seguidos de los bytes UTF-8 concatenados."""
+    count = len(rows)
+    # Datos personales: solo legible por el propietario
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+        f.write(COLUMNAR_MAGIC)
+        f.write(struct.pack('<HII', COLUMNAR_VERSION, count, len(COLUMNS)))
+        for name, kind in COLUMNS:
+            values = [row.get(name) for row in rows]
+            encoded_name = name.encode('utf-8')
+            f.write(struct.pack('<B', len(encoded_name)) + encoded_name + kind.encode('ascii'))
+            f.write(bytes(0 if value is None else 1 for value in values))
+
+            if kind == 'd':
+                f.write(array('d', (float(value or 0) for value in values)).tobytes())
+            elif kind == 'b':
+                f.write(bytes(1 if value else 0 for value in values))
+            else:
+                blobs = [str(value).encode('utf-8') if value is not None else b'' for value in values]
+                offsets = array('I', [0])
+                for blob in blobs:
+                    offsets.append(offsets[-1] + len(blob))
+                f.write(offsets.tobytes())
+                f.write(b''.join(blobs))
+    return count
+
+
+def read_columnar(path):
+    """Lee un archivo de export_columnar() como {columna: lista de valores}"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(COLUMNAR_MAGIC)] != COLUMNAR_MAGIC:
+        raise ValueError(f"{path} no es una exportación de intakes")
+    offset = len(COLUMNAR_MAGIC)
+    version, count, column_count = struct.unpack_from('<HII', data, offset)
+    if version != COLUMNAR_VERSION:
+        raise ValueError(f"Versión de exportación no soportada: {version}")
+    offset += struct.calcsize('<HII')
+
+    columns = {}
+    for _ in range(column_count):
+        name_length = data[offset]
+        name = data[offset + 1:offset + 1 + name_length].decode('utf-8')
+        kind = chr(data[offset + 1 + name_length])
+        offset += name_length + 2
+        present = data[offset:offset + count]
+        offset += count
+
+        if kind == 'd':
+            values = array('d')
+            values.frombytes(data[offset:offset + 8 * count])
+            offset += 8 * count
+        elif kind == 'b':
+            values = [bool(value) for value in data[offset:offset + count]]
+            offset += count
+        else:
+            offsets = array('I')
+            offsets.frombytes(data[offset:offset + 4 * (count + 1)])
+            offset += 4 * (count + 1)
+            values = [data[offset + offsets[i]:offset + offsets[i + 1]].decode('utf-8') for i in range(count)]
+            offset += offsets[count]
+        columns[name] = [value if present[i] else None for i, value in enumerate(values)]
+    return columns
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Registro de intakes')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='Exporta el último estado de cada intake por columnas')
+    export.add_argument('--dir', required=True, help='Directorio del registro')
+    export.add_argument('--output', required=True, help='Archivo de salida')
+    export.add_argument('--complete-only', action='store_true', help='Solo intakes completos')
+    retention = commands.add_parser('prune', help='Borra los segmentos más antiguos que --days')
+    retention.add_argument('--dir', required=True, help='Directorio del registro')
+    retention.add_argument('--days', type=float, default=DEFAULT_RETENTION_DAYS)
+    show = commands.add_parser('show', help='Muestra un archivo exportado')
+    show.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        rows = latest_intakes(read_records(args.dir))
+        if args.complete_only:
+            rows = [row for row in rows if row.get('complete')]
+        print(f"{export_columnar(rows, args.output)} intakes exportados a {args.output}")
+    elif args.command == 'prune':
+        print(f"{prune(args.dir, args.days * 86400)} segmentos borrados de {args.dir}")
+    else:
+        columns = read_columnar(args.path)
+        for row in zip(*columns.values()):
+            print(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""Instrumentación ligera: contadores, histogramas de latencia y exposición
+en formato Prometheus.
+
+Los histogramas usan cubetas fijas, así que observar un valor es O(número de
+cubetas) sin guardar muestras; los percentiles p50/p95/p99 se estiman
+interpolando dentro de la cubeta. Las métricas son por proceso (cada worker
+de gunicorn expone las suyas).
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Límites superiores de las cubetas de latencia (segundos)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Histograma de cubetas fijas con estimación de percentiles"""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    # Cubeta +Inf: lo mejor que se puede decir es el último límite
+                    return self.buckets[-1]
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """Registro de contadores e histogramas etiquetados"""
+
+    def __init__(self, prefix='sofia'):
+        self.prefix = prefix
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, amount=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Mide la duración del bloque en el histograma `name`"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def register_collector(self, collector):
+        """collector() -> iterable de (nombre, tipo, etiquetas, valor) leído al exportar"""
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        """Resumen en JSON: contadores y percentiles de cada histograma"""
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in self._counters.items()]
+            histograms = [{
+                'name': name,
+                'labels': dict(labels),
+                'count': histogram.count,
+                'sum': round(histogram.sum, 6),
+                **{f'p{int(q * 100)}': round(histogram.quantile(q), 6) for q in QUANTILES}
+            } for (name, labels), histogram in self._histograms.items()]
+        return {'counters': counters, 'histograms': histograms}
+
+    def render_prometheus(self):
+        """Exposición en formato de texto de Prometheus"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                ((key, list(h.counts), h.count, h.sum, [h.quantile(q) for q in QUANTILES])
+                 for key, h in self._histograms.items()),
+                key=lambda item: item[0]
+            )
+
+        declared = set()
+        for (name, labels), value in counters:
+            self._declare(lines, declared, name, 'counter')
+            lines.append(f'{self._full(name)}{_labels(labels)} {value}')
+
+        for (name, labels), counts, count, total, quantiles in histograms:
+            full = self._full(name)
+            self._declare(lines, declared, name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{full}_bucket{_labels(labels + (("le", str(bound)),))} {cumulative}')
+            lines.append(f'{full}_sum{_labels(labels)} {total:.6f}')
+            lines.append(f'{full}_count{_labels(labels)} {count}')
+
+        # Percentiles estimados como gauges aparte (un histograma no admite la etiqueta quantile)
+        for (name, labels), _, count, _, quantiles in histograms:
+            quantile_name = f'{name}_quantile'
+            self._declare(lines, declared, quantile_name, 'gauge')
+            for q, value in zip(QUANTILES, quantiles):
+                lines.append(f'{self._full(quantile_name)}{_labels(labels + (("quantile", str(q)),))} {value:.6f}')
+
+        for collector in self._collectors:
+            for name, kind, labels, value in collector():
+                self._declare(lines, declared, name, kind)
+                lines.append(f'{self._full(name)}{_labels(_key(name, labels)[1])} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _full(self, name):
+        return f'{self.prefix}_{name}'
+
+    def _declare(self, lines, declared, name, kind):
+        if name in declared:
+            return
+        declared.add(name)
+        if name in self._help:
+            lines.append(f'# HELP {self._full(name)} {self._help[name]}')
+        lines.append(f'# TYPE {self._full(name)} {kind}')
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = MetricsRegistry()
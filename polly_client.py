@@ -0,0 +1,131 @@
+"""Cliente de Amazon Polly compartido por todo el proceso.
+
+Crear un cliente de boto3 por petición vuelve a resolver endpoints, recarga
+los modelos del servicio y abre conexiones TLS nuevas. Aquí se crea un único
+cliente por proceso, de forma perezosa y thread-safe, con un pool de
+conexiones de botocore configurable.
+
+Con el modelo pre-fork de gunicorn el cliente nunca se hereda del proceso
+padre: se descarta tras el fork y cada worker crea el suyo en la primera
+petición.
+"""
+import logging
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class PollyClientFactory:
+    """Fábrica perezosa y thread-safe del cliente de Polly"""
+
+    def __init__(self, region, access_key=None, secret_key=None, endpoint_url=None,
+                 max_pool_connections=20, connect_timeout=2, read_timeout=10,
+                 max_attempts=3, retry_mode='standard', tcp_keepalive=True):
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.endpoint_url = endpoint_url or None
+        self.config = Config(
+            region_name=region,
+            max_pool_connections=max_pool_connections,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            retries={'total_max_attempts': max_attempts, 'mode': retry_mode},
+            tcp_keepalive=tcp_keepalive
+        )
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._created = 0
+        self._reused = 0
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    @classmethod
+    def from_env(cls, region, access_key=None, secret_key=None):
+        """Crea la fábrica leyendo la configuración del pool de variables de entorno"""
+        return cls(
+            region,
+            access_key=access_key,
+            secret_key=secret_key,
+            endpoint_url=os.environ.get("POLLY_ENDPOINT_URL"),
+            max_pool_connections=int(os.environ.get("POLLY_MAX_POOL_CONNECTIONS", 20)),
+            connect_timeout=float(os.environ.get("POLLY_CONNECT_TIMEOUT", 2)),
+            read_timeout=float(os.environ.get("POLLY_READ_TIMEOUT", 10)),
+            max_attempts=int(os.environ.get("POLLY_MAX_ATTEMPTS", 3)),
+            retry_mode=os.environ.get("POLLY_RETRY_MODE", "standard"),
+            tcp_keepalive=os.environ.get("POLLY_TCP_KEEPALIVE", "true").lower() in ('1', 'true', 'yes')
+        )
+
+    def get(self):
+        """Devuelve el cliente del proceso actual, creándolo si hace falta"""
+        pid = os.getpid()
+        client = self._client
+        if client is not None and self._pid == pid:
+            self._reused += 1
+            return client
+
+        with self._lock:
+            if self._client is None or self._pid != pid:
+                # boto3.Session no es thread-safe: se crea dentro del lock
+                session = boto3.session.Session(
+                    aws_access_key_id=self.access_key,
+                    aws_secret_access_key=self.secret_key,
+                    region_name=self.region
+                )
+                self._client = session.client('polly', config=self.config, endpoint_url=self.endpoint_url)
+                self._pid = pid
+                self._created += 1
+                logger.info(f"Cliente Polly creado para el proceso {pid}")
+            else:
+                self._reused += 1
+            return self._client
+
+    def stats(self):
+        """Estadísticas del cliente y de su pool de conexiones"""
+        stats = {
+            'pid': os.getpid(),
+            'client_ready': self._client is not None and self._pid == os.getpid(),
+            'clients_created': self._created,
+            'client_reuses': self._reused,
+            'max_pool_connections': self.config.max_pool_connections,
+            'connect_timeout': self.config.connect_timeout,
+            'read_timeout': self.config.read_timeout,
+            'retries': self.config.retries,
+            'tcp_keepalive': self.config.tcp_keepalive,
+            'pools': []
+        }
+        if stats['client_ready']:
+            stats['pools'] = self._connection_pools()
+        return stats
+
+    def _connection_pools(self):
+        # Acceso de solo lectura a los internos de botocore/urllib3; si cambian
+        # en otra versión simplemente no se reportan pools.
+        try:
+            manager = self._client._endpoint.http_session._manager
+            pools = []
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                pools.append({
+                    'host': pool.host,
+                    'connections_opened': pool.num_connections,
+                    'requests': pool.num_requests,
+                    'idle_connections': pool.pool.qsize() if pool.pool else 0
+                })
+            return pools
+        except AttributeError:
+            return []
+
+    def _reset_after_fork(self):
+        # El lock y el cliente del padre no son válidos en el hijo
+        self._lock = threading.Lock()
+        self._client = None
+        self._pid = None
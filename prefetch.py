@@ -0,0 +1,228 @@
+"""Síntesis especulativa de la siguiente respuesta de cada sesión.
+
+El flujo de conversación es casi lineal: tras el nombre viene la pregunta del
+rol, tras el rol la de la categoría... En cuanto se responde un turno se
+predicen las respuestas más probables del siguiente (dialogue.likely_replies)
+y se sintetiza su audio en segundo plano mientras el usuario habla. Cuando
+llega el /api/speak de ese texto el audio ya está hecho; si aún no lo está,
+la petición sintetiza por su cuenta sin esperar.
+
+- La predicción y la síntesis se hacen fuera de la petición, en un pool
+  acotado. Si ya hay demasiado trabajo pendiente la especulación se descarta
+  en lugar de encolarse.
+- El audio especulativo vive en un buffer por sesión con un TTL corto y un
+  presupuesto de bytes; no entra en la caché de audio hasta que se usa, así
+  que las predicciones fallidas no desplazan entradas útiles.
+- Un turno nuevo de la sesión reemplaza las predicciones anteriores, salvo
+  la del texto que se acaba de responder, que sigue esperando su /api/speak.
+- Las predicciones se ordenan por lo que más ha acertado en este proceso.
+- El buffer es por proceso: solo acierta si el /api/speak llega al mismo
+  worker que atendió el /api/chat (un worker o sesiones fijas por worker).
+"""
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_PREDICTIONS = 2
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+class _Speculation:
+    """Predicciones de un turno de una sesión"""
+
+    __slots__ = ('expires', 'audio_format', 'entries', 'labels')
+
+    def __init__(self, expires, audio_format):
+        self.expires = expires
+        self.audio_format = audio_format
+        # texto -> Future con (clave, audio, motor) o None; cancelado si se descartó
+        self.entries = {}
+        self.labels = {}
+
+
+class Prefetcher:
+    """Predice y sintetiza en segundo plano las próximas respuestas por sesión.
+
+    predict(snapshot) devuelve [(etiqueta, texto)] y synthesize(texto, formato)
+    (clave, audio, motor), o None si el audio ya está en la caché y no hace
+    falta adelantarlo."""
+
+    def __init__(self, predict, synthesize, max_workers=2, ttl=DEFAULT_TTL,
+                 max_predictions=DEFAULT_MAX_PREDICTIONS, max_sessions=DEFAULT_MAX_SESSIONS,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self.predict = predict
+        self.synthesize = synthesize
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.max_predictions = max_predictions
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self._sessions = OrderedDict()
+        # Reentrante: los callbacks de los futures (_forget) pueden ejecutarse con él tomado
+        self._lock = threading.RLock()
+        self._pending = 0
+        self._bytes = 0
+        self._label_hits = Counter()
+        self._counters = {
+            'scheduled': 0,
+            'dropped': 0,
+            'synthesized': 0,
+            'already_cached': 0,
+            'over_budget': 0,
+            'errors': 0,
+            'hits': 0,
+            'misses': 0,
+            'wasted': 0,
+        }
+
+    def schedule(self, session_id, snapshot, audio_format, keep=None):
+        """Lanza la especulación del próximo turno (reemplaza la anterior de la sesión).
+
+        keep es la respuesta que se acaba de dar: si estaba predicha, su audio
+        pasa a la especulación nueva en lugar de descartarse."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            previous = self._sessions.pop(session_id, None)
+            speculation = _Speculation(now + self.ttl, audio_format)
+            if previous is not None and keep in previous.entries and previous.audio_format == audio_format:
+                speculation.entries[keep] = previous.entries.pop(keep)
+                speculation.labels[keep] = previous.labels[keep]
+            self._discard(previous)
+            self._sessions[session_id] = speculation
+            while len(self._sessions) > self.max_sessions:
+                self._discard(self._sessions.popitem(last=False)[1])
+            # Nunca más trabajo pendiente que hilos: lo que no cabe ya llegaría tarde
+            if self._pending >= self.max_workers:
+                self._counters['dropped'] += 1
+                return
+            self._pending += 1
+            self._counters['scheduled'] += 1
+        self._executor.submit(self._run, speculation, snapshot)
+
+    def take(self, session_id, text, audio_format):
+        """Audio adelantado de este texto para la sesión: (clave, audio, motor) o None.
+
+        Si la síntesis sigue en marcha no se espera: la petición no se bloquea
+        y ese audio, cuando termine, se descarta."""
+        with self._lock:
+            self._expire(time.monotonic())
+            speculation = self._sessions.get(session_id)
+            future = None
+            if speculation is not None and speculation.audio_format == audio_format:
+                future = speculation.entries.pop(text, None)
+                label = speculation.labels.get(text)
+            if future is None or not future.done():
+                self._counters['misses'] += 1
+                if future is not None:
+                    # Si termina más tarde nadie lo recogerá
+                    future.add_done_callback(self._forget)
+                return None
+            result = future.result()
+            if result is None:
+                self._counters['misses'] += 1
+                return None
+            self._bytes -= len(result[1])
+            self._counters['hits'] += 1
+            self._label_hits[label] += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                'sessions': len(self._sessions),
+                'pending': self._pending,
+                'buffered_bytes': self._bytes,
+                'ttl': self.ttl,
+            })
+        return stats
+
+    def _run(self, speculation, snapshot):
+        futures = []
+        try:
+            replies = self.predict(snapshot)
+            # Primero lo que más ha acertado; a igualdad, el orden del diálogo
+            replies = sorted(replies, key=lambda reply: -self._label_hits[reply[0]])[:self.max_predictions]
+            with self._lock:
+                for label, text in replies:
+                    # Un texto heredado del turno anterior ya tiene quien lo sintetice
+                    if text not in speculation.entries:
+                        speculation.entries[text] = Future()
+                        speculation.labels[text] = label
+                        futures.append((text, speculation.entries[text]))
+            for text, future in futures:
+                if future.cancelled() or speculation.expires <= time.monotonic():
+                    continue
+                try:
+                    self._synthesize(speculation, text, future)
+                except Exception as e:
+                    logger.warning(f"Error en la síntesis especulativa: {e}")
+                    with self._lock:
+                        self._counters['errors'] += 1
+        except Exception as e:
+            logger.warning(f"Error prediciendo la siguiente respuesta: {e}")
+            with self._lock:
+                self._counters['errors'] += 1
+        finally:
+            # Nadie debe quedarse esperando en take()
+            with self._lock:
+                for _, future in futures:
+                    if not future.done():
+                        future.set_result(None)
+                self._pending -= 1
+
+    def _synthesize(self, speculation, text, future):
+        result = self.synthesize(text, speculation.audio_format)
+        with self._lock:
+            if result is None:
+                self._counters['already_cached'] += 1
+            elif future.cancelled():
+                self._counters['wasted'] += 1
+                result = None
+            elif self._bytes + len(result[1]) > self.max_bytes:
+                self._counters['over_budget'] += 1
+                result = None
+            else:
+                self._bytes += len(result[1])
+                self._counters['synthesized'] += 1
+            # Dentro del lock: _discard ve el resultado o cancela antes
+            if not future.done():
+                future.set_result(result)
+
+    def _expire(self, now):
+        # Con el lock tomado. Las sesiones están en orden de schedule() y todas
+        # tienen el mismo TTL, así que las caducadas están al principio
+        while self._sessions:
+            session_id, speculation = next(iter(self._sessions.items()))
+            if speculation.expires > now:
+                break
+            del self._sessions[session_id]
+            self._discard(speculation)
+
+    def _discard(self, speculation):
+        # Con el lock tomado: libera el audio que nadie llegó a pedir
+        if speculation is None:
+            return
+        for future in speculation.entries.values():
+            if future.cancel():
+                continue
+            result = future.result()
+            if result is not None:
+                self._bytes -= len(result[1])
+                self._counters['wasted'] += 1
+        speculation.entries.clear()
+
+    def _forget(self, future):
+        result = None if future.cancelled() else future.result()
+        if result is not None:
+            with self._lock:
+                self._bytes -= len(result[1])
+                self._counters['wasted'] += 1
@@ -0,0 +1,435 @@
+"""Agenda de citas: horarios por abogado y categoría (civil, laboral, penal).
+
+Los horarios se generan a partir de una política semanal (días, horas y
+duración de la cita) para cada abogado, hasta `horizon_days` por delante.
+Mientras el llamante decide, el horario ofrecido queda retenido (hold) a su
+nombre durante `hold_ttl` segundos; si no lo confirma a tiempo vuelve a estar
+libre. Confirmar o retener es atómico aunque muchas sesiones compitan por el
+mismo horario.
+
+Hay dos backends, como en session_store.py:
+
+- memory: por categoría, una lista ordenada de horarios libres; el siguiente
+  horario libre se busca con bisect (O(log n)). Solo sirve con un worker.
+- sqlite: una fila por horario con índice parcial (categoría, inicio) sobre
+  los no reservados; retener es un UPDATE condicional (compare-and-set), así
+  que dos workers nunca se llevan el mismo horario.
+"""
+import bisect
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ('civil', 'laboral', 'penal')
+DEFAULT_HOLD_TTL = 5 * 60
+DEFAULT_TIMEZONE = 'America/Bogota'
+
+DEFAULT_LAWYERS = {category: (f'{category}-1', f'{category}-2') for category in CATEGORIES}
+
+DAY_NAMES = ('Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo')
+MONTH_NAMES = ('Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio',
+               'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre')
+
+FREE = 'free'
+HELD = 'held'
+BOOKED = 'booked'
+
+
+class SchedulePolicy:
+    """Horario de atención: qué horarios se ofrecen a cada abogado"""
+
+    def __init__(self, weekdays=(0, 1, 2, 3, 4), first_slot='08:30', last_slot='16:30', slot_minutes=60,
+                 horizon_days=21, lead_hours=12, timezone=DEFAULT_TIMEZONE):
+        self.weekdays = frozenset(weekdays)
+        self.first_slot = _minutes(first_slot)
+        self.last_slot = _minutes(last_slot)
+        self.slot_minutes = slot_minutes
+        self.horizon_days = horizon_days
+        self.lead_seconds = lead_hours * 3600
+        self.timezone = ZoneInfo(timezone)
+
+    def slot_starts(self, now):
+        """Inicios (epoch) de los horarios de hoy hasta el horizonte"""
+        today = datetime.fromtimestamp(now, self.timezone).replace(hour=0, minute=0, second=0, microsecond=0)
+        for offset in range(self.horizon_days + 1):
+            day = today + timedelta(days=offset)
+            if day.weekday() not in self.weekdays:
+                continue
+            for minute in range(self.first_slot, self.last_slot + 1, self.slot_minutes):
+                start = day.replace(hour=minute // 60, minute=minute % 60)
+                yield start.timestamp()
+
+
+def _minutes(hhmm):
+    hours, minutes = hhmm.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def spoken_time(start, timezone):
+    """'Lunes 29 de Septiembre a las 10:30 de la mañana'"""
+    moment = datetime.fromtimestamp(start, timezone)
+    hour = moment.hour % 12 or 12
+    article = 'a la' if hour == 1 else 'a las'
+    if moment.hour < 12:
+        period = 'de la mañana'
+    elif moment.hour < 19:
+        period = 'de la tarde'
+    else:
+        period = 'de la noche'
+    return (f"{DAY_NAMES[moment.weekday()]} {moment.day} de {MONTH_NAMES[moment.month - 1]} "
+            f"{article} {hour}:{moment.minute:02d} {period}")
+
+
+def short_time(start, timezone):
+    """'Lunes 29 de Septiembre - 10:30 am'"""
+    moment = datetime.fromtimestamp(start, timezone)
+    hour = moment.hour % 12 or 12
+    suffix = 'am' if moment.hour < 12 else 'pm'
+    return f"{DAY_NAMES[moment.weekday()]} {moment.day} de {MONTH_NAMES[moment.month - 1]} - {hour}:{moment.minute:02d} {suffix}"
+
+
+class Slot:
+    """Horario de un abogado; se identifica por abogado e inicio"""
+
+    __slots__ = ('slot_id', 'lawyer', 'category', 'start', 'status', 'session_id', 'hold_expires')
+
+    def __init__(self, lawyer, category, start, status=FREE, session_id=None, hold_expires=None):
+        self.slot_id = f'{lawyer}@{int(start)}'
+        self.lawyer = lawyer
+        self.category = category
+        self.start = start
+        self.status = status
+        self.session_id = session_id
+        self.hold_expires = hold_expires
+
+    def to_dict(self):
+        return {'slot_id': self.slot_id, 'lawyer': self.lawyer, 'category': self.category,
+                'start': self.start, 'status': self.status}
+
+
+class _BaseScheduler:
+
+    def __init__(self, lawyers=None, policy=None, hold_ttl=DEFAULT_HOLD_TTL):
+        self.lawyers = {category: tuple(names) for category, names in (lawyers or DEFAULT_LAWYERS).items()}
+        self.policy = policy or SchedulePolicy()
+        self.hold_ttl = hold_ttl
+
+    @staticmethod
+    def slot_start(slot_id):
+        """Inicio (epoch) de un horario a partir de su id"""
+        return float(slot_id.rsplit('@', 1)[1])
+
+    def spoken(self, slot):
+        return spoken_time(slot.start, self.policy.timezone)
+
+    def label(self, slot):
+        return short_time(slot.start, self.policy.timezone)
+
+    def _categories(self, category):
+        # Sin categoría conocida ('no definida') vale cualquier abogado
+        return (category,) if category in self.lawyers else tuple(self.lawyers)
+
+    def _generate(self, now):
+        for start in self.policy.slot_starts(now):
+            if start < now:
+                continue
+            for category, names in self.lawyers.items():
+                for lawyer in names:
+                    yield Slot(lawyer, category, start)
+
+
+class MemoryScheduler(_BaseScheduler):
+    """Agenda en memoria del proceso"""
+
+    def __init__(self, lawyers=None, policy=None, hold_ttl=DEFAULT_HOLD_TTL):
+        super().__init__(lawyers, policy, hold_ttl)
+        self._slots = {}
+        self._free = {category: [] for category in self.lawyers}
+        self._holds = []
+        self._generated_until = 0.0
+        self._lock = threading.Lock()
+
+    def hold(self, category, session_id, after=None):
+        """Retiene el primer horario libre posterior a `after` (o None si no hay)"""
+        now = time.time()
+        with self._lock:
+            self._refresh(now)
+            best = self._first_free(category, max(after or 0.0, now + self.policy.lead_seconds))
+            if best is None:
+                return None
+            _, free, index = best
+            _, slot_id = free.pop(index)
+            slot = self._slots[slot_id]
+            slot.status = HELD
+            slot.session_id = session_id
+            slot.hold_expires = now + self.hold_ttl
+            heapq.heappush(self._holds, (slot.hold_expires, slot_id))
+            return slot
+
+    def peek(self, category, after=None):
+        """El horario que devolvería hold(), sin retenerlo"""
+        now = time.time()
+        with self._lock:
+            self._refresh(now)
+            best = self._first_free(category, max(after or 0.0, now + self.policy.lead_seconds))
+            return None if best is None else self._slots[best[0][1]]
+
+    def confirm(self, slot_id, session_id):
+        """Reserva el horario si sigue retenido por la sesión o libre; devuelve el Slot o None"""
+        with self._lock:
+            self._refresh(time.time())
+            slot = self._slots.get(slot_id)
+            if slot is None:
+                return None
+            if slot.status == FREE:
+                self._remove_free(slot)
+            elif slot.status != HELD or slot.session_id != session_id:
+                return None
+            slot.status = BOOKED
+            slot.session_id = session_id
+            slot.hold_expires = None
+            return slot
+
+    def release(self, slot_id, session_id):
+        """Libera un horario retenido por la sesión"""
+        with self._lock:
+            slot = self._slots.get(slot_id)
+            if slot is not None and slot.status == HELD and slot.session_id == session_id:
+                self._make_free(slot)
+
+    def stats(self):
+        with self._lock:
+            self._refresh(time.time())
+            counts = {FREE: 0, HELD: 0, BOOKED: 0}
+            for slot in self._slots.values():
+                counts[slot.status] += 1
+        return {'backend': 'memory', 'hold_ttl': self.hold_ttl, **counts}
+
+    def _refresh(self, now):
+        # Debe llamarse con el lock tomado: caduca retenciones y amplía el horizonte
+        while self._holds and self._holds[0][0] <= now:
+            expires, slot_id = heapq.heappop(self._holds)
+            slot = self._slots[slot_id]
+            if slot.status == HELD and slot.hold_expires == expires:
+                self._make_free(slot)
+
+        if now - self._generated_until < 3600:
+            return
+        for slot in self._generate(now):
+            if slot.slot_id not in self._slots:
+                self._slots[slot.slot_id] = slot
+                bisect.insort(self._free[slot.category], (slot.start, slot.slot_id))
+        # Los horarios ya pasados no se vuelven a ofrecer
+        for free in self._free.values():
+            del free[:bisect.bisect_left(free, (now, ''))]
+        for slot_id in [slot_id for slot_id, slot in self._slots.items() if slot.start < now and slot.status != HELD]:
+            del self._slots[slot_id]
+        self._generated_until = now
+
+    def _first_free(self, category, earliest):
+        # Primer horario libre que empieza después de `earliest`: (entrada, lista, posición)
+        best = None
+        for name in self._categories(category):
+            free = self._free[name]
+            index = bisect.bisect_right(free, (earliest, '\uffff'))
+            if index < len(free) and (best is None or free[index] < best[0]):
+                best = (free[index], free, index)
+        return best
+
+    def _make_free(self, slot):
+        slot.status = FREE
+        slot.session_id = None
+        slot.hold_expires = None
+        bisect.insort(self._free[slot.category], (slot.start, slot.slot_id))
+
+    def _remove_free(self, slot):
+        free = self._free[slot.category]
+        index = bisect.bisect_left(free, (slot.start, slot.slot_id))
+        if index < len(free) and free[index][1] == slot.slot_id:
+            del free[index]
+
+
+class SQLiteScheduler(_BaseScheduler):
+    """Agenda en SQLite compartida por varios workers y procesos"""
+
+    MAX_ATTEMPTS = 8
+
+    def __init__(self, path, lawyers=None, policy=None, hold_ttl=DEFAULT_HOLD_TTL):
+        super().__init__(lawyers, policy, hold_ttl)
+        self.path = path
+        self._local = threading.local()
+        self._generated_until = 0.0
+        self._generate_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS slots ('
+                    'slot_id TEXT PRIMARY KEY, lawyer TEXT NOT NULL, category TEXT NOT NULL, '
+                    'start REAL NOT NULL, status TEXT NOT NULL, session_id TEXT, hold_expires REAL)'
+                )
+                # Solo los horarios aún reservables: las reservas no alargan la búsqueda
+                conn.execute("CREATE INDEX IF NOT EXISTS slots_open ON slots (category, start) "
+                             "WHERE status != 'booked'")
+        finally:
+            conn.close()
+
+    def hold(self, category, session_id, after=None):
+        now = time.time()
+        earliest = max(after or 0.0, now + self.policy.lead_seconds)
+        self._ensure_horizon(now)
+        conn = self._connection()
+
+        for _ in range(self.MAX_ATTEMPTS):
+            row = self._first_free(conn, category, earliest, now)
+            if row is None:
+                return None
+            with conn:
+                # Compare-and-set: si otro worker lo tomó entre medias, se prueba el siguiente
+                taken = conn.execute(
+                    "UPDATE slots SET status = 'held', session_id = ?, hold_expires = ? "
+                    "WHERE slot_id = ? AND (status = 'free' OR (status = 'held' AND hold_expires <= ?))",
+                    (session_id, now + self.hold_ttl, row[0], now)
+                ).rowcount
+            if taken:
+                return Slot(row[1], row[2], row[3], HELD, session_id, now + self.hold_ttl)
+        logger.warning(f"No se pudo retener un horario tras {self.MAX_ATTEMPTS} intentos")
+        return None
+
+    def peek(self, category, after=None):
+        now = time.time()
+        self._ensure_horizon(now)
+        row = self._first_free(self._connection(), category, max(after or 0.0, now + self.policy.lead_seconds), now)
+        return None if row is None else Slot(row[1], row[2], row[3])
+
+    def _first_free(self, conn, category, earliest, now):
+        categories = self._categories(category)
+        placeholders = ','.join('?' * len(categories))
+        return conn.execute(
+            f"SELECT slot_id, lawyer, category, start FROM slots "
+            f"WHERE category IN ({placeholders}) AND status != 'booked' AND start > ? "
+            f"AND (status = 'free' OR hold_expires <= ?) ORDER BY start, slot_id LIMIT 1",
+            (*categories, earliest, now)
+        ).fetchone()
+
+    def confirm(self, slot_id, session_id):
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            booked = conn.execute(
+                "UPDATE slots SET status = 'booked', session_id = ?, hold_expires = NULL "
+                "WHERE slot_id = ? AND (status = 'free' OR (status = 'held' AND (session_id = ? OR hold_expires <= ?)))",
+                (session_id, slot_id, session_id, now)
+            ).rowcount
+        if not booked:
+            return None
+        row = conn.execute('SELECT lawyer, category, start FROM slots WHERE slot_id = ?', (slot_id,)).fetchone()
+        return Slot(row[0], row[1], row[2], BOOKED, session_id)
+
+    def release(self, slot_id, session_id):
+        conn = self._connection()
+        with conn:
+            conn.execute("UPDATE slots SET status = 'free', session_id = NULL, hold_expires = NULL "
+                         "WHERE slot_id = ? AND status = 'held' AND session_id = ?", (slot_id, session_id))
+
+    def stats(self):
+        now = time.time()
+        counts = {FREE: 0, HELD: 0, BOOKED: 0}
+        rows = self._connection().execute(
+            "SELECT CASE WHEN status = 'held' AND hold_expires <= ? THEN 'free' ELSE status END, COUNT(*) "
+            "FROM slots GROUP BY 1", (now,)
+        ).fetchall()
+        counts.update(dict(rows))
+        return {'backend': 'sqlite', 'hold_ttl': self.hold_ttl, 'path': self.path, **counts}
+
+    def _ensure_horizon(self, now):
+        # Cada proceso amplía el horizonte como mucho una vez por hora (INSERT OR IGNORE es idempotente)
+        if now - self._generated_until < 3600:
+            return
+        with self._generate_lock:
+            if now - self._generated_until < 3600:
+                return
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM slots WHERE start < ? AND status != 'booked'", (now,))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO slots (slot_id, lawyer, category, start, status) VALUES (?, ?, ?, ?, 'free')",
+                    ((slot.slot_id, slot.lawyer, slot.category, slot.start) for slot in self._generate(now))
+                )
+            self._generated_until = now
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def _connection(self):
+        # Una conexión por hilo y por proceso (no se reutilizan tras un fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class PreviewScheduler:
+    """Vista de solo lectura de una agenda para simular turnos de conversación.
+
+    hold() devuelve el horario que se ofrecería sin retenerlo y confirm() el
+    que se reservaría sin reservarlo; release() no hace nada."""
+
+    def __init__(self, scheduler):
+        self._scheduler = scheduler
+
+    def hold(self, category, session_id, after=None):
+        return self._scheduler.peek(category, after=after)
+
+    def confirm(self, slot_id, session_id):
+        lawyer, _, start = slot_id.rpartition('@')
+        return Slot(lawyer, None, float(start), BOOKED, session_id)
+
+    def release(self, slot_id, session_id):
+        pass
+
+    def slot_start(self, slot_id):
+        return self._scheduler.slot_start(slot_id)
+
+    def spoken(self, slot):
+        return self._scheduler.spoken(slot)
+
+    def label(self, slot):
+        return self._scheduler.label(slot)
+
+
+def load_lawyers(value):
+    """Abogados por categoría desde JSON ({"civil": ["ana", ...], ...}) o los de por defecto"""
+    if not value:
+        return DEFAULT_LAWYERS
+    lawyers = json.loads(value)
+    unknown = set(lawyers) - set(CATEGORIES)
+    if unknown:
+        raise ValueError(f"Categorías desconocidas en la agenda: {', '.join(sorted(unknown))}")
+    return lawyers
+
+
+def create_scheduler(backend='memory', path=None, lawyers=None, policy=None, hold_ttl=DEFAULT_HOLD_TTL):
+    """Crea el backend de agenda indicado ('memory' o 'sqlite')"""
+    if backend == 'sqlite':
+        return SQLiteScheduler(path, lawyers=lawyers, policy=policy, hold_ttl=hold_ttl)
+    if backend != 'memory':
+        raise ValueError(f"Backend de agenda desconocido: {backend}")
+    return MemoryScheduler(lawyers=lawyers, policy=policy, hold_ttl=hold_ttl)
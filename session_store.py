@@ -0,0 +1,203 @@
+"""Estado de conversación por sesión.
+
+Cada llamada tiene su propio ConversationState, identificado por un id de
+sesión, en lugar de guardar los datos como atributos de la función chat()
+(compartidos por todos los llamantes). Hay dos backends:
+
+- memory: diccionario en el proceso. Solo sirve con un worker de gunicorn.
+- sqlite: base de datos en disco compartida por todos los workers del mismo
+  equipo, en modo WAL para que las lecturas no bloqueen.
+
+Las sesiones inactivas más de `ttl` segundos se descartan.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 30 * 60
+
+# Datos que el flujo de conversación va rellenando
+SESSION_FIELDS = (
+    'user_name',
+    'user_role',
+    'case_category',
+    'case_description',
+    'user_email',
+    'user_phone',
+    'appointment_time',
+    'offered_slot',
+    'offered_time',
+)
+
+
+class ConversationState:
+    """Datos de una conversación; un campo en None aún no se ha pedido.
+
+    intake_id identifica cada intake de la sesión (un saludo empieza otro)."""
+
+    __slots__ = ('session_id', 'updated_at', 'intake_id') + SESSION_FIELDS
+
+    def __init__(self, session_id, updated_at=None, intake_id=None, **fields):
+        self.session_id = session_id
+        self.updated_at = updated_at or time.time()
+        self.intake_id = intake_id
+        for field in SESSION_FIELDS:
+            setattr(self, field, fields.get(field))
+
+    def reset(self):
+        """Olvida todos los datos capturados (nueva conversación)"""
+        self.intake_id = None
+        for field in SESSION_FIELDS:
+            setattr(self, field, None)
+
+    def to_dict(self):
+        return {'intake_id': self.intake_id, **{field: getattr(self, field) for field in SESSION_FIELDS}}
+
+    @classmethod
+    def from_dict(cls, session_id, data, updated_at=None):
+        return cls(session_id, updated_at=updated_at, **data)
+
+
+class MemorySessionStore:
+    """Sesiones en memoria del proceso, con expiración por inactividad"""
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        """Devuelve el estado de la sesión (uno vacío si no existe o expiró)"""
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            state = self._sessions.get(session_id)
+            if state is None:
+                return ConversationState(session_id, updated_at=now)
+            self._sessions.move_to_end(session_id)
+            return state
+
+    def save(self, state):
+        state.updated_at = time.time()
+        with self._lock:
+            self._sessions[state.session_id] = state
+            self._sessions.move_to_end(state.session_id)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            self._purge_expired(time.time())
+            return {'backend': 'memory', 'active_sessions': len(self._sessions), 'ttl': self.ttl}
+
+    def _purge_expired(self, now):
+        # Las sesiones están ordenadas por último uso: las caducadas van primero
+        while self._sessions:
+            session_id, state = next(iter(self._sessions.items()))
+            if now - state.updated_at <= self.ttl:
+                break
+            del self._sessions[session_id]
+
+
+class SQLiteSessionStore:
+    """Sesiones en SQLite, compartidas por varios workers y procesos"""
+
+    PURGE_EVERY = 500
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._saves = 0
+        self._saves_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS sessions ('
+                    'session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)'
+                )
+                conn.execute('CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)')
+        finally:
+            conn.close()
+
+    def load(self, session_id):
+        now = time.time()
+        row = self._connection().execute(
+            'SELECT data, updated_at FROM sessions WHERE session_id = ? AND updated_at >= ?',
+            (session_id, now - self.ttl)
+        ).fetchone()
+        if row is None:
+            return ConversationState(session_id, updated_at=now)
+        return ConversationState.from_dict(session_id, json.loads(row[0]), updated_at=row[1])
+
+    def save(self, state):
+        state.updated_at = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)',
+                (state.session_id, json.dumps(state.to_dict(), ensure_ascii=False), state.updated_at)
+            )
+
+        with self._saves_lock:
+            self._saves += 1
+            purge = self._saves % self.PURGE_EVERY == 0
+        if purge:
+            self.purge_expired()
+
+    def delete(self, session_id):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+
+    def purge_expired(self):
+        """Borra las sesiones caducadas"""
+        conn = self._connection()
+        with conn:
+            deleted = conn.execute('DELETE FROM sessions WHERE updated_at < ?',
+                                   (time.time() - self.ttl,)).rowcount
+        if deleted:
+            logger.info(f"Sesiones caducadas eliminadas: {deleted}")
+
+    def stats(self):
+        active = self._connection().execute(
+            'SELECT COUNT(*) FROM sessions WHERE updated_at >= ?', (time.time() - self.ttl,)
+        ).fetchone()[0]
+        return {'backend': 'sqlite', 'active_sessions': active, 'ttl': self.ttl, 'path': self.path}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def _connection(self):
+        # Una conexión por hilo y por proceso (no se reutilizan tras un fork)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+def create_session_store(backend='memory', ttl=DEFAULT_TTL, path=None):
+    """Crea el backend de sesiones indicado ('memory' o 'sqlite')"""
+    if backend == 'sqlite':
+        return SQLiteSessionStore(path, ttl=ttl)
+    if backend != 'memory':
+        raise ValueError(f"Backend de sesiones desconocido: {backend}")
+    return MemorySessionStore(ttl=ttl)
@@ -0,0 +1,42 @@
+"""Síntesis por frases en pipeline para respuestas largas.
+
+En vez de enviar a Polly la respuesta completa como un solo SSML, se parte en
+frases que se sintetizan en paralelo en un pool de hilos y se emiten en orden
+según van estando listas. El primer audio sale en cuanto está la primera
+frase, sin esperar a las demás.
+"""
+import re
+from collections import deque
+from itertools import islice
+
+from ssml import SENTENCE_PUNCTUATION
+
+# Límite de frase: los mismos signos tras los que el SSML pone la pausa larga,
+# seguidos de espacio para no partir "TusAbogados.com"
+SENTENCE_BOUNDARY = re.compile(rf'(?<=[{re.escape(SENTENCE_PUNCTUATION)}])\s+')
+
+DEFAULT_WINDOW = 4
+
+
+def split_sentences(text):
+    """Parte el texto en frases no vacías"""
+    return [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+
+
+def pipelined(segments, synthesize, executor, window=DEFAULT_WINDOW):
+    """Genera synthesize(segmento) para cada segmento, en orden.
+
+    Mantiene hasta `window` síntesis en vuelo en el executor. Si el consumidor
+    deja de iterar, las síntesis pendientes se cancelan."""
+    remaining = iter(segments)
+    pending = deque(executor.submit(synthesize, segment) for segment in islice(remaining, window))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            # Rellenar la ventana antes de entregar el resultado
+            for segment in islice(remaining, 1):
+                pending.append(executor.submit(synthesize, segment))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
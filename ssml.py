@@ -0,0 +1,114 @@
+"""Compilador de SSML para los textos de Sofía.
+
+Antes el SSML se construía con un str.replace por palabra del léxico y tres
+re.sub para las pausas, repitiendo todo para cada motor. Aquí el léxico y los
+signos de puntuación se compilan en una sola expresión regular y el texto se
+recorre una única vez, emitiendo a la vez los <emphasis>, los <break> y el
+escape de caracteres XML. El resultado se memoiza por texto.
+
+Las palabras del léxico solo se marcan como palabra completa: "demandante" ya
+no se convierte en "<emphasis>demanda</emphasis>nte" y un texto nunca se
+envuelve dos veces.
+"""
+import re
+from functools import lru_cache
+
+# Palabras legales que necesitan mejor pronunciación
+PRONUNCIATION_LEXICON = {
+    'abogada': 'abogáda',
+    'legal': 'legál',
+    'cliente': 'clienté',
+    'proceso': 'procéso',
+    'judicial': 'judiciál',
+    'documento': 'documentó',
+    'contrato': 'contráto',
+    'custodia': 'custódia',
+    'pensión': 'pensión',
+    'alimentaria': 'alimentária',
+    'herencia': 'heréncia',
+    'testamento': 'testaménto',
+    'demanda': 'demánda',
+    'juzgado': 'juzgádo',
+}
+
+# Signos que cierran una frase y pausa tras cada signo de puntuación
+SENTENCE_PUNCTUATION = '.!?'
+PAUSES = {
+    '.': '500ms',
+    '!': '500ms',
+    '?': '500ms',
+    ',': '200ms',
+    ':': '300ms',
+}
+
+XML_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;'}
+
+MEMO_SIZE = 2048
+
+_WORDS = '|'.join(re.escape(word) for word in sorted(PRONUNCIATION_LEXICON, key=len, reverse=True))
+_PUNCTUATION = '[' + re.escape(''.join(PAUSES)) + ']'
+_ESCAPES = '[' + re.escape(''.join(XML_ESCAPES)) + ']'
+
+# Cada token reconocido se sustituye con una sola consulta a este diccionario
+_REPLACEMENTS = {word: f'<emphasis level="moderate">{word}</emphasis>' for word in PRONUNCIATION_LEXICON}
+_REPLACEMENTS.update({mark: f'{mark}<break time="{pause}"/>' for mark, pause in PAUSES.items()})
+_REPLACEMENTS.update(XML_ESCAPES)
+
+_FULL_PATTERN = re.compile(rf'\b(?:{_WORDS})\b|{_PUNCTUATION}|{_ESCAPES}')
+_EMPHASIS_PATTERN = re.compile(rf'\b(?:{_WORDS})\b|{_ESCAPES}')
+_PAUSE_PATTERN = re.compile(rf'{_PUNCTUATION}|{_ESCAPES}')
+
+
+def _render_token(match):
+    return _REPLACEMENTS[match.group()]
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def compile_ssml_body(text):
+    """Énfasis del léxico + pausas naturales + escape XML en una sola pasada"""
+    return _FULL_PATTERN.sub(_render_token, text)
+
+
+def improve_pronunciation(text):
+    """Mejora la pronunciación de texto legal con énfasis en palabras clave"""
+    return _EMPHASIS_PATTERN.sub(_render_token, text)
+
+
+def add_natural_pauses(text):
+    """Añade pausas naturales en el texto para mejor fluidez"""
+    return _PAUSE_PATTERN.sub(_render_token, text)
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def create_ssml_text(text):
+    """Crea texto SSML optimizado para voz natural"""
+    ssml = f"""
+    <speak>
+        <prosody rate="105%" pitch="+2%" volume="loud">
+            <amazon:effect name="drc">
+                <amazon:effect vocal-tract-length="+3%">
+                    {compile_ssml_body(text)}
+                </amazon:effect>
+            </amazon:effect>
+        </prosody>
+    </speak>
+    """
+
+    return ssml.strip()
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def create_generative_ssml(text):
+    """Crea SSML optimizado específicamente para motor generativo"""
+    # SSML simplificado para generativo (es más inteligente)
+    ssml = f"""
+    <speak>
+        <prosody rate="100%" pitch="+2%" volume="medium">
+            <amazon:auto-breaths volume="x-soft" frequency="medium">
+                {compile_ssml_body(text)}
+            </amazon:auto-breaths>
+        </prosody>
+    </speak>
+    """
+
+    return ssml.strip()
@@ -1,2 +1,11 @@
 #!/bin/bash
-gunicorn app:app --bind 0.0.0.0:$PORT --workers 1
+# Varios workers comparten las sesiones de conversación a través de SQLite
+export SESSION_BACKEND=${SESSION_BACKEND:-sqlite}
+
+if [ "$SERVER_MODE" = "asgi" ]; then
+    # Modo asyncio: el pool de conexiones a Polly acompaña al límite de concurrencia
+    export POLLY_MAX_POOL_CONNECTIONS=${POLLY_MAX_POOL_CONNECTIONS:-${POLLY_MAX_CONCURRENCY:-64}}
+    exec gunicorn asgi:app -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT --workers ${WEB_CONCURRENCY:-2}
+fi
+
+gunicorn app:app --bind 0.0.0.0:$PORT --workers ${WEB_CONCURRENCY:-4} --threads ${GUNICORN_THREADS:-8}
@@ -0,0 +1,237 @@
+"""Síntesis de respuestas personalizadas a partir de sus plantillas.
+
+Muchas respuestas solo cambian en el nombre, el correo o el teléfono del
+usuario ("Mucho gusto {user_name}. Para orientarle mejor..."), así que cachear
+la respuesta completa falla en cada llamada. Aquí cada plantilla de
+dialogue.py se parte en segmentos:
+
+- Fijos: el texto de la plantilla entre frases con datos del usuario. Se
+  sintetizan una vez (el warm-up los deja en la caché al arrancar) y los
+  comparten todas las llamadas.
+- Personalizados: las frases o líneas que contienen algún campo. Son cortos y
+  son lo único que se envía a Polly en cada turno.
+
+Los cortes siguen los límites de frase o de línea de la plantilla, nunca
+caen a mitad de frase, así que la entonación de cada segmento es natural.
+
+El audio de los segmentos se une en el servidor. En MP3 se quitan las
+etiquetas ID3 y la trama Xing/Info/VBRI de cada segmento (describe solo ese
+segmento y confundiría la duración del conjunto) y se conservan solo tramas
+completas. El PCM se une muestra a muestra. Ogg Vorbis no se puede
+concatenar sin reescribir el contenedor, así que no se monta por segmentos.
+"""
+import hashlib
+import re
+from string import Formatter
+
+from ssml import SENTENCE_PUNCTUATION
+
+# Límite de segmento: fin de frase seguido de espacio, o salto de línea
+SEGMENT_BOUNDARY = re.compile(rf'(?<=[{re.escape(SENTENCE_PUNCTUATION)}])\s+|\s*\n\s*')
+
+# OutputFormat de Polly cuyo audio se puede montar por segmentos
+SPLICEABLE_FORMATS = ('mp3', 'pcm')
+
+# Tablas de la cabecera de trama MPEG audio (Layer III)
+_MPEG1, _MPEG2, _MPEG25 = 3, 2, 0
+_BITRATES = {
+    _MPEG1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    _MPEG2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_BITRATES[_MPEG25] = _BITRATES[_MPEG2]
+_SAMPLE_RATES = {
+    _MPEG1: (44100, 48000, 32000),
+    _MPEG2: (22050, 24000, 16000),
+    _MPEG25: (11025, 12000, 8000),
+}
+_VBR_TAGS = (b'Xing', b'Info')
+
+
+class _Template:
+    """Plantilla compilada: expresión que reconoce sus respuestas y sus segmentos"""
+
+    __slots__ = ('pattern', 'segments')
+
+    def __init__(self, pattern, segments):
+        self.pattern = pattern
+        # [(texto o cadena de formato, fijo)]
+        self.segments = segments
+
+    def render(self, values):
+        segments = ((text if static else text.format(**values)).strip() for text, static in self.segments)
+        # Un campo vacío puede dejar un segmento sin nada que pronunciar (".")
+        return [segment for segment in segments if any(char.isalnum() for char in segment)]
+
+
+def _escape(text):
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+def _pattern(template):
+    parts = []
+    seen = set()
+    for literal, field, _, _ in Formatter().parse(template):
+        parts.append(re.escape(literal))
+        if field is None:
+            continue
+        # Un campo repetido debe tener el mismo valor en toda la respuesta
+        parts.append(f'(?P={field})' if field in seen else f'(?P<{field}>.*?)')
+        seen.add(field)
+    return re.compile(''.join(parts), re.DOTALL)
+
+
+def _segments(template):
+    """Segmentos de una plantilla: los cortes caen en límites de frase o línea"""
+    segments = []
+    pending = None
+    for literal, field, _, _ in Formatter().parse(template):
+        if pending is not None:
+            # Tras un campo, el segmento personalizado llega hasta el siguiente límite
+            cut = SEGMENT_BOUNDARY.search(literal)
+            if cut is None:
+                pending += _escape(literal)
+                literal = ''
+            else:
+                segments.append([pending + _escape(literal[:cut.start()]), False, literal[cut.start():cut.end()]])
+                pending = None
+                literal = literal[cut.end():]
+        if field is None:
+            if literal.strip():
+                segments.append([literal, True, ''])
+            continue
+        if pending is None:
+            # El texto desde el último límite hasta el campo va con el campo
+            cuts = list(SEGMENT_BOUNDARY.finditer(literal))
+            if cuts:
+                if literal[:cuts[-1].start()].strip():
+                    segments.append([literal[:cuts[-1].start()], True, ''])
+                literal = literal[cuts[-1].end():]
+            pending = _escape(literal)
+        pending += '{' + field + '}'
+    if pending is not None:
+        segments.append([pending, False, ''])
+
+    # Segmentos personalizados seguidos: una sola llamada a Polly
+    merged = []
+    for text, static, separator in segments:
+        if merged and not static and not merged[-1][1] and merged[-1][2]:
+            merged[-1][0] += _escape(merged[-1][2]) + text
+            merged[-1][2] = separator
+        else:
+            merged.append([text, static, separator])
+    return [(text, static) for text, static, _ in merged]
+
+
+class TemplateSplicer:
+    """Reconoce respuestas generadas con plantillas y las parte en segmentos.
+
+    Solo se compilan las plantillas con campos y con algún segmento fijo: en
+    las demás no hay nada que compartir entre llamadas."""
+
+    def __init__(self, templates):
+        self.templates = []
+        for template in templates:
+            segments = _segments(template)
+            if any(static for _, static in segments) and not all(static for _, static in segments):
+                self.templates.append(_Template(_pattern(template), segments))
+        # Las plantillas con más texto fijo primero: son las más específicas
+        self.templates.sort(key=lambda compiled: -len(compiled.pattern.pattern))
+
+    def segments(self, text):
+        """Segmentos de una respuesta en orden, o None si no sale de ninguna plantilla"""
+        for template in self.templates:
+            match = template.pattern.fullmatch(text)
+            if match is not None:
+                return template.render(match.groupdict())
+        return None
+
+    def static_segments(self):
+        """Textos fijos de todas las plantillas (para el warm-up)"""
+        texts = (text.strip() for template in self.templates for text, static in template.segments if static)
+        return tuple(dict.fromkeys(text for text in texts if text))
+
+
+def mp3_frames(audio_data):
+    """Solo las tramas de audio completas de un MP3 (sin ID3 ni trama Xing/Info/VBRI)"""
+    data = memoryview(audio_data)
+    end = len(data)
+    if end >= 128 and bytes(data[end - 128:end - 125]) == b'TAG':
+        end -= 128
+    position = 0
+    if bytes(data[:3]) == b'ID3' and end >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        position = 10 + size + (10 if data[5] & 0x10 else 0)
+
+    frames = []
+    first = True
+    while position + 4 <= end:
+        length = _frame_length(data, position)
+        if length is None:
+            # Basura entre tramas: buscar la siguiente sincronización
+            position += 1
+            continue
+        if position + length > end:
+            break
+        if not (first and _is_vbr_tag(data, position)):
+            frames.append(data[position:position + length])
+        first = False
+        position += length
+    return b''.join(frames)
+
+
+def _frame_length(data, position):
+    b1, b2 = data[position + 1], data[position + 2]
+    if data[position] != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version = (b1 >> 3) & 3
+    layer = (b1 >> 1) & 3
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 3
+    # Solo Layer III (lo que devuelve Polly); índices libres o reservados no valen
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _BITRATES[version][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    samples = 144 if version == _MPEG1 else 72
+    return samples * bitrate // sample_rate + ((b2 >> 1) & 1)
+
+
+def _is_vbr_tag(data, position):
+    b1, b3 = data[position + 1], data[position + 3]
+    mono = b3 >> 6 == 3
+    if (b1 >> 3) & 3 == _MPEG1:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    offset = position + 4 + (0 if b1 & 1 else 2) + side_info
+    return (bytes(data[offset:offset + 4]) in _VBR_TAGS
+            or bytes(data[position + 36:position + 40]) == b'VBRI')
+
+
+def clean_segment(output_format, audio_data):
+    """Audio de un segmento listo para concatenarlo con otros del mismo formato"""
+    if output_format == 'mp3':
+        return mp3_frames(audio_data)
+    if output_format == 'pcm':
+        # Sin media muestra suelta que desplace las siguientes
+        return audio_data[:len(audio_data) - len(audio_data) % 2]
+    return audio_data
+
+
+def splice(output_format, segments):
+    """Une el audio de varios segmentos sintetizados con el mismo formato"""
+    if output_format not in SPLICEABLE_FORMATS:
+        raise ValueError(f"No se puede montar audio {output_format} por segmentos")
+    return b''.join(clean_segment(output_format, audio_data) for audio_data in segments)
+
+
+def spliced_cache_key(segment_keys):
+    """Clave de caché del audio montado con los segmentos de estas claves.
+
+    Distinta de cualquier clave de una síntesis completa: el audio montado no
+    es el que devolvería Polly para la respuesta entera."""
+    digest = hashlib.sha256(b'spliced\x00')
+    for key in segment_keys:
+        digest.update(key.encode('ascii'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
@@ -0,0 +1,141 @@
+"""Pre-síntesis (warm-up) de los mensajes fijos de la conversación.
+
+Sintetiza cada mensaje fijo una vez por motor de la cadena de fallback y deja
+el resultado en la caché de audio, de modo que el primer llamante después de
+un despliegue no espera a Polly.
+
+Uso desde la línea de comandos:
+
+    python warmup.py                # contra Amazon Polly (requiere credenciales)
+    python warmup.py --stub         # contra un Polly local de pruebas
+"""
+import argparse
+import fcntl
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from botocore.response import StreamingBody
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+
+# Trama MP3 (MPEG-1 Layer III, 128 kbps, 44.1 kHz) en silencio
+_MP3_FRAME_HEADER = b'\xff\xfb\x90\x64'
+_MP3_FRAME_SIZE = 417
+
+
+def silent_mp3(text):
+    """MP3 en silencio de duración proporcional al texto (una trama de 26 ms por cada 2 caracteres)"""
+    frames = max(1, len(text) // 2)
+    frame = _MP3_FRAME_HEADER + bytes(_MP3_FRAME_SIZE - len(_MP3_FRAME_HEADER))
+    return frame * frames
+
+
+class StubPolly:
+    """Sustituto local de Polly para pruebas: devuelve MP3 en silencio"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def synthesize_speech(self, **params):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        audio = silent_mp3(params.get('Text', ''))
+        return {
+            'AudioStream': StreamingBody(io.BytesIO(audio), len(audio)),
+            'ContentType': 'audio/mpeg',
+            'RequestCharacters': len(params.get('Text', ''))
+        }
+
+
+def warm_up(texts, synthesize, engines, max_workers=DEFAULT_WORKERS):
+    """Sintetiza cada texto con cada motor en un pool acotado de hilos.
+
+    synthesize(text, engine) debe devolver el audio (y guardarlo en caché).
+    Devuelve un resumen con los totales y el tiempo empleado."""
+    jobs = [(text, engine) for text in dict.fromkeys(texts) for engine in engines]
+    started = time.monotonic()
+    ok = 0
+    failed = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='warmup') as pool:
+        futures = {pool.submit(synthesize, text, engine): (text, engine) for text, engine in jobs}
+        for future in as_completed(futures):
+            text, engine = futures[future]
+            try:
+                future.result()
+                ok += 1
+            except Exception as e:
+                failed += 1
+                logger.warning(f"Warm-up falló con motor {engine} para '{text[:40]}...': {e}")
+
+    summary = {
+        'jobs': len(jobs),
+        'ok': ok,
+        'failed': failed,
+        'seconds': round(time.monotonic() - started, 3)
+    }
+    logger.info(f"Warm-up de audio terminado: {summary}")
+    return summary
+
+
+def start_background_warmup(run, lock_path=None):
+    """Ejecuta run() en un hilo daemon para no retrasar el arranque del worker.
+
+    Si se indica lock_path, solo un worker a la vez hace el warm-up; los demás
+    lo omiten y aprovechan el nivel de disco de la caché."""
+    def target():
+        lock_file = None
+        try:
+            if lock_path:
+                lock_file = open(lock_path, 'a')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    logger.info("Otro worker está haciendo el warm-up de audio, se omite")
+                    return
+            run()
+        except Exception as e:
+            logger.error(f"Error en warm-up de audio: {e}")
+        finally:
+            if lock_file:
+                lock_file.close()
+
+    thread = threading.Thread(target=target, name='audio-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-sintetiza los mensajes fijos de la conversación')
+    parser.add_argument('--stub', action='store_true', help='Usar un Polly local de pruebas')
+    parser.add_argument('--stub-latency', type=float, default=0.05, help='Latencia simulada del stub (s)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Tamaño del pool de hilos')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.stub and 'AUDIO_CACHE_DIR' not in os.environ:
+        # No mezclar audio falso con la caché real
+        os.environ['AUDIO_CACHE_DIR'] = os.path.join(tempfile.gettempdir(), 'sofia-audio-cache-stub')
+
+    import app as sofia
+
+    polly = StubPolly(latency=args.stub_latency) if args.stub else None
+    summary = sofia.warm_up_audio(polly=polly, max_workers=args.workers)
+    summary['cache'] = sofia.audio_cache.stats()
+    print(summary)
+
+
+if __name__ == '__main__':
+    main()